@@ -1,5 +1,6 @@
 from ._version import __version__
 from .pybna import pyBNA
 from .importer import Importer
+from .synthetic import SyntheticCity
 from .stress import Stress
 from .tests import *
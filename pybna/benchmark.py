@@ -0,0 +1,392 @@
+###################################################################
+# Scaling benchmarks for pyBNA using synthetic cities. Each pyBNA
+# stage is timed at several city sizes and the results are saved
+# as JSON so they can be compared across commits.
+###################################################################
+import os
+import json
+import time
+import datetime
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+from ._version import __version__
+from .synthetic import SyntheticCity
+from .stress import Stress
+from .pybna import pyBNA
+
+
+STAGES = [
+    "segment_stress",
+    "crossing_stress",
+    "build_network",
+    "calculate_connectivity",
+    "score",
+    "aggregate"
+]
+
+
+def run_benchmark(out_file=None,sizes=(10,20,40),config=None,engine=None,
+                  concurrency=None,seed=0,trace_memory=True,host=None,
+                  db_name=None,user=None,password=None,**city_options):
+    """
+    Generates a synthetic city at each size and runs the pyBNA stages on it,
+    recording the time and peak Python memory of each stage.
+
+    WARNING: this overwrites the tables named in the config file. Only run it
+    against a throwaway database.
+
+    Parameters
+    ----------
+    out_file : str, optional
+        path to save the results as JSON
+    sizes : list, optional
+        city sizes to test (number of blocks along each side)
+    config : str, optional
+        path to the config file, if not given use the default config.yaml
+    engine : str, optional
+        routing engine for calculate_connectivity
+    concurrency : int, optional
+        concurrency for calculate_connectivity
+    seed : int, optional
+        random seed for the synthetic cities
+    trace_memory : bool, optional
+        track peak memory with tracemalloc (this slows down code that runs
+        in Python, such as the in-process routing engine)
+    host : str, optional
+        host to connect to
+    db_name : str, optional
+        database name
+    user : str, optional
+        database user
+    password : str, optional
+        database password
+    **city_options
+        additional options for SyntheticCity.generate
+
+    Returns
+    -------
+    dict of results
+    """
+    db = {"host": host, "db_name": db_name, "user": user, "password": password}
+    results = {
+        "created": datetime.datetime.now().isoformat(),
+        "version": __version__,
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "options": {
+            "engine": engine,
+            "concurrency": concurrency,
+            "seed": seed,
+            "trace_memory": trace_memory,
+            "city": city_options
+        },
+        "runs": list()
+    }
+
+    for size in sizes:
+        print("Benchmarking synthetic city of size {}".format(size))
+        city = SyntheticCity(config=config,**db)
+        city.generate(size=size,seed=seed,overwrite=True,**city_options)
+        run = {
+            "size": size,
+            "stages": dict()
+        }
+
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            stress = _timed(run,"segment_stress",trace_memory,lambda: Stress(config=config,**db))
+            _timed(run,"segment_stress",trace_memory,stress.segment_stress)
+            _timed(run,"crossing_stress",trace_memory,stress.crossing_stress)
+            bna = _timed(run,"build_network",trace_memory,lambda: pyBNA(config=config,force_net_build=True,**db))
+            run["blocks"] = _count(bna,"blocks")
+            run["roads"] = _count(bna,"roads")
+            _timed(run,"calculate_connectivity",trace_memory,lambda: bna.calculate_connectivity(
+                concurrency=concurrency,
+                engine=engine
+            ))
+            _timed(run,"score",trace_memory,lambda: bna.score("benchmark_scores",overwrite=True))
+            _timed(run,"aggregate",trace_memory,lambda: bna.aggregate(
+                "benchmark_aggregate",
+                "benchmark_scores",
+                overwrite=True
+            ))
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        results["runs"].append(run)
+
+    if out_file is not None:
+        with open(out_file,"w") as f:
+            json.dump(results,f,indent=2)
+
+    print_benchmark(results)
+    return results
+
+
+def benchmark_scoring(bna,output_table="benchmark_scores",
+                      methods=(("sql","per_category"),("sql","single_pass"),("numpy","sparse")),
+                      repeat=1):
+    """
+    Times score() with each combination of engine and counting method on an
+    existing pyBNA object and checks that every method gives the same block
+    scores as the first one.
+
+    WARNING: this overwrites the output table and one table per method with
+    the method appended to its name.
+
+    Parameters
+    ----------
+    bna : pyBNA
+        pyBNA object with connectivity already calculated
+    output_table : str, optional
+        prefix of the score tables to create
+    methods : list, optional
+        (engine, counting) pairs to test. The first is the reference.
+    repeat : int, optional
+        number of times to run each method (the fastest run is reported)
+
+    Returns
+    -------
+    pandas DataFrame with the time of each method, its speedup over the
+    reference, and the number of blocks whose counts or scores differ from
+    the reference
+    """
+    results = list()
+    reference = None
+    for engine, counting in methods:
+        table = "{}_{}_{}".format(output_table,engine,counting)
+        times = list()
+        for i in range(repeat):
+            start = time.time()
+            bna.score(table,engine=engine,counting=counting,overwrite=True)
+            times.append(time.time() - start)
+        scores = _read_scores(bna,table)
+        if reference is None:
+            reference = scores
+        results.append({
+            "engine": engine,
+            "counting": counting,
+            "time": min(times),
+            "mismatches": _count_mismatches(reference,scores)
+        })
+
+    df = pd.DataFrame(results)
+    df["speedup"] = df["time"].iloc[0] / df["time"]
+    print(df.to_string(index=False))
+    return df
+
+
+def compare_benchmarks(baseline,current,threshold=0.1):
+    """
+    Compares two sets of benchmark results (e.g. from two commits) and prints
+    the change in time for each stage at each size.
+
+    Parameters
+    ----------
+    baseline : str or dict
+        path to a JSON file from run_benchmark (or the results themselves)
+    current : str or dict
+        path to a JSON file from run_benchmark (or the results themselves)
+    threshold : float, optional
+        relative slowdown above which a stage is reported as a regression
+
+    Returns
+    -------
+    list of (size, stage, ratio) for stages that regressed
+    """
+    if isinstance(baseline,str):
+        baseline = json.load(open(baseline))
+    if isinstance(current,str):
+        current = json.load(open(current))
+
+    base_runs = {r["size"]: r for r in baseline["runs"]}
+    regressions = list()
+    print("Comparing {} to {}".format(
+        baseline.get("commit") or baseline["created"],
+        current.get("commit") or current["created"]
+    ))
+    for run in current["runs"]:
+        if run["size"] not in base_runs:
+            continue
+        base = base_runs[run["size"]]
+        print("   size {}".format(run["size"]))
+        for stage in STAGES:
+            if stage not in run["stages"] or stage not in base["stages"]:
+                continue
+            old = base["stages"][stage]["time"]
+            new = run["stages"][stage]["time"]
+            ratio = new/old if old > 0 else float("inf")
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  <-- slower"
+                regressions.append((run["size"],stage,ratio))
+            print("      {:<24} {:>9.2f}s {:>9.2f}s {:>7.2f}x{}".format(
+                stage,old,new,ratio,flag
+            ))
+    return regressions
+
+
+def print_benchmark(results):
+    """
+    Prints a summary table of benchmark results
+
+    Parameters
+    ----------
+    results : str or dict
+        path to a JSON file from run_benchmark (or the results themselves)
+    """
+    if isinstance(results,str):
+        results = json.load(open(results))
+    for run in results["runs"]:
+        print("Size {} ({} blocks, {} roads)".format(
+            run["size"],
+            run.get("blocks"),
+            run.get("roads")
+        ))
+        for stage in STAGES:
+            if stage not in run["stages"]:
+                continue
+            stats = run["stages"][stage]
+            if stats["peak_memory"] is None:
+                memory = ""
+            else:
+                memory = "{:.1f} MB".format(stats["peak_memory"]/1024/1024)
+            print("   {:<24} {:>9.2f}s {:>12}".format(stage,stats["time"],memory))
+
+
+def _timed(run,stage,trace_memory,func):
+    """
+    Runs func and adds its time and peak memory to the stage in the run
+    results. Time and memory accumulate if the stage is timed more than once.
+
+    Parameters
+    ----------
+    run : dict
+        results for the run
+    stage : str
+        name of the stage
+    trace_memory : bool
+        whether tracemalloc is running
+    func : callable
+        function to run
+
+    returns:
+    the return value of func
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.time()
+    value = func()
+    elapsed = time.time() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+
+    stats = run["stages"].setdefault(stage,{"time": 0.0, "peak_memory": None})
+    stats["time"] += elapsed
+    if peak is not None:
+        stats["peak_memory"] = max(peak,stats["peak_memory"] or 0)
+    return value
+
+
+def _count(bna,name):
+    """
+    Counts rows in one of the input tables
+
+    Parameters
+    ----------
+    bna : pyBNA
+        pyBNA object
+    name : str
+        prefix of the table's substitutions (e.g. "blocks")
+
+    returns:
+    integer
+    """
+    conn = bna.get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        sql.SQL("SELECT COUNT(*) FROM {}.{}").format(
+            bna.sql_subs[name+"_schema"],
+            bna.sql_subs[name+"_table"]
+        )
+    )
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return count
+
+
+def _read_scores(bna,table):
+    """
+    Reads a score table into a DataFrame indexed by block id
+
+    Parameters
+    ----------
+    bna : pyBNA
+        pyBNA object
+    table : str
+        the score table
+
+    returns:
+    pandas DataFrame
+    """
+    schema, table = bna.parse_table_name(table)
+    if schema is None:
+        schema = bna.get_default_schema()
+    conn = bna.get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        sql.SQL("SELECT * FROM {}.{}").format(sql.Identifier(schema),sql.Identifier(table))
+    )
+    columns = [d[0] for d in cur.description]
+    df = pd.DataFrame(cur.fetchall(),columns=columns)
+    cur.close()
+    conn.close()
+    return df.set_index(bna.sql_subs["blocks_id_col"].string).sort_index()
+
+
+def _count_mismatches(reference,scores):
+    """
+    Counts the blocks whose values differ between two score tables (NULLs
+    match NULLs and floats are compared with a small tolerance)
+
+    Parameters
+    ----------
+    reference : pandas DataFrame
+        reference scores (see _read_scores)
+    scores : pandas DataFrame
+        scores to compare
+
+    returns:
+    integer
+    """
+    if not reference.index.equals(scores.index) or set(reference.columns) != set(scores.columns):
+        return max(len(reference),len(scores))
+    different = np.zeros(len(reference),dtype=bool)
+    for column in reference.columns:
+        a = reference[column].to_numpy(dtype=float,na_value=np.nan)
+        b = scores[column].to_numpy(dtype=float,na_value=np.nan)
+        different |= ~np.isclose(a,b,equal_nan=True)
+    return int(different.sum())
+
+
+def _git_commit():
+    """
+    Returns the current git commit of the pyBNA source (if it's in a git
+    repository)
+    """
+    try:
+        return subprocess.check_output(
+            ["git","rev-parse","HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
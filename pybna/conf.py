@@ -136,6 +136,11 @@ class Conf(DBUtils):
         else:
             edges_geom_col = "geom"
 
+        if "contracted_table" in network.edges:
+            edges_contracted_table = network.edges.contracted_table
+        else:
+            edges_contracted_table = edges_table + "_contracted"
+
         # nodes
         nodes_schema, nodes_table = self.parse_table_name(network.nodes.table)
         if nodes_schema is None:
@@ -206,6 +211,7 @@ class Conf(DBUtils):
             "edges_target_col": sql.Identifier(network.edges.target_column),
             "edges_stress_col": sql.Identifier(network.edges.stress_column),
             "edges_cost_col": sql.Identifier(network.edges.cost_column),
+            "edges_contracted_table": sql.Identifier(edges_contracted_table),
             "nodes_table": sql.Identifier(nodes_table),
             "nodes_schema": sql.Identifier(nodes_schema),
             "nodes_id_col": sql.Identifier(nodes_id_col),
@@ -217,7 +223,10 @@ class Conf(DBUtils):
             "connectivity_max_distance": sql.Literal(connectivity.max_distance),
             "connectivity_max_detour": sql.Literal(connectivity.max_detour),
             "connectivity_detour_agnostic_threshold": sql.Literal(connectivity.detour_agnostic_threshold),
-            "connectivity_max_stress": sql.Literal(connectivity.max_stress)
+            "connectivity_max_stress": sql.Literal(connectivity.max_stress),
+            "connectivity_band_select": sql.SQL(""),
+            "connectivity_band_columns": sql.SQL(""),
+            "connectivity_band_values": sql.SQL("")
         }
 
         return subs
@@ -1,11 +1,17 @@
-import os, string, warnings
+import os, string, warnings, hashlib
 warnings.simplefilter("always")
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from tqdm import tqdm
 import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 from .dbutils import DBUtils
+from .telemetry import ProgressTracker, phase
+from .routing import RoutingGraph, Router, ContractionHierarchy, NetworkSnapshot, HIGH_STRESS, contract_chains
 
 
 class Connectivity(DBUtils):
@@ -24,7 +30,9 @@ class Connectivity(DBUtils):
         self.db_connection_string = None
 
 
-    def build_network(self,skip_check=False,throw_error=False):
+    @phase("build_network")
+    def build_network(self,skip_check=False,throw_error=False,contract=False,
+                      snapshot=False):
         """
         Builds the network in the DB using details from the BNA config file.
 
@@ -34,6 +42,14 @@ class Connectivity(DBUtils):
             skips check for network issues
         throw_error : bool, optional
             throws an error rather than raising a warning if checks uncover issues
+        contract : bool, optional
+            also builds a contracted copy of the edges table with chains of
+            degree-2 nodes collapsed into single edges for use by the python
+            routing engine
+        snapshot : bool, optional
+            also writes a binary snapshot of the network to the directory given
+            by the snapshot setting in the config file (see
+            write_network_snapshot)
         """
         if self.verbose:
             print("Building network in database")
@@ -59,9 +75,141 @@ class Connectivity(DBUtils):
         print("Finishing up network")
         self._run_sql_script("cleanup.sql",subs,["sql","build_network"],conn=conn)
 
+        # a contracted network left over from a previous build is stale
+        if contract:
+            print("Contracting network")
+            self._build_contracted_network(subs,conn)
+        else:
+            self._run_sql("DROP TABLE IF EXISTS {edges_schema}.{edges_contracted_table}",subs,conn=conn)
+
         conn.commit()
         conn.close()
 
+        if snapshot:
+            self.write_network_snapshot()
+
+
+    def write_network_snapshot(self,path=None):
+        """
+        Writes a binary snapshot of the network that the python routing engine
+        memory-maps instead of querying the edges table. The snapshot holds
+        the network as compressed sparse row arrays along with the road ids
+        of each edge and node. It records a fingerprint of the edges table
+        and is ignored once the table changes.
+
+        Parameters
+        ----------
+        path : str, optional
+            directory to write to (if none use the snapshot setting in the
+            network section of the config file)
+        """
+        if path is None:
+            path = self.config.bna.network.get("snapshot")
+        if path is None:
+            raise ValueError("No path given for the network snapshot")
+
+        print("Writing network snapshot")
+        subs = dict(self.sql_subs)
+        conn = self.get_db_connection()
+        fingerprint = self.get_table_fingerprint(
+            subs["edges_table"].string,
+            subs["edges_schema"].string,
+            conn=conn
+        )
+        edges = self._run_sql_script("snapshot_edges.sql",subs,["sql","build_network"],ret=True,conn=conn)
+        nodes = self._run_sql_script("snapshot_nodes.sql",subs,["sql","build_network"],ret=True,conn=conn)
+        conn.rollback()
+        conn.close()
+
+        snapshot = NetworkSnapshot.from_rows(edges,nodes,fingerprint)
+        snapshot.save(path)
+        if self.verbose:
+            print("   {} written to {}".format(snapshot,path))
+
+
+    def _load_network_snapshot(self,conn=None):
+        """
+        Loads the network snapshot if one is configured and it matches the
+        current edges table
+
+        Parameters
+        ----------
+        conn : psycopg2 connection object, optional
+            a DB connection
+
+        returns:
+        NetworkSnapshot or None
+        """
+        path = self.config.bna.network.get("snapshot")
+        if path is None:
+            return None
+
+        fingerprint = self.get_table_fingerprint(
+            self.sql_subs["edges_table"].string,
+            self.sql_subs["edges_schema"].string,
+            conn=conn
+        )
+        snapshot = NetworkSnapshot.load(path,fingerprint)
+        if snapshot is None:
+            if os.path.isdir(path):
+                warnings.warn("Network snapshot at {} is missing or out of date and will not be used".format(path))
+        elif self.verbose:
+            print("   using network snapshot {}".format(path))
+        return snapshot
+
+
+    def _build_contracted_network(self,subs,conn):
+        """
+        Builds a copy of the edges table with chains of degree-2 nodes of the
+        same stress collapsed into single edges. Nodes attached to blocks are
+        always kept so block-to-block costs are unchanged. The table is saved
+        next to the edges table.
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        """
+        subs = dict(subs)
+        subs["contracted_index"] = sql.Identifier("idx_"+subs["edges_contracted_table"].string+"_source")
+
+        ret = self._run_sql_script("block_nodes.sql",subs,["sql","build_network"],ret=True,conn=conn)
+        keep_nodes = set(row[0] for row in ret)
+        edges = self._run_sql(
+            """
+                SELECT
+                    {edges_id_col},
+                    {edges_source_col},
+                    {edges_target_col},
+                    {edges_cost_col},
+                    {edges_stress_col}
+                FROM {edges_schema}.{edges_table}
+            """,
+            subs=subs,
+            ret=True,
+            conn=conn
+        )
+        contracted = contract_chains(edges,keep_nodes)
+        if self.verbose:
+            print("   {} edges contracted to {}".format(len(edges),len(contracted)))
+
+        self._run_sql_script("create_contracted_table.sql",subs,["sql","build_network"],conn=conn)
+        insert_sql = sql.SQL("""
+            INSERT INTO {edges_schema}.{edges_contracted_table} (
+                {edges_source_col},
+                {edges_target_col},
+                {edges_cost_col},
+                {edges_stress_col},
+                edge_ids
+            ) VALUES %s
+        """).format(**subs)
+        cur = conn.cursor()
+        execute_values(cur,insert_sql.as_string(conn),contracted)
+        cur.close()
+        self._run_sql_script("index_contracted_table.sql",subs,["sql","build_network"],conn=conn)
+
 
     def check_network(self):
         """
@@ -99,21 +247,57 @@ class Connectivity(DBUtils):
         return blocks
 
 
-    def _connectivity_table_create(self,overwrite=False):
+    def _connectivity_table_subs(self,table=None):
+        """
+        Returns a copy of the SQL substitutions with the connectivity table
+        replaced by the given table
+
+        Parameters
+        ----------
+        table : str, optional
+            table name (optionally schema-qualified). if none use the
+            connectivity table from the config file.
+        """
+        subs = dict(self.sql_subs)
+        if table is not None:
+            schema, table = self.parse_table_name(table)
+            if schema is None:
+                schema = self.get_default_schema()
+            subs["connectivity_schema"] = sql.Identifier(schema)
+            subs["connectivity_table"] = sql.Identifier(table)
+        return subs
+
+
+    def _connectivity_table_create(self,overwrite=False,table=None):
         """
         Creates the connectivity table in the database
+
+        Parameters
+        ----------
+        overwrite : bool, optional
+            drop the table first if it exists
+        table : str, optional
+            table to create (if none use the connectivity table from the config
+            file)
         """
+        if table is None:
+            table = self.db_connectivity_table
+        subs = self._connectivity_table_subs(table)
         conn = self.get_db_connection()
         cur = conn.cursor()
         if overwrite:
-            self.drop_table(self.db_connectivity_table,conn=conn)
+            self._drop_connectivity_table(
+                subs["connectivity_table"].string,
+                subs["connectivity_schema"].string,
+                conn=conn
+            )
         try:
-            self._run_sql_script("create_table.sql",self.sql_subs,["sql","connectivity"],conn=conn)
+            self._run_sql_script("create_table.sql",subs,["sql","connectivity"],conn=conn)
         except psycopg2.ProgrammingError:
             if conn.closed == 0:
                 conn.rollback()
                 conn.close()
-            raise ValueError("Table %s already exists" % self.config.bna.connectivity.table)
+            raise ValueError("Table %s already exists" % table)
         if conn.closed == 0:
             if not cur.closed:
                 cur.close()
@@ -121,11 +305,18 @@ class Connectivity(DBUtils):
             conn.close()
 
 
-    def _connectivity_table_drop_index(self):
+    def _connectivity_table_drop_index(self,table=None):
         # adapted from https://stackoverflow.com/questions/34010401/how-can-i-drop-all-indexes-of-a-table-in-postgres
         """
         Drops indexes on the connectivity table
+
+        Parameters
+        ----------
+        table : str, optional
+            the table (if none use the connectivity table from the config file)
         """
+        if table is None:
+            table = self.config.bna.connectivity.table
         conn = self.get_db_connection()
         cur = conn.cursor()
         cur.execute(sql.SQL("\
@@ -135,7 +326,7 @@ class Connectivity(DBUtils):
                 AND d.deptype = 'i' \
             WHERE  i.indrelid = {}::regclass \
             AND    d.objid IS NULL \
-        ").format(sql.Literal(self.config.bna.connectivity.table)))
+        ").format(sql.Literal(table)))
         for row in cur:
             if row[0] is None:
                 pass
@@ -149,20 +340,44 @@ class Connectivity(DBUtils):
         conn.close()
 
 
-    def _connectivity_table_create_index(self,overwrite=False):
+    def _connectivity_table_add_bands(self,table=None):
+        """
+        Adds the distance band columns to the connectivity table
+
+        Parameters
+        ----------
+        table : str, optional
+            the table (if none use the connectivity table from the config file)
+        """
+        if table is None:
+            table = self.db_connectivity_table
+        self._add_column(table,"high_stress_band","FLOAT")
+        self._add_column(table,"low_stress_band","FLOAT")
+
+
+    def _connectivity_table_create_index(self,overwrite=False,table=None):
         """
         Creates index on the connectivity table
+
+        Parameters
+        ----------
+        overwrite : bool, optional
+            drop existing indexes first
+        table : str, optional
+            the table (if none use the connectivity table from the config file)
         """
+        if table is None:
+            table = self.config.bna.connectivity.table
         # make a copy of sql substitutes
-        subs = dict(self.sql_subs)
-        s,t = self.parse_table_name(self.config.bna.connectivity.table)
+        subs = self._connectivity_table_subs(table)
+        s,t = self.parse_table_name(table)
         idx = "idx_" + t + "_low_stress"
         subs["connectivity_index"] = sql.Identifier(idx)
 
         conn = self.get_db_connection()
         cur = conn.cursor()
         if overwrite:
-            self._connectivity_table_drop_index()
+            self._connectivity_table_drop_index(table)
 
         cur.execute(sql.SQL(" \
             CREATE INDEX {connectivity_index} \
@@ -173,10 +388,12 @@ class Connectivity(DBUtils):
         cur.execute(sql.SQL("analyze {connectivity_schema}.{connectivity_table}").format(**subs));
 
 
+    @phase("connectivity")
     def _calculate_connectivity(self,scenario_id=None,origin_blocks=None,
                                 destination_blocks=None,network_filter=None,
                                 road_ids=None,append=False,subtract=False,
-                                dry=None):
+                                concurrency=None,engine=None,bands=None,
+                                connectivity_table=None,subs=None,dry=None):
         """
         Organizes and calls SQL scripts for calculating connectivity.
 
@@ -199,12 +416,38 @@ class Connectivity(DBUtils):
             (requires scenario_id) if true the calculated scores for
             the scenario are flagged as a subtraction of that scenario from the
             finished network
+        concurrency : int, optional
+            number of blocks to process at once, each on its own db connection
+            (if none or 1, blocks are processed one at a time)
+        engine : str, optional
+            routing engine, either "pgrouting" or "python" (if none use the
+            config file setting, defaulting to pgrouting)
+        bands : list, optional
+            distances at which to record connectivity. The search runs once
+            out to the largest band and the smallest band reached at high and
+            low stress is saved for each pair. (if none use the bands setting
+            in the config file, if any)
+        connectivity_table : str, optional
+            table to write connectivity to (if none use the connectivity table
+            from the config file)
+        subs : dict, optional
+            SQL substitutions to start from (if none use the config file).
+            Used to route between zones other than blocks.
         dry : str
             a path to save SQL statements to instead of executing in DB
         """
         if scenario_id is None and subtract:
             raise ValueError("Subtract flag can only be used with a scenario")
-        subs = dict(self.sql_subs)
+        if subs is None:
+            subs = dict(self.sql_subs)
+        else:
+            subs = dict(subs)
+        if connectivity_table is None:
+            connectivity_table = self.db_connectivity_table
+        else:
+            table_subs = self._connectivity_table_subs(connectivity_table)
+            subs["connectivity_schema"] = table_subs["connectivity_schema"]
+            subs["connectivity_table"] = table_subs["connectivity_table"]
         if scenario_id:
             subs["scenario_id"] = sql.Literal(scenario_id)
         else:
@@ -215,6 +458,11 @@ class Connectivity(DBUtils):
         else:
             subs["scenario_subtract"] = sql.SQL("NULL")
 
+        # the contracted network can't represent filters or flipped roads and
+        # the network snapshot can't represent filters
+        contracted = network_filter is None and road_ids is None
+        unfiltered = network_filter is None
+
         if network_filter is None:
             network_filter = "TRUE"
         subs["network_filter"] = sql.SQL(network_filter)
@@ -224,6 +472,25 @@ class Connectivity(DBUtils):
         else:
             subs["low_stress_road_ids"] = sql.Literal(road_ids)
 
+        # distance bands, searching out to the largest
+        if bands is None:
+            bands = self.config.bna.connectivity.get("bands")
+        if bands is None:
+            max_distance = self.config.bna.connectivity.max_distance
+        else:
+            bands = sorted(float(b) for b in bands)
+            if len(bands) == 0 or bands[0] <= 0:
+                raise ValueError("Distance bands must be a list of positive numbers")
+            max_distance = bands[-1]
+            subs["connectivity_max_distance"] = sql.Literal(max_distance)
+            subs["connectivity_bands"] = sql.Literal(bands)
+            subs["connectivity_band_select"] = sql.SQL("""
+                ,(SELECT MIN(band) FROM unnest({bands}::FLOAT[]) band WHERE hs_cost <= band) AS hs_band
+                ,(SELECT MIN(band) FROM unnest({bands}::FLOAT[]) band WHERE ls_cost <= band) AS ls_band
+            """).format(bands=subs["connectivity_bands"])
+            subs["connectivity_band_columns"] = sql.SQL(",high_stress_band,low_stress_band")
+            subs["connectivity_band_values"] = sql.SQL(",hs_band,ls_band")
+
         # check blocks
         if origin_blocks is None:
             origin_blocks = self._get_block_ids()
@@ -240,159 +507,849 @@ class Connectivity(DBUtils):
 
         # create db table or check existence if append mode set, drop index if append
         if not append and dry is None:
-            self._connectivity_table_create(overwrite=False)
+            self._connectivity_table_create(overwrite=False,table=connectivity_table)
         if append and dry is None:
-            if not self.table_exists(self.db_connectivity_table):
-                raise ValueError("table %s not found" % self.db_connectivity_table)
-            self._connectivity_table_drop_index()
+            if not self.table_exists(connectivity_table):
+                raise ValueError("table %s not found" % connectivity_table)
+            self._connectivity_table_drop_index(connectivity_table)
+        if bands is not None and dry is None:
+            self._connectivity_table_add_bands(connectivity_table)
+
+        # set up the routing engine
+        if engine is None:
+            engine = self.config.bna.connectivity.get("engine","pgrouting")
+        if engine == "pgrouting":
+            router = None
+        elif engine == "python":
+            router = self._get_router(
+                subs,
+                contracted=contracted,
+                snapshot=unfiltered,
+                road_ids=road_ids,
+                max_distance=max_distance
+            )
+        else:
+            raise ValueError("Unknown routing engine {}".format(engine))
+
+        try:
+            if concurrency is not None and concurrency > 1:
+                failed_blocks = self._run_async(self._connectivity_blocks_async(
+                    origin_blocks,subs,concurrency,scenario_id=scenario_id,
+                    router=router,dry=dry
+                ))
+            else:
+                failed_blocks = self._connectivity_blocks(
+                    origin_blocks,subs,scenario_id=scenario_id,router=router,dry=dry
+                )
+        finally:
+            # anything derived from the connectivity written here is now stale
+            if dry is None:
+                conn = self.get_db_connection()
+                if scenario_id is None:
+                    self._reset_connectivity_versions(subs,[],base=True,conn=conn)
+                else:
+                    self._reset_connectivity_versions(subs,[scenario_id],conn=conn)
+                conn.commit()
+                conn.close()
 
+        print("\n\n------------------------------------")
+        print("Process completed with {} failed units".format(len(failed_blocks)))
+        if len(failed_blocks) > 0:
+            print(failed_blocks)
+        if router is not None and router.cache is not None:
+            print("Routing cache: {}".format(router.cache))
+        print("------------------------------------\n")
+
+        if dry is None and not append:
+            self._connectivity_table_create_index(table=connectivity_table);
+
+
+    def _connectivity_blocks(self,origin_blocks,subs,scenario_id=None,
+                             router=None,dry=None):
+        """
+        Calculates connectivity for each origin block in turn on a new
+        connection per block.
+
+        Parameters
+        ----------
+        origin_blocks : list
+            list of block IDs to use as origins
+        subs : dict
+            SQL substitutions from the parent method
+        scenario_id
+            the id of the scenario for which connectivity is calculated
+        router : Router, optional
+            in-process routing engine (if none use pgRouting)
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+
+        returns:
+        list of block IDs that failed
+        """
         block_progress = tqdm(origin_blocks,smoothing=0.1)
+        tracker = ProgressTracker(len(origin_blocks))
         failed_blocks = list()
 
         for block_id in block_progress:
-            failure = False
             block_progress.set_description("Block id: "+str(block_id))
-            subs["block_id"] = sql.Literal(block_id)
-
+            start = time.time()
+            timings = dict()
+            rows = None
             conn = self.get_db_connection()
-            cur = conn.cursor()
-
-            # filter blocks
-            self._run_sql_script("10_filter_this_block.sql",subs,["sql","connectivity","calculation"],conn=conn)
-            self._run_sql_script("15_filter_other_blocks.sql",subs,["sql","connectivity","calculation"],conn=conn)
-            if scenario_id is not None:
-                self._run_sql_script("17_remove_ls_connections_for_scenario.sql",subs,["sql","connectivity","calculation"],conn=conn)
-            self._run_sql_script("20_assign_nodes_to_blocks.sql",subs,["sql","connectivity","calculation"],conn=conn)
-            self._run_sql_script("25_flip_low_stress.sql",subs,["sql","connectivity","calculation"],conn=conn)
-
-            # subset hs network
-            subs["max_stress"] = sql.Literal(99)
-            subs["net_table"] = sql.Identifier("tmp_hs_net")
-            if scenario_id is None:
-                self._run_sql_script("30_network_subset.sql",subs,["sql","connectivity","calculation"],conn=conn)
-
-                # get hs nodes
-                ret = self._run_sql("select distinct source from tmp_hs_net union select distinct target from tmp_hs_net",ret=True,conn=conn)
-                if dry is None:
-                    hs_nodes = set(n[0] for n in ret)
+            steps = self._connectivity_block_steps(block_id,subs,scenario_id,router,dry=dry)
+
+            result = None
+            failure = False
+            while True:
+                t = time.time()
+                try:
+                    q, ret, guarded, label = steps.send(result)
+                except StopIteration:
+                    break
+                finally:
+                    timings["python"] = timings.get("python",0.0) + time.time() - t
+                t = time.time()
+                cur = conn.cursor()
+                try:
+                    self._execute(cur,q,label)
+                except Exception as e:
+                    if conn.closed == 0:
+                        conn.rollback()
+                        conn.close()
+                    self._emit("block_failed",block_id=block_id,script=label,error=str(e))
+                    if not guarded:
+                        raise e
+                    failure = True
+                    break
+                if ret:
+                    result = cur.fetchall()
                 else:
-                    hs_nodes = {-1}
-            else:
-                hs_nodes = set()
+                    result = None
+                if label.startswith("80_insert"):
+                    rows = cur.rowcount
+                cur.close()
+                timings[label] = timings.get(label,0.0) + time.time() - t
+
+            if failure:
+                failed_blocks.append(block_id)
+                self._block_progress(tracker)
+                time.sleep(2)
+                continue
+
+            conn.commit()
+            conn.close()
+            self._block_progress(tracker,block_id,start,timings,rows)
+
+        return failed_blocks
+
+
+    def _block_progress(self,tracker,block_id=None,start=None,timings=None,
+                        rows=None):
+        """
+        Records a finished block and emits block and slowdown events
+
+        Parameters
+        ----------
+        tracker : telemetry.ProgressTracker
+            progress tracker for the run
+        block_id, optional
+            id of the block that finished (if none the block failed and no
+            block event is emitted)
+        start : float, optional
+            time the block started
+        timings : dict, optional
+            step label -> seconds spent
+        rows : int, optional
+            rows written to the connectivity table
+        """
+        progress = tracker.update()
+        slowdown = progress.pop("slowdown")
+        if block_id is not None:
+            self._emit(
+                "block",
+                block_id=block_id,
+                duration=time.time()-start,
+                scripts=timings,
+                rows=rows,
+                **progress
+            )
+        if slowdown:
+            self._emit("slowdown",rate=progress["rate"],recent_rate=progress["recent_rate"])
+
 
-            # subset ls network
-            subs["max_stress"] = sql.Literal(self.config.bna.connectivity.max_stress)
-            subs["net_table"] = sql.Identifier("tmp_ls_net")
-            self._run_sql_script("30_network_subset.sql",subs,["sql","connectivity","calculation"],conn=conn)
+    async def _connectivity_blocks_async(self,origin_blocks,subs,concurrency,
+                                         scenario_id=None,router=None,dry=None):
+        """
+        Calculates connectivity for the origin blocks with up to `concurrency`
+        blocks in flight at once, each on its own asynchronous connection. This
+        keeps the database busy with one block's network subset while another
+        block is being routed rather than waiting on the client between
+        scripts. With the python engine each block's routing runs on a worker
+        thread so it doesn't hold up the other blocks' database work. The
+        threads share the interpreter lock though, so routing several blocks
+        at once is no faster than routing them in turn.
+
+        Parameters
+        ----------
+        origin_blocks : list
+            list of block IDs to use as origins
+        subs : dict
+            SQL substitutions from the parent method
+        concurrency : int
+            number of blocks (and connections) to keep in flight
+        scenario_id
+            the id of the scenario for which connectivity is calculated
+        router : Router, optional
+            in-process routing engine (if none use pgRouting)
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+
+        returns:
+        list of block IDs that failed
+        """
+        queue = asyncio.Queue()
+        for block_id in origin_blocks:
+            queue.put_nowait(block_id)
+        block_progress = tqdm(total=len(origin_blocks),smoothing=0.1)
+        tracker = ProgressTracker(len(origin_blocks))
+        failed_blocks = list()
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency) if router is not None else None
 
-            # get ls nodes
-            ret = self._run_sql("select distinct source from tmp_ls_net union select distinct target from tmp_ls_net",ret=True,conn=conn)
+        def advance(steps,result):
+            # StopIteration can't be raised into a future
+            try:
+                return steps.send(result)
+            except StopIteration:
+                return None
+
+        async def worker():
+            conn = await self._get_async_db_connection()
+            try:
+                while not queue.empty():
+                    block_id = queue.get_nowait()
+                    block_progress.set_description("Block id: "+str(block_id))
+                    start = time.time()
+                    timings = dict()
+                    rows = None
+                    steps = self._connectivity_block_steps(block_id,subs,scenario_id,router,dry=dry)
+
+                    result = None
+                    failure = False
+                    while True:
+                        t = time.time()
+                        if executor is None:
+                            step = advance(steps,result)
+                        else:
+                            # routing is CPU bound, keep it off the event loop
+                            step = await loop.run_in_executor(executor,advance,steps,result)
+                        timings["python"] = timings.get("python",0.0) + time.time() - t
+                        if step is None:
+                            break
+                        q, ret, guarded, label = step
+                        t = time.time()
+                        try:
+                            out = await self._run_sql_async(q,conn,ret=ret)
+                        except psycopg2.Error as e:
+                            self._emit("block_failed",block_id=block_id,script=label,error=str(e))
+                            if not guarded:
+                                raise e
+                            # start over with a clean session
+                            failure = True
+                            failed_blocks.append(block_id)
+                            conn.close()
+                            await asyncio.sleep(2)
+                            conn = await self._get_async_db_connection()
+                            break
+                        if ret:
+                            result = out
+                            self._profile_record(label,time.time()-t,len(out))
+                        else:
+                            result = None
+                            self._profile_record(label,time.time()-t,out)
+                        if label.startswith("80_insert"):
+                            rows = out
+                        timings[label] = timings.get(label,0.0) + time.time() - t
+                    block_progress.update(1)
+                    if failure:
+                        self._block_progress(tracker)
+                    else:
+                        self._block_progress(tracker,block_id,start,timings,rows)
+            finally:
+                conn.close()
+
+        workers = [asyncio.ensure_future(worker()) for i in range(min(concurrency,len(origin_blocks)))]
+        try:
+            await asyncio.gather(*workers)
+        except Exception as e:
+            for w in workers:
+                w.cancel()
+            raise e
+        finally:
+            block_progress.close()
+            if executor is not None:
+                executor.shutdown()
+
+        return failed_blocks
+
+
+    def _connectivity_block_steps(self,block_id,subs,scenario_id=None,
+                                  router=None,costs_only=False,dry=None):
+        """
+        Generator that walks through the SQL scripts for calculating
+        connectivity from a single origin block. Each step is yielded as a
+        tuple of (query, ret, guarded, label) where query is a composed SQL
+        object, ret indicates that the rows produced by the query should be
+        sent back into the generator, guarded indicates that a failure should
+        mark the block as failed rather than halting the run, and label names
+        the step (the SQL script name where there is one) for timing. The caller is
+        responsible for executing the queries in order on a single connection.
+
+        Parameters
+        ----------
+        block_id
+            the id of the origin block
+        subs : dict
+            SQL substitutions from the parent method (not modified)
+        scenario_id
+            the id of the scenario for which connectivity is calculated
+        router : Router, optional
+            in-process routing engine (if none use pgRouting)
+        costs_only : bool, optional
+            stop once the cost tables are built without writing to the
+            connectivity table
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+        """
+        subs = dict(subs)
+        subs["block_id"] = sql.Literal(block_id)
+        calc_dirs = ["sql","connectivity","calculation"]
+
+        # filter blocks
+        yield self._compose_sql_script("10_filter_this_block.sql",subs,calc_dirs), False, False, "10_filter_this_block"
+        yield self._compose_sql_script("15_filter_other_blocks.sql",subs,calc_dirs), False, False, "15_filter_other_blocks"
+        if scenario_id is not None:
+            yield self._compose_sql_script("17_remove_ls_connections_for_scenario.sql",subs,calc_dirs), False, False, "17_remove_ls_connections_for_scenario"
+        yield self._compose_sql_script("20_assign_nodes_to_blocks.sql",subs,calc_dirs), False, False, "20_assign_nodes_to_blocks"
+
+        # get hs and ls block costs
+        if router is None:
+            yield from self._pgrouting_cost_steps(subs,scenario_id,dry)
+        else:
+            yield from self._router_cost_steps(subs,router,scenario_id,dry)
+        if costs_only:
+            return
+
+        # build combined cost table and write to connectivity table
+        yield self._compose_sql_script("70_combine_cost_matrices.sql",subs,calc_dirs), False, True, "70_combine_cost_matrices"
+        if "connectivity_bands" in subs:
+            yield self._compose_sql_script("75_connectivity_bands.sql",subs,calc_dirs), False, True, "75_connectivity_bands"
+        if scenario_id is None:
+            yield self._compose_sql_script("80_insert.sql",subs,calc_dirs), False, True, "80_insert"
+        else:
+            yield self._compose_sql_script("80_insert_with_scenario.sql",subs,calc_dirs), False, True, "80_insert_with_scenario"
+
+
+    def _pgrouting_cost_steps(self,subs,scenario_id=None,dry=None):
+        """
+        Generator of steps (see _connectivity_block_steps) that builds the
+        tmp_hs_cost_to_blocks and tmp_ls_cost_to_blocks tables by routing
+        with pgRouting on a subset of the network around the block. The subset
+        holds the edges within network_subset_distance of the block, which
+        defaults to connectivity_max_distance.
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions for this block (modified)
+        scenario_id
+            the id of the scenario for which connectivity is calculated
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+        """
+        calc_dirs = ["sql","connectivity","calculation"]
+        if "network_subset_distance" not in subs:
+            subs["network_subset_distance"] = subs["connectivity_max_distance"]
+        yield self._compose_sql_script("25_flip_low_stress.sql",subs,calc_dirs), False, False, "25_flip_low_stress"
+
+        # subset hs network
+        subs["max_stress"] = sql.Literal(99)
+        subs["net_table"] = sql.Identifier("tmp_hs_net")
+        if scenario_id is None:
+            yield self._compose_sql_script("30_network_subset.sql",subs,calc_dirs), False, False, "30_network_subset"
+
+            # get hs nodes
+            ret = yield sql.SQL("select distinct source from tmp_hs_net union select distinct target from tmp_hs_net"), True, False, "hs_nodes"
             if dry is None:
-                ls_nodes = set(n[0] for n in ret)
+                hs_nodes = set(n[0] for n in ret)
             else:
-                ls_nodes = {-1}
+                hs_nodes = {-1}
+        else:
+            hs_nodes = set()
 
-            # retrieve nodes for this block and loop through
-            ret = self._run_sql_script("35_this_block_nodes.sql",subs,["sql","connectivity","calculation"],ret=True,conn=conn)
-            if dry is not None:
-                ret = set()
+        # subset ls network
+        subs["max_stress"] = sql.Literal(self.config.bna.connectivity.max_stress)
+        subs["net_table"] = sql.Identifier("tmp_ls_net")
+        yield self._compose_sql_script("30_network_subset.sql",subs,calc_dirs), False, False, "30_network_subset"
 
-            if len(ret) <= 0:
-                node_ids = set()
-            else:
-                node_ids = ret[0][0]
-                if node_ids is None:
-                    node_ids = set()
-                else:
-                    node_ids = set(node_ids)
-            hs_node_ids = list(node_ids & hs_nodes)
-            ls_node_ids = list(node_ids & ls_nodes)
+        # get ls nodes
+        ret = yield sql.SQL("select distinct source from tmp_ls_net union select distinct target from tmp_ls_net"), True, False, "ls_nodes"
+        if dry is None:
+            ls_nodes = set(n[0] for n in ret)
+        else:
+            ls_nodes = {-1}
 
-            # get hs block costs
-            subs["node_ids"] = sql.Literal(hs_node_ids)
-            subs["net_table"] = sql.Identifier("tmp_hs_net")
-            subs["distance_table"] = sql.Identifier("tmp_hs_distance")
-            subs["cost_to_blocks"] = sql.Identifier("tmp_hs_cost_to_blocks")
+        # retrieve nodes for this block and loop through
+        node_ids = yield from self._this_block_node_steps(subs,dry)
+        hs_node_ids = list(node_ids & hs_nodes)
+        ls_node_ids = list(node_ids & ls_nodes)
 
-            if len(hs_node_ids) == 0 or scenario_id is not None:
-                cur2 = conn.cursor()
-                cur2.execute("create temp table tmp_hs_cost_to_blocks (id int, agg_cost float)")
-                cur2.close()
-            else:
-                try:
-                    self._run_sql_script("40_distance_table.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                except:
-                    failure = True
-                    failed_blocks.append(block_id)
-                    time.sleep(2)
-                    continue
+        # get hs block costs
+        subs["node_ids"] = sql.Literal(hs_node_ids)
+        subs["net_table"] = sql.Identifier("tmp_hs_net")
+        subs["distance_table"] = sql.Identifier("tmp_hs_distance")
+        subs["cost_to_blocks"] = sql.Identifier("tmp_hs_cost_to_blocks")
 
-                try:
-                    self._run_sql_script("60_cost_to_blocks.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                except:
-                    failure = True
-                    failed_blocks.append(block_id)
-                    time.sleep(2)
-                    continue
+        if len(hs_node_ids) == 0 or scenario_id is not None:
+            yield self._cost_to_blocks_sql("tmp_hs_cost_to_blocks",dict(),subs), False, False, "cost_to_blocks"
+        else:
+            yield self._compose_sql_script("40_distance_table.sql",subs,calc_dirs), False, True, "40_distance_table"
+            yield self._compose_sql_script("60_cost_to_blocks.sql",subs,calc_dirs), False, True, "60_cost_to_blocks"
 
-            # get ls block costs
-            subs["node_ids"] = sql.Literal(ls_node_ids)
-            subs["net_table"] = sql.Identifier("tmp_ls_net")
-            subs["distance_table"] = sql.Identifier("tmp_ls_distance")
-            subs["cost_to_blocks"] = sql.Identifier("tmp_ls_cost_to_blocks")
+        # get ls block costs
+        subs["node_ids"] = sql.Literal(ls_node_ids)
+        subs["net_table"] = sql.Identifier("tmp_ls_net")
+        subs["distance_table"] = sql.Identifier("tmp_ls_distance")
+        subs["cost_to_blocks"] = sql.Identifier("tmp_ls_cost_to_blocks")
 
-            if len(ls_node_ids) == 0:
-                cur2 = conn.cursor()
-                cur2.execute("create temp table tmp_ls_cost_to_blocks (id int, agg_cost float)")
-                cur2.close()
+        if len(ls_node_ids) == 0:
+            yield self._cost_to_blocks_sql("tmp_ls_cost_to_blocks",dict(),subs), False, False, "cost_to_blocks"
+        else:
+            yield self._compose_sql_script("40_distance_table.sql",subs,calc_dirs), False, True, "40_distance_table"
+            yield self._compose_sql_script("60_cost_to_blocks.sql",subs,calc_dirs), False, True, "60_cost_to_blocks"
+
+
+    def _router_cost_steps(self,subs,router,scenario_id=None,dry=None):
+        """
+        Generator of steps (see _connectivity_block_steps) that builds the
+        tmp_hs_cost_to_blocks and tmp_ls_cost_to_blocks tables by routing
+        with the in-process routing engine.
+
+        Unlike pgRouting, which only sees the edges within
+        connectivity_max_distance of the block (30_network_subset.sql), the
+        search runs on the whole network and is bounded only by cost. Routes
+        start at the middle of each road touching the block, which for a long
+        road can be well outside the block, and edge costs are rounded, so a
+        route within the cost limit can use edges beyond that radius. Those
+        routes are found here and not by pgRouting, so pairs near the edge of
+        the search distance can differ between the engines.
+        test_connectivity_engines compares this engine with pgRouting on a
+        subset wide enough to hold every such route.
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions for this block
+        router : Router
+            in-process routing engine
+        scenario_id
+            the id of the scenario for which connectivity is calculated
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+        """
+        node_ids = yield from self._this_block_node_steps(subs,dry)
+        blocks_nodes = yield sql.SQL("select id, node_id from tmp_blocks_nodes"), True, False, "blocks_nodes"
+        if dry is not None:
+            blocks_nodes = list()
+
+        hs_costs, ls_costs = router.costs(
+            node_ids,
+            blocks_nodes,
+            high_stress=(scenario_id is None)
+        )
+
+        yield self._cost_to_blocks_sql("tmp_hs_cost_to_blocks",hs_costs,subs), False, True, "cost_to_blocks"
+        yield self._cost_to_blocks_sql("tmp_ls_cost_to_blocks",ls_costs,subs), False, True, "cost_to_blocks"
+
+
+    def _this_block_node_steps(self,subs,dry=None):
+        """
+        Generator of steps (see _connectivity_block_steps) that retrieves the
+        network nodes associated with the origin block. Returns a set of node
+        ids.
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions for this block
+        dry : str
+            a path to save SQL statements to instead of executing in DB
+        """
+        ret = yield self._compose_sql_script("35_this_block_nodes.sql",subs,["sql","connectivity","calculation"]), True, False, "35_this_block_nodes"
+        if dry is not None:
+            ret = set()
+
+        if len(ret) <= 0:
+            return set()
+        node_ids = ret[0][0]
+        if node_ids is None:
+            return set()
+        return set(node_ids)
+
+
+    def _cost_to_blocks_sql(self,table,costs,subs):
+        """
+        Returns SQL to (re)create a temporary table of costs to each block
+
+        Parameters
+        ----------
+        table : str
+            name of the temporary table
+        costs : dict
+            block id -> cost
+        subs : dict
+            SQL substitutions
+
+        returns:
+        a composed psycopg2 SQL object
+        """
+        q = sql.SQL("""
+            DROP TABLE IF EXISTS {table};
+            CREATE TEMP TABLE {table} (id {blocks_id_type}, agg_cost FLOAT);
+        """).format(table=sql.Identifier(table),blocks_id_type=subs["blocks_id_type"])
+        if len(costs) > 0:
+            values = sql.SQL(",").join([
+                sql.SQL("({},{})").format(sql.Literal(block_id),sql.Literal(cost))
+                for block_id, cost in costs.items()
+            ])
+            q += sql.SQL("INSERT INTO {table} (id, agg_cost) VALUES {values};").format(
+                table=sql.Identifier(table),
+                values=values
+            )
+        return q
+
+
+    def _get_routing_graph(self,subs,contracted=False,snapshot=False,
+                           road_ids=None,conn=None):
+        """
+        Loads the network into memory as a RoutingGraph
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions from the parent method (low_stress_road_ids and
+            network_filter are applied to the network)
+        contracted : bool, optional
+            load the contracted network if one was saved by build_network
+            (only valid without a network filter or flipped roads)
+        snapshot : bool, optional
+            load the network snapshot if a valid one exists (only valid without
+            a network filter)
+        road_ids : list, optional
+            list of road_ids to be flipped to low stress (must match
+            low_stress_road_ids in subs)
+        conn : psycopg2 connection object, optional
+            a DB connection
+
+        returns:
+        RoutingGraph
+        """
+        close_conn = False
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+
+        if self.verbose:
+            print("Loading network for routing")
+        if contracted and self.table_exists(subs["edges_contracted_table"].string,subs["edges_schema"].string):
+            if self.verbose:
+                print("   using contracted network")
+            graph = RoutingGraph.from_edges(
+                self._run_sql_script("routing_edges_contracted.sql",subs,["sql","connectivity"],ret=True,conn=conn)
+            )
+        else:
+            network_snapshot = None
+            if snapshot:
+                network_snapshot = self._load_network_snapshot(conn=conn)
+            if network_snapshot is None:
+                self._run_sql_script("25_flip_low_stress.sql",subs,["sql","connectivity","calculation"],conn=conn)
+                graph = RoutingGraph.from_edges(
+                    self._run_sql_script("routing_edges.sql",subs,["sql","connectivity"],ret=True,conn=conn)
+                )
+            elif road_ids is None:
+                graph = network_snapshot.graph
             else:
-                try:
-                    self._run_sql_script("40_distance_table.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                except:
-                    failure = True
-                    failed_blocks.append(block_id)
-                    time.sleep(2)
-                    continue
+                graph = network_snapshot.flip_stress(road_ids,self.config.bna.connectivity.max_stress)
+        if self.verbose:
+            print(graph)
 
-                try:
-                    self._run_sql_script("60_cost_to_blocks.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                except:
-                    failure = True
-                    failed_blocks.append(block_id)
-                    time.sleep(2)
-                    continue
+        if close_conn:
+            conn.rollback()
+            conn.close()
 
-            # build combined cost table and write to connectivity table
-            try:
-                self._run_sql_script("70_combine_cost_matrices.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                if scenario_id is None:
-                    self._run_sql_script("80_insert.sql",subs,["sql","connectivity","calculation"],conn=conn)
-                else:
-                    self._run_sql_script("80_insert_with_scenario.sql",subs,["sql","connectivity","calculation"],conn=conn)
-            except:
-                failure = True
-                failed_blocks.append(block_id)
-                time.sleep(2)
+        return graph
+
+
+    def _get_router(self,subs,contracted=False,snapshot=False,road_ids=None,
+                    max_distance=None,conn=None):
+        """
+        Loads the network into memory and returns an in-process routing engine.
+        Contraction hierarchies saved by build_routing_hierarchy are used if
+        they are valid for the network.
+
+        Parameters
+        ----------
+        subs : dict
+            SQL substitutions from the parent method (low_stress_road_ids and
+            network_filter are applied to the network)
+        contracted : bool, optional
+            load the contracted network if one was saved by build_network
+            (only valid without a network filter or flipped roads)
+        snapshot : bool, optional
+            load the network snapshot if a valid one exists (only valid without
+            a network filter)
+        road_ids : list, optional
+            list of road_ids to be flipped to low stress (must match
+            low_stress_road_ids in subs)
+        max_distance : float, optional
+            the maximum distance to search (if none use the config file)
+        conn : psycopg2 connection object, optional
+            a DB connection
+
+        returns:
+        Router
+        """
+        graph = self._get_routing_graph(
+            subs,
+            contracted=contracted,
+            snapshot=snapshot,
+            road_ids=road_ids,
+            conn=conn
+        )
+        connectivity = self.config.bna.connectivity
+        if max_distance is None:
+            max_distance = connectivity.max_distance
+        if contracted:
+            hierarchies = self._load_routing_hierarchies(graph,max_distance)
+        else:
+            hierarchies = None
+
+        return Router(
+            graph,
+            max_distance=max_distance,
+            max_stress=connectivity.max_stress,
+            max_detour=connectivity.max_detour,
+            detour_agnostic_threshold=connectivity.detour_agnostic_threshold,
+            early_termination=connectivity.get("early_termination",True),
+            cache_size=connectivity.get("cache_size",None),
+            hierarchies=hierarchies
+        )
+
+
+    def _routing_hierarchy_path(self,path,max_stress):
+        """
+        Returns the file name for the hierarchy of the given stress level
+
+        Parameters
+        ----------
+        path : str
+            directory holding the hierarchy files
+        max_stress : int
+            the highest stress included in the hierarchy
+        """
+        return os.path.join(path,"stress_{}.npz".format(max_stress))
+
+
+    def build_routing_hierarchy(self,path=None,witness_limit=100):
+        """
+        Builds contraction hierarchies over the network for the high stress
+        and low stress thresholds and saves them to disk for use by the python
+        routing engine. Hierarchies are only used for base connectivity runs
+        without a network filter and must be rebuilt if the network changes.
+
+        Parameters
+        ----------
+        path : str, optional
+            directory to save the hierarchies to (if none use the hierarchy
+            setting from the config file)
+        witness_limit : int, optional
+            number of nodes settled in each witness search during
+            preprocessing
+
+        returns:
+        dict of max stress -> preprocessing time in seconds
+        """
+        if path is None:
+            path = self.config.bna.connectivity.get("hierarchy")
+        if path is None:
+            raise ValueError("No path given for the routing hierarchy")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        subs = dict(self.sql_subs)
+        subs["network_filter"] = sql.SQL("TRUE")
+        subs["low_stress_road_ids"] = sql.SQL("NULL")
+        graph = self._get_routing_graph(subs,contracted=True,snapshot=True)
+
+        connectivity = self.config.bna.connectivity
+        build_times = dict()
+        for max_stress in (connectivity.max_stress,HIGH_STRESS):
+            print("Building routing hierarchy for stress {}".format(max_stress))
+            meta = {"max_stress": max_stress, "graph": graph.fingerprint()}
+            hierarchy = ContractionHierarchy.from_adjacency(
+                graph.adjacency(max_stress),
+                max(connectivity.get("bands") or [connectivity.max_distance]),
+                witness_limit=witness_limit,
+                meta=meta
+            )
+            hierarchy.save(self._routing_hierarchy_path(path,max_stress))
+            build_times[max_stress] = hierarchy.meta["build_time"]
+            if self.verbose:
+                print("   {} in {:.1f} seconds".format(hierarchy,build_times[max_stress]))
+
+        return build_times
+
+
+    def _load_routing_hierarchies(self,graph,max_distance):
+        """
+        Loads the hierarchies saved by build_routing_hierarchy, skipping any
+        that were built for a different network or a shorter max distance.
+
+        Parameters
+        ----------
+        graph : RoutingGraph
+            the network being routed on
+        max_distance : float
+            the maximum distance that will be searched
+
+        returns:
+        dict of max stress -> ContractionHierarchy
+        """
+        connectivity = self.config.bna.connectivity
+        path = connectivity.get("hierarchy")
+        hierarchies = dict()
+        if path is None:
+            return hierarchies
+
+        fingerprint = graph.fingerprint()
+        for max_stress in (connectivity.max_stress,HIGH_STRESS):
+            fname = self._routing_hierarchy_path(path,max_stress)
+            if not os.path.isfile(fname):
                 continue
+            hierarchy = ContractionHierarchy.load(fname)
+            if hierarchy.meta.get("graph") != fingerprint:
+                warnings.warn("Routing hierarchy {} is out of date and will not be used".format(fname))
+                continue
+            if hierarchy.max_cost < max_distance:
+                warnings.warn("Routing hierarchy {} was built for a shorter max_distance and will not be used".format(fname))
+                continue
+            if self.verbose:
+                print("   using routing hierarchy {}".format(fname))
+            hierarchies[max_stress] = hierarchy
 
-            cur.close()
-            conn.commit()
-            conn.close()
+        return hierarchies
+
+
+    def benchmark_routing(self,origin_blocks=None,sample=25,seed=None):
+        """
+        Times the routing for a sample of origin blocks on each available
+        engine: pgRouting, the python engine with Dijkstra searches, and the
+        python engine with contraction hierarchies (if they've been built).
+        Nothing is written to the connectivity table.
+
+        Parameters
+        ----------
+        origin_blocks : list, optional
+            list of block IDs to time (if none take a random sample of blocks)
+        sample : int, optional
+            number of blocks to sample if origin_blocks isn't given
+        seed : int, optional
+            seed for the random sample
+
+        returns:
+        dict of engine -> dict of timing statistics in seconds
+        """
+        if origin_blocks is None:
+            block_ids = self._get_block_ids()
+            origin_blocks = random.Random(seed).sample(block_ids,min(sample,len(block_ids)))
+        if len(origin_blocks) == 0:
+            raise ValueError("No blocks to time")
+
+        subs = dict(self.sql_subs)
+        subs["scenario_id"] = sql.SQL("NULL")
+        subs["scenario_subtract"] = sql.SQL("NULL")
+        subs["network_filter"] = sql.SQL("TRUE")
+        subs["low_stress_road_ids"] = sql.SQL("NULL")
+        subs["destination_blocks_filter"] = sql.SQL("TRUE")
+
+        router = self._get_router(subs,contracted=True,snapshot=True)
+        engines = [
+            ("pgrouting",None),
+            ("dijkstra",Router(
+                router.graph,
+                router.max_distance,
+                router.max_stress,
+                router.max_detour,
+                router.detour_agnostic_threshold,
+                early_termination=router.early_termination
+            ))
+        ]
+        if len(router.hierarchies) > 0:
+            engines.append(("hierarchy",router))
+
+        results = dict()
+        for engine, engine_router in engines:
+            times = list()
+            for block_id in tqdm(origin_blocks,desc=engine):
+                conn = self.get_db_connection()
+                cur = conn.cursor()
+                steps = self._connectivity_block_steps(block_id,subs,router=engine_router,costs_only=True)
+                start = time.time()
+                result = None
+                while True:
+                    try:
+                        q, ret, guarded, label = steps.send(result)
+                    except StopIteration:
+                        break
+                    cur.execute(q)
+                    if ret:
+                        result = cur.fetchall()
+                    else:
+                        result = None
+                times.append(time.time() - start)
+                cur.close()
+                conn.rollback()
+                conn.close()
+
+            times = sorted(times)
+            results[engine] = {
+                "blocks": len(times),
+                "mean": sum(times)/len(times),
+                "median": times[len(times)//2],
+                "max": times[-1]
+            }
+        for max_stress, hierarchy in router.hierarchies.items():
+            results["hierarchy"]["preprocessing_stress_{}".format(max_stress)] = hierarchy.meta["build_time"]
 
         print("\n\n------------------------------------")
-        print("Process completed with {} failed units".format(len(failed_blocks)))
-        if len(failed_blocks) > 0:
-            print(failed_blocks)
+        print("Per-origin routing time (seconds)")
+        for engine, stats in results.items():
+            print("{:<10}  mean {:.3f}  |  median {:.3f}  |  max {:.3f}".format(
+                engine,stats["mean"],stats["median"],stats["max"]
+            ))
+        for max_stress, hierarchy in router.hierarchies.items():
+            print("Hierarchy preprocessing for stress {}: {:.1f} seconds".format(max_stress,hierarchy.meta["build_time"]))
         print("------------------------------------\n")
 
-        if dry is None and not append:
-            self._connectivity_table_create_index();
+        return results
 
 
     def drop_scenario(self,scenario_ids=None,conn=None):
         """
-        Removes the scenario(s) from the connectivity table. If no scenario_id
-        is given, remove all scenarios.
+        Removes the scenario(s) from the connectivity table, along with any
+        materialized connectivity for them (see
+        materialize_scenario_connectivity). If no scenario_id is given, remove
+        all scenarios.
 
         Parameters
         ----------
@@ -432,16 +1389,335 @@ class Connectivity(DBUtils):
                     subs=subs,
                     conn=conn
                 )
+        self._drop_scenario_views(scenario_ids,conn)
+        self._reset_connectivity_versions(subs,scenario_ids,conn=conn)
 
         if close_conn:
             conn.commit()
             conn.close()
 
 
+    def materialize_scenario_connectivity(self,scenario_ids,subtract=False):
+        """
+        Creates (or refreshes) materialized views of the resolved connectivity
+        for the given scenarios, i.e. the base connectivity with the
+        scenario's rows substituted in. score() and travel_sheds() use these
+        views instead of resolving the scenario on every call when
+        materialize_scenarios is set in the connectivity section of the
+        config (views are otherwise created the first time a scenario is
+        used). The views are saved to the cache_schema from the config, or the
+        schema of the connectivity table if none is given, and dropped by
+        drop_scenario().
+
+        Parameters
+        ----------
+        scenario_ids : list
+            list of scenarios
+        subtract : bool, optional
+            materialize the connectivity with the scenario subtracted
+        """
+        if not hasattr(scenario_ids,"__iter__") or isinstance(scenario_ids,str):
+            scenario_ids = [scenario_ids]
+        conn = self.get_db_connection()
+        for scenario_id in scenario_ids:
+            print("Materializing connectivity for scenario {}".format(scenario_id))
+            subs = dict(self.sql_subs)
+            self._scenario_view_subs(subs,scenario_id,subtract)
+            subs["connectivity_version"] = sql.Literal(self._connectivity_version(subs,scenario_id,conn=conn))
+            self._run_sql_script("scenario_connectivity_registry.sql",subs,["sql","scenarios"],conn=conn)
+            self._run_sql_script("materialize_scenario.sql",subs,["sql","scenarios"],conn=conn)
+        conn.commit()
+        conn.close()
+
+
+    def _load_connectivity(self,subs,scenario_id=None,subtract=False,conn=None):
+        """
+        Creates pg_temp.tmp_connectivity holding the connectivity for the base
+        condition or for a scenario. With materialize_scenarios set in the
+        config, a scenario's connectivity is read from its materialized view
+        (which is created if it doesn't exist yet).
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes (scenario_where for the base condition)
+        scenario_id : optional
+            the scenario (none for the base condition)
+        subtract : bool, optional
+            whether the scenario is subtracted
+        conn : psycopg2 connection object
+            a DB connection
+        """
+        if scenario_id is None:
+            self._run_sql_script("01_connectivity_table.sql",subs,["sql","scenarios"],conn=conn)
+        elif self.config.bna.connectivity.get("materialize_scenarios"):
+            self._scenario_view_subs(subs,scenario_id,subtract)
+            subs["connectivity_version"] = sql.Literal(self._connectivity_version(subs,scenario_id,conn=conn))
+            self._run_sql_script("scenario_connectivity_registry.sql",subs,["sql","scenarios"],conn=conn)
+            exists = self._run_sql("""
+                SELECT 1
+                FROM {cache_schema}.scenario_connectivity registry
+                WHERE
+                    scenario = {scenario_text}
+                    AND subtract = {subtract}
+                    AND connectivity = {connectivity_version}
+                    AND EXISTS (
+                        SELECT 1
+                        FROM pg_matviews
+                        WHERE
+                            schemaname = {cache_schema_name}
+                            AND matviewname = registry.view_name
+                    )
+            """,subs,ret=True,conn=conn)
+            if len(exists) == 0:
+                print("Materializing connectivity for scenario {}".format(scenario_id))
+                self._run_sql_script("materialize_scenario.sql",subs,["sql","scenarios"],conn=conn)
+            subs["resolved_schema"] = subs["cache_schema"]
+            subs["resolved_table"] = subs["scenario_view"]
+            self._run_sql_script("01_connectivity_view.sql",subs,["sql","scenarios"],conn=conn)
+        elif subtract:
+            self._run_sql_script("01_connectivity_table_scenario_subtract.sql",subs,["sql","scenarios"],conn=conn)
+        else:
+            self._run_sql_script("01_connectivity_table_scenario.sql",subs,["sql","scenarios"],conn=conn)
+
+
+    def _scenario_view_subs(self,subs,scenario_id,subtract):
+        """
+        Adds the sql substitutes for a scenario's materialized connectivity
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes (updated in place)
+        scenario_id
+            the scenario
+        subtract : bool
+            whether the scenario is subtracted
+        """
+        cache_schema = self._connectivity_cache_schema()
+        # scenario ids can be any value so the view is named with a hash
+        view = "scenario_connectivity_" + hashlib.md5(
+            "{}|{}".format(scenario_id,bool(subtract)).encode()
+        ).hexdigest()[:12]
+        subs["cache_schema"] = sql.Identifier(cache_schema)
+        subs["cache_schema_name"] = sql.Literal(cache_schema)
+        subs["scenario_id"] = sql.Literal(scenario_id)
+        subs["scenario_text"] = sql.Literal(str(scenario_id))
+        subs["subtract"] = sql.Literal(bool(subtract))
+        subs["scenario_view"] = sql.Identifier(view)
+        subs["scenario_view_name"] = sql.Literal(view)
+        subs["scenario_view_index"] = sql.Identifier("idx_" + view)
+        if subtract:
+            subs["scenario_filter"] = sql.SQL("(scenario = {scenario_id} AND subtract) OR scenario IS NULL").format(**subs)
+        else:
+            subs["scenario_filter"] = sql.SQL("scenario = {scenario_id} OR scenario IS NULL").format(**subs)
+
+
+    def _connectivity_cache_schema(self):
+        """
+        Returns the schema holding materialized scenarios and connectivity
+        versions: the cache_schema from the config, or the schema of the
+        connectivity table if none is given
+        """
+        cache_schema = self.config.bna.get("cache_schema")
+        if cache_schema is None:
+            cache_schema = self.sql_subs["connectivity_schema"].string
+        return cache_schema
+
+
+    def _connectivity_version_subs(self,subs,conn):
+        """
+        Returns sql substitutes for the connectivity versions of the
+        connectivity table in subs
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes (connectivity_schema and connectivity_table)
+        conn : psycopg2 connection object
+            a DB connection
+
+        returns:
+        dict
+        """
+        cache_schema = self._connectivity_cache_schema()
+        return {
+            "cache_schema": sql.Identifier(cache_schema),
+            "versions_table": sql.Literal(
+                sql.SQL("{}.connectivity_versions").format(sql.Identifier(cache_schema)).as_string(conn)
+            ),
+            "connectivity_name": sql.Literal(
+                sql.SQL("{connectivity_schema}.{connectivity_table}").format(**subs).as_string(conn)
+            )
+        }
+
+
+    def _connectivity_version(self,subs,scenario_id=None,conn=None):
+        """
+        Returns the version of the base connectivity in the connectivity table
+        or, for a scenario, of the base and scenario connectivity together. A
+        version stays the same until pyBNA recalculates or drops that
+        connectivity (see _reset_connectivity_versions) or the table is
+        rebuilt, so connectivity derived from it can be checked without
+        reading the table.
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes (connectivity_schema and connectivity_table)
+        scenario_id : optional
+            the scenario (none for the base condition)
+        conn : psycopg2 connection object
+            a DB connection
+
+        returns:
+        str
+        """
+        version_subs = self._connectivity_version_subs(subs,conn)
+        scopes = ["base"]
+        if scenario_id is not None:
+            scopes.append("scenario:" + str(scenario_id))
+
+        versions = list()
+        for scope in scopes:
+            version_subs["version_scope"] = sql.Literal(scope)
+            self._run_sql_script("connectivity_versions.sql",version_subs,["sql","scenarios"],conn=conn)
+            versions.append(self._run_sql("""
+                SELECT COALESCE(to_regclass(connectivity)::OID::TEXT,'') || ':' || version
+                FROM {cache_schema}.connectivity_versions
+                WHERE
+                    connectivity = {connectivity_name}
+                    AND scope = {version_scope}
+            """,version_subs,ret=True,conn=conn)[0][0])
+        return "|".join(versions)
+
+
+    def _reset_connectivity_versions(self,subs,scenario_ids=None,base=False,conn=None):
+        """
+        Discards connectivity versions (see _connectivity_version) after the
+        connectivity they describe has changed. New versions are issued the
+        next time they're read.
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes (connectivity_schema and connectivity_table)
+        scenario_ids : list, optional
+            list of scenarios (if none all scenarios)
+        base : bool, optional
+            also discard the version of the base connectivity, which every
+            scenario's connectivity includes
+        conn : psycopg2 connection object
+            a DB connection
+        """
+        version_subs = self._connectivity_version_subs(subs,conn)
+        exists = self._run_sql(
+            "SELECT to_regclass({versions_table})",
+            version_subs,
+            ret=True,
+            conn=conn
+        )[0][0]
+        if exists is None:
+            return
+
+        if scenario_ids is None:
+            scope_where = [sql.SQL("scope LIKE 'scenario:%'")]
+        else:
+            scope_where = [sql.SQL("scope = ANY({})").format(
+                sql.Literal(["scenario:" + str(s) for s in scenario_ids])
+            )]
+        if base:
+            scope_where.append(sql.SQL("scope = 'base'"))
+        version_subs["scope_where"] = sql.SQL(" OR ").join(scope_where)
+        self._run_sql("""
+            DELETE FROM {cache_schema}.connectivity_versions
+            WHERE
+                connectivity = {connectivity_name}
+                AND ({scope_where})
+        """,version_subs,conn=conn)
+
+
+    def _drop_connectivity_table(self,table,schema=None,conn=None):
+        """
+        Drops a connectivity table along with any materialized scenario
+        connectivity (the views depend on the table they're built from, so the
+        table can't be dropped while they exist)
+
+        Parameters
+        ----------
+        table : str
+            table name (optionally schema-qualified)
+        schema : str, optional
+            schema name (incompatible with schema-qualified table name)
+        conn : psycopg2 connection object, optional
+            a DB connection object. If none start a new connection and close it
+            when complete
+        """
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        else:
+            close_conn = False
+
+        self._drop_scenario_views(None,conn)
+        subs = self._connectivity_table_subs(table if schema is None else schema + "." + table)
+        self._reset_connectivity_versions(subs,base=True,conn=conn)
+        self.drop_table(table,schema=schema,conn=conn)
+
+        if close_conn:
+            conn.commit()
+            conn.close()
+
+
+    def _drop_scenario_views(self,scenario_ids,conn):
+        """
+        Drops the materialized connectivity of the given scenarios (all
+        scenarios if none)
+
+        Parameters
+        ----------
+        scenario_ids : list
+            list of scenarios (none for all)
+        conn : psycopg2 connection object
+            a DB connection
+        """
+        subs = dict(self.sql_subs)
+        self._scenario_view_subs(subs,None,False)
+        registry = self._run_sql(
+            "SELECT to_regclass({registry})::TEXT",
+            {"registry": sql.Literal(
+                sql.SQL("{cache_schema}.scenario_connectivity").format(**subs).as_string(conn)
+            )},
+            ret=True,
+            conn=conn
+        )[0][0]
+        if registry is None:
+            return
+
+        if scenario_ids is None:
+            subs["scenario_where"] = sql.SQL("TRUE")
+        else:
+            subs["scenario_where"] = sql.SQL("scenario = ANY({})").format(
+                sql.Literal([str(s) for s in scenario_ids])
+            )
+        views = self._run_sql("""
+            DELETE FROM {cache_schema}.scenario_connectivity
+            WHERE {scenario_where}
+            RETURNING view_name
+        """,subs,ret=True,conn=conn)
+        for row in views:
+            self._run_sql(
+                "DROP MATERIALIZED VIEW IF EXISTS {cache_schema}.{view}",
+                {"cache_schema": subs["cache_schema"], "view": sql.Identifier(row[0])},
+                conn=conn
+            )
+
+
     def calculate_scenario_connectivity(self,scenario_column,scenario_ids=None,
                                         datatype=None,origin_blocks=None,
                                         destination_blocks=None,network_filter=None,
-                                        subtract=False,dry=None):
+                                        subtract=False,concurrency=None,
+                                        engine=None,bands=None,dry=None):
         """
         Wrapper for connectivity calculations on a given scenario, only to be
         used once the base scenario has been run.
@@ -464,12 +1740,23 @@ class Connectivity(DBUtils):
         subtract : bool, optional
             if true the calculated scores for the scenario represent
             a subtraction of that scenario from all other scenarios
+        concurrency : int, optional
+            number of blocks to process at once, each on its own db connection
+        engine : str, optional
+            routing engine, either "pgrouting" or "python"
+        bands : list, optional
+            distances at which to record connectivity (see
+            calculate_connectivity)
         dry : str, optional
             a path to save SQL statements to instead of executing in DB
         """
         if not self.table_exists(self.db_connectivity_table):
             raise ValueError("Connectivity table {} for the base scenario not found".format(self.db_connectivity_table))
         subs = dict(self.sql_subs)
+        if bands is None:
+            bands = self.config.bna.connectivity.get("bands")
+        if bands:
+            subs["connectivity_max_distance"] = sql.Literal(max(bands))
 
         # add column
         if datatype is None:
@@ -533,12 +1820,16 @@ class Connectivity(DBUtils):
                 destination_blocks=destination_blocks,
                 network_filter=network_filter,
                 road_ids=road_ids,
-                append=True
+                append=True,
+                concurrency=concurrency,
+                engine=engine,
+                bands=bands
             )
 
 
     def calculate_connectivity(self,blocks=None,network_filter=None,
-                               append=False,dry=None):
+                               append=False,concurrency=None,engine=None,
+                               bands=None,dry=None):
         """
         Wrapper for connectivity calculations on the base scenario
 
@@ -550,14 +1841,197 @@ class Connectivity(DBUtils):
             filter to be applied to the road network when routing
         append : bool, optional
             append to existing db table instead of creating a new one
+        concurrency : int, optional
+            number of blocks to process at once, each on its own db connection.
+            Values above 1 use asynchronous connections to keep several blocks
+            in flight so the database isn't left idle between scripts.
+        engine : str, optional
+            routing engine, either "pgrouting" (route in the database) or
+            "python" (route in memory with searches that stop once every
+            nearby block has been resolved). If none use the config file
+            setting, defaulting to pgrouting.
+        bands : list, optional
+            distances (e.g. [800,1600,2680]) at which to record connectivity.
+            A single search runs out to the largest band, which replaces
+            max_distance, and the smallest band reached at high and low
+            stress is saved to the high_stress_band and low_stress_band
+            columns. If none use the bands setting in the config file, if any.
         dry : str, optional
             a path to save SQL statements to instead of executing in DB
         """
         self._calculate_connectivity(
             origin_blocks=blocks,
             network_filter=network_filter,
-            append=append
+            append=append,
+            concurrency=concurrency,
+            engine=engine,
+            bands=bands
+        )
+
+
+    @phase("preview_connectivity")
+    def calculate_preview_connectivity(self,output_table,zones="block_group",
+                                       hex_size=None,block_group_length=12,
+                                       overwrite=False,concurrency=None,
+                                       engine=None):
+        """
+        Calculates approximate connectivity quickly by grouping blocks into
+        larger zones, routing between zones, and giving every pair of blocks
+        the connectivity of their zones. Blocks in the same zone are treated
+        as connected. Results are written to a separate table that can be
+        passed to score() with the connectivity_table argument.
+
+        The zones are saved alongside the output table as <output>_zones and
+        <output>_zone_blocks, and the zone-to-zone results as
+        <output>_zone_connectivity.
+
+        Parameters
+        ----------
+        output_table : str
+            table to write block connectivity to (optionally schema-qualified)
+        zones : str, optional
+            how to group blocks: "block_group" (census block groups taken
+            from the leading digits of the block id) or "hex" (a hexagonal
+            grid)
+        hex_size : float, optional
+            edge length of the hexagons in units of the block geometries (if
+            none use a quarter of max_distance)
+        block_group_length : int, optional
+            number of leading characters of the block id that identify the
+            block group
+        overwrite : bool, optional
+            overwrite pre-existing tables
+        concurrency : int, optional
+            number of zones to process at once, each on its own db connection
+        engine : str, optional
+            routing engine, either "pgrouting" or "python"
+        """
+        start = time.time()
+        schema, table = self.parse_table_name(output_table)
+        if schema is None:
+            schema = self.get_default_schema()
+        output_table = schema + "." + table
+        zones_table = table + "_zones"
+        zone_blocks_table = table + "_zone_blocks"
+        zone_connectivity_table = table + "_zone_connectivity"
+
+        if self.table_exists(output_table):
+            if overwrite:
+                self._drop_connectivity_table(output_table)
+            else:
+                raise ValueError("Table {} already exists".format(output_table))
+
+        subs = self._connectivity_table_subs(schema + "." + zone_connectivity_table)
+        subs["zones_schema"] = sql.Identifier(schema)
+        subs["zones_table"] = sql.Identifier(zones_table)
+        subs["zone_blocks_table"] = sql.Identifier(zone_blocks_table)
+        subs["zone_connectivity_table"] = sql.Identifier(zone_connectivity_table)
+        subs["zones_index"] = sql.Identifier("sidx_" + zones_table)
+        subs["zone_blocks_index"] = sql.Identifier("idx_" + zone_blocks_table)
+
+        # build zones
+        print("Building {} zones".format(zones))
+        conn = self.get_db_connection()
+        if zones == "block_group":
+            subs["block_group_length"] = sql.Literal(block_group_length)
+            self._run_sql_script("zones_block_group.sql",subs,["sql","connectivity","preview"],conn=conn)
+        elif zones == "hex":
+            if hex_size is None:
+                hex_size = self.config.bna.connectivity.max_distance / 4.0
+            subs["hex_size"] = sql.Literal(hex_size)
+            self._run_sql_script("zones_hex.sql",subs,["sql","connectivity","preview"],conn=conn)
+        else:
+            raise ValueError("Unknown zone type {}".format(zones))
+        self._run_sql_script("zones_table.sql",subs,["sql","connectivity","preview"],conn=conn)
+        self.drop_table(zone_connectivity_table,schema,conn=conn)
+
+        # zone connectivity uses integer ids
+        zone_subs = dict(subs)
+        zone_subs["blocks_schema"] = subs["zones_schema"]
+        zone_subs["blocks_table"] = subs["zones_table"]
+        zone_subs["blocks_id_col"] = sql.Identifier("zone_id")
+        zone_subs["blocks_id_type"] = sql.SQL("INTEGER")
+        zone_subs["blocks_geom_col"] = sql.Identifier("geom")
+        self._run_sql_script("create_table.sql",zone_subs,["sql","connectivity"],conn=conn)
+        zone_ids = [row[0] for row in self._run_sql(
+            "SELECT zone_id FROM {zones_schema}.{zones_table}",
+            subs,
+            ret=True,
+            conn=conn
+        )]
+        conn.commit()
+        conn.close()
+        print("Routing between {} zones".format(len(zone_ids)))
+
+        self._calculate_connectivity(
+            origin_blocks=zone_ids,
+            append=True,
+            concurrency=concurrency,
+            engine=engine,
+            connectivity_table=schema + "." + zone_connectivity_table,
+            subs=zone_subs
+        )
+
+        # expand to blocks
+        print("Writing block connectivity")
+        self._connectivity_table_create(table=output_table)
+        subs = self._connectivity_table_subs(output_table)
+        subs.update({k: v for k, v in zone_subs.items() if k.startswith("zone")})
+        self._run_sql_script("expand_zones.sql",subs,["sql","connectivity","preview"])
+        self._connectivity_table_create_index(table=output_table)
+
+        print("Preview connectivity finished in {:.1f} minutes".format((time.time()-start)/60))
+
+
+    def calculate_sampled_connectivity(self,output_table,fraction=0.1,seed=None,
+                                       overwrite=False,concurrency=None,
+                                       engine=None):
+        """
+        Calculates connectivity for a random sample of origin blocks and writes
+        it to a separate table. Score the results with
+        score(connectivity_table=output_table,sampled=True) so that only the
+        sampled blocks are included in the scores, then aggregate() as usual
+        for an estimate of the overall score. estimate_sampling_error() gives
+        the uncertainty of the estimate.
+
+        Parameters
+        ----------
+        output_table : str
+            table to write connectivity to (optionally schema-qualified)
+        fraction : float, optional
+            share of origin blocks to route
+        seed : int, optional
+            seed for the random sample
+        overwrite : bool, optional
+            overwrite a pre-existing table
+        concurrency : int, optional
+            number of blocks to process at once, each on its own db connection
+        engine : str, optional
+            routing engine, either "pgrouting" or "python"
+
+        returns:
+        list of sampled block ids
+        """
+        if fraction <= 0 or fraction > 1:
+            raise ValueError("Sample fraction must be greater than 0 and no more than 1")
+        if self.table_exists(output_table):
+            if overwrite:
+                self._drop_connectivity_table(output_table)
+            else:
+                raise ValueError("Table {} already exists".format(output_table))
+
+        block_ids = self._get_block_ids()
+        sample_size = max(1,int(round(fraction*len(block_ids))))
+        origin_blocks = random.Random(seed).sample(block_ids,sample_size)
+        print("Routing {} of {} blocks".format(sample_size,len(block_ids)))
+
+        self._calculate_connectivity(
+            origin_blocks=origin_blocks,
+            concurrency=concurrency,
+            engine=engine,
+            connectivity_table=output_table
         )
+        return origin_blocks
 
 
     def check_road_features(self,throw_error=False):
@@ -78,11 +78,7 @@ class Core(DBUtils):
                 subs["scenario_where"] = sql.SQL("WHERE scenario IS NULL")
             except:
                 subs["scenario_where"] = sql.SQL("")
-            self._run_sql_script("01_connectivity_table.sql",subs,["sql","scenarios"],conn=conn)
-        elif subtract:
-            self._run_sql_script("01_connectivity_table_scenario_subtract.sql",subs,["sql","scenarios"],conn=conn)
-        else:
-            self._run_sql_script("01_connectivity_table_scenario.sql",subs,["sql","scenarios"],conn=conn)
+        self._load_connectivity(subs,scenario_id=scenario_id,subtract=subtract,conn=conn)
 
         # make sheds
         if composite:
@@ -2,10 +2,15 @@
 # This is a class that provides utilities for working with the
 # database
 ###################################################################
-import os, warnings
+import os, re, warnings
 warnings.simplefilter("always")
+import time
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 import psycopg2
+import psycopg2.extensions
 import sqlite3
 from psycopg2 import sql
 from psycopg2.extras import execute_values
@@ -38,6 +43,13 @@ class DBUtils:
         self.verbose = verbose
         self.debug = debug
         self.module_dir = os.path.dirname(os.path.abspath(__file__))
+        self.event_callbacks = list()
+        self._phases = list()
+        self.profiling = False
+        self.profile_explain = False
+        self.profile_records = list()
+        self.db_stats = False
+        self.db_stats_records = list()
 
 
     def get_db_connection(self):
@@ -47,6 +59,556 @@ class DBUtils:
         return psycopg2.connect(self.db_connection_string)
 
 
+    def add_event_callback(self,callback):
+        """
+        Registers a function to receive progress events. Each event is passed
+        to the callback as a dictionary with at least "event" (the event type),
+        "time" (a unix timestamp), and "phase" (the name of the running phase,
+        if any). Event types are:
+            phase_start / phase_end: a major step such as build_network or
+                score started or finished (phase_end includes "duration" and
+                "status")
+            block: an origin block finished connectivity (includes "block_id",
+                "duration", "scripts" with seconds per SQL script, "rows"
+                written, and "done", "total", "rate" in blocks per second, and
+                "eta" in seconds)
+            block_failed: an origin block failed (includes "block_id",
+                "script", and "error")
+            slowdown: recent throughput dropped well below the average for the
+                run (includes "rate" and "recent_rate")
+            profile: SQL timings for a finished phase when profiling is on
+                (includes "scripts", see profile_report)
+            db_stats: server-side activity during a phase when enabled with
+                enable_db_stats (buffer hits/reads, temp files, scans, dead
+                tuples, and the busiest tables and statements)
+
+        Parameters
+        ----------
+        callback : callable
+            function taking a single dictionary argument (see
+            telemetry.JSONLinesSink for a ready-made sink)
+        """
+        self.event_callbacks.append(callback)
+
+
+    def remove_event_callback(self,callback):
+        """
+        Unregisters a function added with add_event_callback
+
+        Parameters
+        ----------
+        callback : callable
+            the function to remove
+        """
+        self.event_callbacks.remove(callback)
+
+
+    def _emit(self,event,**fields):
+        """
+        Sends an event to all registered callbacks. Errors raised by a
+        callback are reported as warnings so they can't halt a run.
+
+        Parameters
+        ----------
+        event : str
+            the event type
+        **fields
+            additional event details
+        """
+        callbacks = getattr(self,"event_callbacks",None)
+        if not callbacks:
+            return
+        phases = getattr(self,"_phases",None)
+        data = {
+            "event": event,
+            "time": time.time(),
+            "phase": phases[-1] if phases else None
+        }
+        data.update(fields)
+        for callback in list(callbacks):
+            try:
+                callback(data)
+            except Exception as e:
+                warnings.warn("Event callback failed: {}".format(e))
+
+
+    @contextmanager
+    def _phase(self,name,**fields):
+        """
+        Context manager that emits phase_start and phase_end events around a
+        major step of the analysis
+
+        Parameters
+        ----------
+        name : str
+            name of the phase
+        **fields
+            additional details to include with the phase_start event
+        """
+        if getattr(self,"_phases",None) is None:
+            self._phases = list()
+        self._phases.append(name)
+        self._emit("phase_start",**fields)
+        mark = len(getattr(self,"profile_records",list()))
+        before = None
+        if getattr(self,"db_stats",False):
+            before = self._db_stats_snapshot()
+        start = time.time()
+        status = "failed"
+        try:
+            yield
+            status = "ok"
+        finally:
+            self._emit("phase_end",duration=time.time()-start,status=status)
+            if before is not None:
+                self._db_stats_phase_end(name,before)
+            if getattr(self,"profiling",False) and len(self._phases) == 1:
+                self._emit("profile",scripts=self.profile_report(phase=name,start=mark))
+            self._phases.pop()
+
+
+    def enable_profiling(self,explain=False):
+        """
+        Turns on profiling of SQL scripts. While profiling, the wall time and
+        rows affected are recorded for every script run through the DBUtils
+        helpers (and for each step of a connectivity run) and a summary is
+        printed at the end of each pyBNA method.
+
+        Parameters
+        ----------
+        explain : bool, optional
+            also capture EXPLAIN (ANALYZE, BUFFERS) output for each statement.
+            This runs every statement a second time inside a savepoint that is
+            rolled back, so it roughly doubles the time spent in the database.
+            Plans are not captured on asynchronous connections.
+        """
+        self.profiling = True
+        self.profile_explain = explain
+        if getattr(self,"profile_records",None) is None:
+            self.profile_records = list()
+
+
+    def disable_profiling(self):
+        """
+        Turns off SQL profiling. Records already collected are kept in
+        profile_records.
+        """
+        self.profiling = False
+        self.profile_explain = False
+
+
+    def profile_report(self,phase=None,show=True,start=0):
+        """
+        Summarizes the profile records by script
+
+        Parameters
+        ----------
+        phase : str, optional
+            only summarize records collected during the given top-level phase
+            (e.g. "connectivity")
+        show : bool, optional
+            print the summary
+        start : int, optional
+            index of the first record to include
+
+        returns:
+        dictionary of script name -> dict of calls, total, p50, p95, max
+        (all in seconds) and rows (total rows affected)
+        """
+        groups = dict()
+        for r in getattr(self,"profile_records",list())[start:]:
+            if phase is not None and r["phase"] != phase:
+                continue
+            groups.setdefault(r["script"],list()).append(r)
+
+        report = dict()
+        for script, records in groups.items():
+            durations = np.array([r["duration"] for r in records])
+            rows = [r["rows"] for r in records if r["rows"] is not None and r["rows"] >= 0]
+            report[script] = {
+                "calls": len(records),
+                "total": float(durations.sum()),
+                "p50": float(np.percentile(durations,50)),
+                "p95": float(np.percentile(durations,95)),
+                "max": float(durations.max()),
+                "rows": int(sum(rows)) if rows else None
+            }
+
+        if show and report:
+            if phase is None:
+                print("SQL profile")
+            else:
+                print("SQL profile for {}".format(phase))
+            print("   {:<40} {:>7} {:>10} {:>9} {:>9} {:>12}".format(
+                "script","calls","total (s)","p50 (s)","p95 (s)","rows"
+            ))
+            for script, stats in sorted(report.items(),key=lambda x: -x[1]["total"]):
+                print("   {:<40} {:>7} {:>10.2f} {:>9.3f} {:>9.3f} {:>12}".format(
+                    script[:40],
+                    stats["calls"],
+                    stats["total"],
+                    stats["p50"],
+                    stats["p95"],
+                    "" if stats["rows"] is None else stats["rows"]
+                ))
+        return report
+
+
+    def _profile_record(self,script,duration,rows=None,plans=None):
+        """
+        Adds an entry to the profile records if profiling is on
+
+        Parameters
+        ----------
+        script : str
+            name of the script or step
+        duration : float
+            wall time in seconds
+        rows : int, optional
+            rows affected
+        plans : list, optional
+            EXPLAIN output for the statements in the script
+        """
+        if not getattr(self,"profiling",False):
+            return
+        phases = getattr(self,"_phases",None)
+        self.profile_records.append({
+            "script": script,
+            "phase": phases[0] if phases else None,
+            "duration": duration,
+            "rows": rows,
+            "plans": plans
+        })
+
+
+    def _execute(self,cur,q,script):
+        """
+        Executes a statement on the cursor, recording its timing (and plan if
+        requested) when profiling is on
+
+        Parameters
+        ----------
+        cur : psycopg2 cursor
+            the cursor to execute on
+        q : psycopg2 SQL object or str
+            the sql to run
+        script : str
+            name of the script or step for the profile
+        """
+        if not getattr(self,"profiling",False):
+            cur.execute(q)
+            return
+        plans = None
+        if self.profile_explain:
+            plans = self._explain(cur,q)
+        start = time.time()
+        cur.execute(q)
+        self._profile_record(script,time.time()-start,cur.rowcount,plans)
+
+
+    def _explain(self,cur,q):
+        """
+        Runs each statement in q with EXPLAIN (ANALYZE, BUFFERS) inside a
+        savepoint that is rolled back afterward. Statements that can't be
+        explained (DDL, etc.) are executed as-is so later statements see their
+        effects.
+
+        Parameters
+        ----------
+        cur : psycopg2 cursor
+            the cursor to execute on
+        q : psycopg2 SQL object or str
+            the sql to explain
+
+        returns:
+        list of dicts with the statement and its plan (in JSON format), or
+        None if the statements couldn't be explained
+        """
+        conn = cur.connection
+        if conn.autocommit or conn.async_:
+            return None
+        if isinstance(q,str):
+            text = q
+        else:
+            text = q.as_string(conn)
+        statements = self._split_statements(text)
+        if statements is None:
+            return None
+
+        plans = list()
+        cur.execute("SAVEPOINT pybna_explain")
+        try:
+            for statement in statements:
+                cur.execute("SAVEPOINT pybna_explain_statement")
+                try:
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement)
+                    plans.append({
+                        "statement": " ".join(statement.split())[:200],
+                        "plan": cur.fetchone()[0]
+                    })
+                    cur.execute("RELEASE SAVEPOINT pybna_explain_statement")
+                except psycopg2.Error:
+                    cur.execute("ROLLBACK TO SAVEPOINT pybna_explain_statement")
+                    cur.execute(statement)
+        except psycopg2.Error as e:
+            # leave it to the real run to report the error
+            if self.verbose:
+                print("Could not explain statement: {}".format(e))
+        finally:
+            cur.execute("ROLLBACK TO SAVEPOINT pybna_explain")
+            cur.execute("RELEASE SAVEPOINT pybna_explain")
+        return plans
+
+
+    def _split_statements(self,text):
+        """
+        Splits a sql script into its statements. Semicolons inside quoted
+        strings and identifiers, comments, and dollar-quoted bodies (e.g.
+        $$ ... $$ or $func$ ... $func$) don't end a statement.
+
+        Parameters
+        ----------
+        text : str
+            the sql script
+
+        returns:
+        list of statements, or None if the script couldn't be tokenized
+        """
+        tokens = re.compile(
+            r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$)|;",
+            re.S
+        )
+        statements = list()
+        start = 0
+        pos = 0
+        while True:
+            match = tokens.search(text,pos)
+            if match is None:
+                break
+            pos = match.end()
+            if match.group(1) is not None:
+                # skip to the closing tag of the dollar quote
+                close = text.find(match.group(1),pos)
+                if close == -1:
+                    return None
+                pos = close + len(match.group(1))
+            elif match.group(0) == ";":
+                statements.append(text[start:match.start()])
+                start = pos
+        statements.append(text[start:])
+        comments = re.compile(r"--[^\n]*|/\*.*?\*/",re.S)
+        return [s for s in statements if len(comments.sub("",s).strip()) > 0]
+
+
+    def enable_db_stats(self):
+        """
+        Turns on server-side instrumentation. The database's statistics views
+        (pg_stat_database, pg_stat_user_tables, and pg_stat_statements if the
+        extension is installed) are read before and after each major phase
+        (build_network, segment_stress, crossing_stress, connectivity, score,
+        aggregate) and the difference is reported when the phase finishes.
+
+        Note that the server publishes statistics with a short delay (up to
+        half a second before PostgreSQL 15), so very short phases may be
+        under-counted.
+        """
+        self.db_stats = True
+        if getattr(self,"db_stats_records",None) is None:
+            self.db_stats_records = list()
+
+
+    def disable_db_stats(self):
+        """
+        Turns off server-side instrumentation. Reports already collected are
+        kept in db_stats_records.
+        """
+        self.db_stats = False
+
+
+    def _db_stats_snapshot(self):
+        """
+        Reads the current values from the database's statistics views
+
+        returns:
+        dictionary with "database" totals, per-table "tables" counters, and
+        per-query "statements" counters (None if pg_stat_statements is not
+        available)
+        """
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        snapshot = dict()
+
+        cur.execute("""
+            SELECT blks_hit, blks_read, temp_files, temp_bytes
+            FROM pg_stat_database
+            WHERE datname = current_database()
+        """)
+        snapshot["database"] = dict(zip(
+            ["blks_hit","blks_read","temp_files","temp_bytes"],
+            cur.fetchone()
+        ))
+
+        table_cols = ["seq_scan","seq_tup_read","idx_scan","n_tup_ins","n_tup_upd","n_tup_del","n_dead_tup"]
+        cur.execute("""
+            SELECT schemaname, relname, {}
+            FROM pg_stat_user_tables
+        """.format(",".join(["COALESCE({},0)".format(c) for c in table_cols])))
+        snapshot["tables"] = {
+            row[0] + "." + row[1]: dict(zip(table_cols,row[2:]))
+            for row in cur.fetchall()
+        }
+
+        snapshot["statements"] = None
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+        if cur.rowcount > 0:
+            try:
+                cur.execute("""
+                    SELECT *
+                    FROM pg_stat_statements
+                    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                """)
+                names = [d[0] for d in cur.description]
+                # renamed in PostgreSQL 13
+                time_col = "total_exec_time" if "total_exec_time" in names else "total_time"
+                statements = dict()
+                for row in cur.fetchall():
+                    row = dict(zip(names,row))
+                    if row["queryid"] is None:
+                        continue
+                    entry = statements.setdefault(row["queryid"],{
+                        "query": row["query"],
+                        "calls": 0,
+                        "time": 0.0,
+                        "shared_blks_hit": 0,
+                        "shared_blks_read": 0,
+                        "temp_blks_written": 0
+                    })
+                    entry["calls"] += row["calls"]
+                    entry["time"] += row[time_col]/1000
+                    entry["shared_blks_hit"] += row["shared_blks_hit"]
+                    entry["shared_blks_read"] += row["shared_blks_read"]
+                    entry["temp_blks_written"] += row["temp_blks_written"]
+                snapshot["statements"] = statements
+            except psycopg2.Error as e:
+                warnings.warn("Could not read pg_stat_statements: {}".format(e))
+                conn.rollback()
+
+        cur.close()
+        conn.close()
+        return snapshot
+
+
+    def _db_stats_diff(self,before,after,top=5):
+        """
+        Compares two statistics snapshots
+
+        Parameters
+        ----------
+        before : dict
+            snapshot taken at the start of the phase
+        after : dict
+            snapshot taken at the end of the phase
+        top : int, optional
+            number of tables and statements to list
+
+        returns:
+        dictionary of activity between the snapshots
+        """
+        diff = {
+            k: after["database"][k] - before["database"][k]
+            for k in after["database"]
+        }
+
+        totals = dict()
+        tables = list()
+        for table, stats in after["tables"].items():
+            old = before["tables"].get(table,dict())
+            change = {k: v - old.get(k,0) for k, v in stats.items()}
+            # dead tuples are reported as the count at the end of the phase
+            change["n_dead_tup"] = stats["n_dead_tup"]
+            for k, v in change.items():
+                totals[k] = totals.get(k,0) + v
+            if any(change[k] != 0 for k in ("seq_scan","idx_scan","n_tup_ins","n_tup_upd","n_tup_del")):
+                change["table"] = table
+                tables.append(change)
+        diff.update(totals)
+        diff["tables"] = sorted(tables,key=lambda x: -x["seq_tup_read"])[:top]
+
+        diff["statements"] = None
+        if after["statements"] is not None and before["statements"] is not None:
+            statements = list()
+            for queryid, stats in after["statements"].items():
+                old = before["statements"].get(queryid,dict())
+                change = {
+                    k: v - old.get(k,0) for k, v in stats.items() if k != "query"
+                }
+                if change["calls"] > 0:
+                    change["query"] = " ".join(stats["query"].split())[:200]
+                    statements.append(change)
+            diff["statements"] = sorted(statements,key=lambda x: -x["time"])[:top]
+
+        return diff
+
+
+    def _db_stats_phase_end(self,name,before):
+        """
+        Takes the closing snapshot for a phase, then records, prints, and emits
+        the difference. Failures are reported as warnings so they can't mask
+        the outcome of the phase.
+
+        Parameters
+        ----------
+        name : str
+            name of the phase
+        before : dict
+            snapshot taken at the start of the phase
+        """
+        try:
+            diff = self._db_stats_diff(before,self._db_stats_snapshot())
+        except Exception as e:
+            warnings.warn("Could not collect database statistics: {}".format(e))
+            return
+        diff["phase"] = name
+        self.db_stats_records.append(diff)
+
+        reads = diff["blks_hit"] + diff["blks_read"]
+        print("Database stats for {}".format(name))
+        print("   shared buffers: {} hit, {} read ({:.1f}% hit)".format(
+            diff["blks_hit"],
+            diff["blks_read"],
+            100.0*diff["blks_hit"]/reads if reads > 0 else 100.0
+        ))
+        print("   temp files: {} ({:.1f} MB)".format(
+            diff["temp_files"],
+            diff["temp_bytes"]/1024/1024
+        ))
+        print("   seq scans: {} ({} rows read), index scans: {}".format(
+            diff.get("seq_scan",0),
+            diff.get("seq_tup_read",0),
+            diff.get("idx_scan",0)
+        ))
+        print("   dead tuples: {}".format(diff.get("n_dead_tup",0)))
+        for t in diff["tables"]:
+            print("      {}: {} seq scans ({} rows read), {} dead tuples".format(
+                t["table"],
+                t["seq_scan"],
+                t["seq_tup_read"],
+                t["n_dead_tup"]
+            ))
+        if diff["statements"]:
+            print("   slowest statements:")
+            for st in diff["statements"]:
+                print("      {:.2f}s, {} calls, {} blocks read, {} temp blocks: {}".format(
+                    st["time"],
+                    st["calls"],
+                    st["shared_blks_read"],
+                    st["temp_blks_written"],
+                    st["query"][:80]
+                ))
+
+        self._emit("db_stats",**diff)
+
+
     def get_pkid_col(self, table, schema=None):
         # connect to pg and read id col
         conn = self.get_db_connection()
@@ -92,6 +654,75 @@ class DBUtils:
         return cur.fetchone()[0]
 
 
+    def get_table_catalog(self,tables,conn=None):
+        """
+        Looks up the schema and primary key column of several tables at once
+        (tables without a schema are found on the search path)
+
+        Parameters
+        ----------
+        tables : list
+            table names (optionally schema-qualified)
+        conn : psycopg2 connection object, optional
+            a psycopg2 connection object (default: create new connection)
+
+        Returns
+        -------
+        dict
+            for each table name, a tuple of (schema, primary key column) or
+            None if the table doesn't exist. The primary key column is None
+            if the table has no primary key.
+        """
+        close_conn = False
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        cur = conn.cursor()
+
+        names = list()
+        for name in tables:
+            schema, table = self.parse_table_name(name)
+            if schema is None:
+                names.append(sql.Identifier(table).as_string(conn))
+            else:
+                names.append(sql.SQL(".").join([sql.Identifier(schema),sql.Identifier(table)]).as_string(conn))
+
+        cur.execute(
+            sql.SQL("""
+                SELECT
+                    t.i,
+                    n.nspname::TEXT,
+                    (
+                        SELECT a.attname::TEXT
+                        FROM
+                            pg_index i
+                            JOIN pg_attribute a ON a.attrelid = i.indrelid
+                                AND a.attnum = ANY(i.indkey)
+                        WHERE
+                            i.indrelid = c.oid
+                            AND i.indisprimary
+                        ORDER BY a.attnum
+                        LIMIT 1
+                    )
+                FROM
+                    unnest({names}::TEXT[]) WITH ORDINALITY t(name,i)
+                    LEFT JOIN pg_class c ON c.oid = to_regclass(t.name)
+                    LEFT JOIN pg_namespace n ON n.oid = c.relnamespace
+            """).format(names=sql.Literal(names))
+        )
+        catalog = dict()
+        for i, schema, pkid in cur.fetchall():
+            name = tables[i-1]
+            if schema is None:
+                catalog[name] = None
+            else:
+                catalog[name] = (schema, pkid)
+        cur.close()
+        if close_conn:
+            conn.close()
+        return catalog
+
+
     def get_default_schema(self):
         """
         Returns the name of the default schema in the database (i.e. the first
@@ -230,6 +861,64 @@ class DBUtils:
             return False
 
 
+    def get_table_fingerprint(self,table,schema=None,conn=None):
+        """
+        Returns a summary of the table's contents that changes whenever rows
+        are inserted, updated, or deleted or the table is rebuilt. Used to
+        invalidate data derived from the table.
+
+        Parameters
+        ----------
+        table : str
+            the table name
+        schema : str, optional
+            the schema name
+        conn : psycopg2 connection object, optional
+            a psycopg2 connection object (default: create new connection)
+
+        Returns
+        -------
+        dict
+            the row count, the highest transaction id that wrote a live row,
+            and the id of the table's file on disk
+        """
+        close_conn = False
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        cur = conn.cursor()
+
+        if schema is None:
+            schema, table = self.parse_table_name(table)
+        if schema is None:
+            full_table = sql.Identifier(table)
+        else:
+            full_table = sql.SQL(".").join([sql.Identifier(schema),sql.Identifier(table)])
+
+        cur.execute(
+            sql.SQL("""
+                SELECT
+                    COUNT(*),
+                    MAX(xmin::TEXT::BIGINT),
+                    (SELECT relfilenode FROM pg_class WHERE oid = {regclass}::REGCLASS)
+                FROM {table}
+            """).format(
+                regclass=sql.Literal(full_table.as_string(conn)),
+                table=full_table
+            )
+        )
+        row = cur.fetchone()
+        cur.close()
+        if close_conn:
+            conn.close()
+
+        return {
+            "rows": int(row[0]),
+            "max_xmin": None if row[1] is None else int(row[1]),
+            "relfilenode": int(row[2])
+        }
+
+
     def split_sql_for_tqdm(self,sql):
         """
         reads in an input sql script with comments representing progress updates.
@@ -520,6 +1209,25 @@ class DBUtils:
             conn.close()
 
 
+    def _compose_sql_script(self, fname, subs, dirs):
+        """Reads a sql script from the module and passes substitutions into it
+        without executing.
+
+        fname : str
+            name of the sql file
+        subs : dict
+            dict of substitutions for the SQL
+        dirs : list
+            list of directory tree in the submodule
+
+        returns:
+        a composed psycopg2 SQL object
+        """
+        fpath = os.path.join(self.module_dir,*dirs,fname)
+        raw = self.read_sql_from_file(fpath)
+        return sql.SQL(raw).format(**subs)
+
+
     def _run_sql_script(self, fname, subs, dirs, ret=False, conn=None):
         """Pass substitutions into a sql script, and execute against server.
 
@@ -543,18 +1251,10 @@ class DBUtils:
         else:
             close_conn = False
 
-        # process fname
-        dirs.insert(0,self.module_dir)
-        dirs.append(fname)
-        fpath = os.path.join(*dirs)
-
-        # Read SQL script
-        raw = self.read_sql_from_file(fpath)
-
-        q = sql.SQL(raw).format(**subs)
+        q = self._compose_sql_script(fname,subs,dirs)
         cur = conn.cursor()
         try:
-            cur.execute(q)
+            self._execute(cur,q,os.path.splitext(fname)[0])
         except Exception as e:
             if conn.closed == 0:
                 conn.rollback()
@@ -601,7 +1301,7 @@ class DBUtils:
         if dry is None:
             cur = conn.cursor()
             try:
-                cur.execute(q)
+                self._execute(cur,q," ".join(statement.split())[:40])
             except Exception as e:
                 if conn.closed == 0:
                     conn.rollback()
@@ -626,6 +1326,102 @@ class DBUtils:
             conn.close()
 
 
+    async def _get_async_db_connection(self):
+        """
+        Returns a new asynchronous db connection using the settings from the
+        parent pyBNA class. Asynchronous connections are always in autocommit
+        mode.
+        """
+        conn = psycopg2.connect(self.db_connection_string,async_=True)
+        await self._async_wait(conn)
+        return conn
+
+
+    async def _async_wait(self,conn):
+        """
+        Yields control to the event loop until the asynchronous connection has
+        finished its current operation
+
+        Parameters
+        ----------
+        conn : psycopg2 connection object
+            an asynchronous connection
+        """
+        loop = asyncio.get_running_loop()
+        fd = conn.fileno()
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                return
+
+            ready = loop.create_future()
+            def on_ready():
+                if not ready.done():
+                    ready.set_result(None)
+
+            if state == psycopg2.extensions.POLL_READ:
+                loop.add_reader(fd,on_ready)
+                remove = loop.remove_reader
+            elif state == psycopg2.extensions.POLL_WRITE:
+                loop.add_writer(fd,on_ready)
+                remove = loop.remove_writer
+            else:
+                raise psycopg2.OperationalError("Unexpected poll state {}".format(state))
+            try:
+                await ready
+            finally:
+                remove(fd)
+
+
+    async def _run_sql_async(self, q, conn, ret=False):
+        """Executes a composed sql statement on an asynchronous connection
+
+        q : psycopg2 SQL object
+            the composed sql to run
+        conn : psycopg2 connection object
+            an asynchronous connection
+        ret : bool, optional
+            if true, return the rows produced by the statement, otherwise
+            return the number of rows affected by the last statement
+        """
+        cur = conn.cursor()
+        try:
+            cur.execute(q)
+            await self._async_wait(conn)
+            if ret:
+                return cur.fetchall()
+            return cur.rowcount
+        finally:
+            cur.close()
+
+
+    def _run_async(self,coro):
+        """
+        Runs a coroutine to completion on a selector event loop (required for
+        psycopg2's asynchronous connections). If an event loop is already
+        running in this thread (e.g. in a Jupyter notebook) the coroutine is
+        run from a separate thread.
+
+        Parameters
+        ----------
+        coro : coroutine
+            the coroutine to run
+        """
+        def run():
+            loop = asyncio.SelectorEventLoop()
+            try:
+                return loop.run_until_complete(coro)
+            finally:
+                loop.close()
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return run()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(run).result()
+
+
     def _add_column(self,table,name,datatype,schema=None,conn=None):
         """
         Adds a column to the given table
@@ -2,6 +2,7 @@
 # The Destination class stores a BNA destination category for use in pyBNA.
 ###################################################################
 import os
+import json
 import psycopg2
 from psycopg2 import sql
 import numpy as np
@@ -9,9 +10,13 @@ import warnings
 
 from .dbutils import DBUtils
 
+# stored as the comment on bna_break_score so that the function is replaced
+# when its definition changes (update whenever bna_break_score.sql changes)
+BREAK_SCORE_VERSION = "pybna break score 1"
+
 
 class DestinationCategory(DBUtils):
-    def __init__(self,config,db_connection_string,workspace_schema=None):
+    def __init__(self,config,db_connection_string,workspace_schema=None,catalog=None):
         """Sets up a new category of BNA destinations and retrieves data from
         the given db table
 
@@ -21,6 +26,9 @@ class DestinationCategory(DBUtils):
             string to connect to the database
         workspace_schema : str, optional
             schema to save interim working tables to
+        catalog : dict, optional
+            the schema and primary key of the category's table (see
+            DBUtils.get_table_catalog). If none they are looked up.
 
         return: None
         """
@@ -40,17 +48,20 @@ class DestinationCategory(DBUtils):
 
         if "table" in config:
             self.has_count = True
-            if not self.table_exists(config.table):
+            if catalog is None:
+                catalog = self.get_table_catalog([config.table])
+            if catalog.get(config.table) is None:
                 warnings.warn("No table found for {}".format(config.name))
             else:
-                schema, table = self.parse_table_name(config.table)
-                if schema is None:
-                    schema = self.get_schema(table)
+                schema, pkid = catalog[config.table]
+                table = self.parse_table_name(config.table)[1]
 
                 if "uid" in config:
                     id_column = config.uid
+                elif pkid is None:
+                    raise ValueError("No primary key defined on table %s" % table)
                 else:
-                    id_column = self.get_pkid_col(table,schema=schema)
+                    id_column = pkid
 
                 if "geom" in config:
                     if isinstance(config.geom, str):
@@ -114,7 +125,8 @@ class DestinationCategory(DBUtils):
         return self.read_sql_from_file(os.path.join(*dirs))
 
 
-    def count_connections(self,subs,conn=None):
+    def count_connections(self,subs,conn=None,cache_schema=None,reuse=False,
+                          fingerprints=None):
         """
         Counts the number of destinations accessible to each block under high
         and low stress conditions
@@ -127,6 +139,14 @@ class DestinationCategory(DBUtils):
         conn : psycopg2 connection object, optional
             a DB connection object. If none start a new connection and close it
             when complete
+        cache_schema : str, optional
+            schema to cache destination-block assignments in (see assign_blocks)
+        reuse : bool, optional
+            reuse destination-block assignments made earlier on the same
+            connection (see assign_blocks)
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call (see
+            assign_blocks)
         """
         if not self.has_count:
             return
@@ -138,6 +158,8 @@ class DestinationCategory(DBUtils):
             close_conn = False
 
         subs.update(self.sql_subs)
+        self.assign_blocks(subs,cache_schema=cache_schema,reuse=reuse,
+                           fingerprints=fingerprints,conn=conn)
 
         hs_subs = {
             "tbl": sql.Identifier("high_stress"),
@@ -159,6 +181,296 @@ class DestinationCategory(DBUtils):
             conn.close()
 
 
+    def assign_blocks(self,subs,cache_schema=None,reuse=False,fingerprints=None,
+                      conn=None):
+        """
+        Assigns the destinations in a count-based category to the blocks they
+        intersect and adds the table holding the assignments to the sql
+        substitutes (dest_blocks_schema and dest_blocks_table).
+
+        Without a cache schema the assignments go to a temporary table, which
+        can be reused by later calls on the same connection. With a cache
+        schema they are kept in a persistent table that is only rebuilt when
+        the destination table, the blocks table, or the category's filter or
+        geometry columns change.
+
+        Parameters
+        ----------
+        subs : dict
+            a list of sql substitutes (updated in place)
+        cache_schema : str, optional
+            schema to cache the assignments in
+        reuse : bool, optional
+            reuse the temporary table from an earlier call on the same
+            connection if there is one
+        fingerprints : dict, optional
+            (schema, table) -> fingerprint of the tables already fingerprinted
+            during this scoring call. Tables not in it are fingerprinted and
+            added so that they're only scanned once per call.
+        conn : psycopg2 connection object, optional
+            a DB connection object. If none start a new connection and close it
+            when complete
+        """
+        if not self.has_count or self.config.method != "count":
+            return
+
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        else:
+            close_conn = False
+
+        subs.update(self.sql_subs)
+        if cache_schema is None:
+            table = "tmp_dest_blocks_" + self.config.name
+            subs["dest_blocks_schema"] = sql.Identifier("pg_temp")
+            subs["dest_blocks_table"] = sql.Identifier(table)
+            subs["dest_blocks_index"] = sql.Identifier("tidx_" + table)
+            exists = reuse and self._run_sql(
+                "SELECT to_regclass({table})",
+                {"table": sql.Literal(
+                    sql.SQL("pg_temp.{}").format(sql.Identifier(table)).as_string(conn)
+                )},
+                ret=True,
+                conn=conn
+            )[0][0] is not None
+            if not exists:
+                self._run_sql_script("02_destination_blocks.sql",subs,["sql","destinations"],conn=conn)
+            if close_conn:
+                conn.close()
+            return
+
+        table = "dest_blocks_" + self.config.name
+        subs["cache_schema"] = sql.Identifier(cache_schema)
+        subs["dest_blocks_schema"] = sql.Identifier(cache_schema)
+        subs["dest_blocks_table"] = sql.Identifier(table)
+        subs["dest_blocks_index"] = sql.Identifier("idx_" + table)
+        subs["category"] = sql.Literal(self.config.name)
+        subs["inputs"] = sql.Literal(self._block_inputs(subs,conn,fingerprints))
+
+        self._run_sql_script("destination_blocks_cache.sql",subs,["sql","destinations"],conn=conn)
+        cached = self._run_sql("""
+            SELECT inputs
+            FROM {cache_schema}.destination_blocks_cache
+            WHERE category = {category}
+        """,subs,ret=True,conn=conn)
+        if (
+            len(cached) > 0 and
+            cached[0][0] == subs["inputs"].wrapped and
+            self.table_exists(table,cache_schema)
+        ):
+            print("      using cached destination blocks")
+        else:
+            self._run_sql_script("02_destination_blocks.sql",subs,["sql","destinations"],conn=conn)
+            self._run_sql("""
+                INSERT INTO {cache_schema}.destination_blocks_cache (category, inputs)
+                VALUES ({category},{inputs})
+                ON CONFLICT (category) DO UPDATE
+                SET inputs = EXCLUDED.inputs, created = NOW()
+            """,subs,conn=conn)
+
+        if close_conn:
+            conn.commit()
+            conn.close()
+
+
+    def _block_inputs(self,subs,conn,fingerprints=None):
+        """
+        Describes the inputs to the destination-block assignments so that
+        cached assignments can be invalidated when the inputs change
+
+        Parameters
+        ----------
+        subs : dict
+            a list of sql substitutes
+        conn : psycopg2 connection object
+            a DB connection object
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+
+        returns:
+        JSON string
+        """
+        inputs = {
+            "destinations": self._table_fingerprint(
+                subs["destinations_schema"].string,
+                subs["destinations_table"].string,
+                fingerprints,
+                conn
+            ),
+            "blocks": self._table_fingerprint(
+                subs["blocks_schema"].string,
+                subs["blocks_table"].string,
+                fingerprints,
+                conn
+            ),
+            "id": subs["destinations_id_col"].as_string(conn),
+            "geom": subs["destinations_geom_col"].as_string(conn),
+            "filter": subs["destinations_filter"].as_string(conn),
+            "blocks_id": subs["blocks_id_col"].as_string(conn),
+            "blocks_geom": subs["blocks_geom_col"].as_string(conn)
+        }
+        return json.dumps(inputs,sort_keys=True)
+
+
+    def _table_fingerprint(self,schema,table,fingerprints,conn):
+        """
+        Returns the fingerprint of a table (see DBUtils.get_table_fingerprint),
+        reusing the one in fingerprints if the table has already been
+        fingerprinted during this scoring call
+
+        Parameters
+        ----------
+        schema : str
+            the schema name
+        table : str
+            the table name
+        fingerprints : dict
+            (schema, table) -> fingerprint (none to always fingerprint)
+        conn : psycopg2 connection object
+            a DB connection object
+
+        returns:
+        dict
+        """
+        if fingerprints is not None and (schema,table) in fingerprints:
+            return fingerprints[(schema,table)]
+        fingerprint = self.get_table_fingerprint(table,schema=schema,conn=conn)
+        if fingerprints is not None:
+            fingerprints[(schema,table)] = fingerprint
+        return fingerprint
+
+
+    def load_cached_scores(self,subs,cache_schema,connectivity,scored=True,
+                           fingerprints=None,conn=None):
+        """
+        Restores this category's counts (and scores) from the cache schema into
+        the workspace table if none of the inputs have changed since they were
+        cached. Adds the cache substitutes that save_cached_scores needs.
+
+        Parameters
+        ----------
+        subs : dict
+            a list of sql substitutes (updated in place)
+        cache_schema : str
+            schema holding the cached results
+        connectivity : dict
+            describes the connectivity the counts come from (e.g. the version
+            of the base or scenario connectivity)
+        scored : bool, optional
+            whether the results include scores calculated in the database
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call (see
+            assign_blocks)
+        conn : psycopg2 connection object, optional
+            a DB connection object. If none start a new connection and close it
+            when complete
+
+        returns:
+        True if the results were restored from the cache
+        """
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        else:
+            close_conn = False
+
+        subs.update(self.sql_subs)
+        table = "cached_scores_" + self.config.name
+        subs["cache_schema"] = sql.Identifier(cache_schema)
+        subs["cached_scores_table"] = sql.Identifier(table)
+        subs["category"] = sql.Literal(self.config.name)
+        subs["score_inputs"] = sql.Literal(self._score_inputs(subs,connectivity,scored,conn,fingerprints))
+
+        self._run_sql_script("score_cache.sql",subs,["sql","destinations"],conn=conn)
+        cached = self._run_sql("""
+            SELECT inputs
+            FROM {cache_schema}.score_cache
+            WHERE category = {category}
+        """,subs,ret=True,conn=conn)
+        hit = (
+            len(cached) > 0 and
+            cached[0][0] == subs["score_inputs"].wrapped and
+            self.table_exists(table,cache_schema)
+        )
+        if hit:
+            self._run_sql_script("03_load_cached_scores.sql",subs,["sql","destinations"],conn=conn)
+
+        if close_conn:
+            conn.commit()
+            conn.close()
+        return hit
+
+
+    def save_cached_scores(self,subs,conn=None):
+        """
+        Saves the workspace table to the cache schema along with the inputs
+        it was calculated from (subs must come from load_cached_scores)
+
+        Parameters
+        ----------
+        subs : dict
+            a list of sql substitutes
+        conn : psycopg2 connection object, optional
+            a DB connection object. If none start a new connection and close it
+            when complete
+        """
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        else:
+            close_conn = False
+
+        self._run_sql_script("03_save_cached_scores.sql",subs,["sql","destinations"],conn=conn)
+
+        if close_conn:
+            conn.commit()
+            conn.close()
+
+
+    def _score_inputs(self,subs,connectivity,scored,conn,fingerprints=None):
+        """
+        Describes everything this category's counts and scores depend on so
+        that cached results can be invalidated when any of it changes
+
+        Parameters
+        ----------
+        subs : dict
+            a list of sql substitutes
+        connectivity : dict
+            describes the connectivity the counts come from
+        scored : bool
+            whether the results include scores
+        conn : psycopg2 connection object
+            a DB connection object
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+
+        returns:
+        JSON string
+        """
+        if self.config.method == "count":
+            inputs = json.loads(self._block_inputs(subs,conn,fingerprints))
+        else:
+            inputs = {
+                "destinations": self._table_fingerprint(
+                    subs["destinations_schema"].string,
+                    subs["destinations_table"].string,
+                    fingerprints,
+                    conn
+                ),
+                "id": subs["destinations_id_col"].as_string(conn),
+                "val": subs["val"].as_string(conn),
+                "filter": subs["destinations_filter"].as_string(conn)
+            }
+        inputs["method"] = self.config.method
+        inputs["breaks"] = sorted([float(k), float(v)] for k, v in self.config.breaks.items())
+        inputs["maxpoints"] = self.maxpoints
+        inputs["connectivity"] = connectivity
+        inputs["scored"] = scored
+        return json.dumps(inputs,sort_keys=True)
+
+
     def calculate_score(self,subs,conn=None):
         """
         Calculates the score for this destination category
@@ -182,13 +494,100 @@ class DestinationCategory(DBUtils):
             close_conn = False
 
         subs.update(self.sql_subs)
-        subs["case"] = self._concat_case("hs","ls")
+        subs["score_function"] = self._break_score_call("hs","ls")
+        self.install_break_score(conn)
 
         self._run_sql("""
             UPDATE {workspace_schema}.{workspace_table}
-            SET score = {case}
+            SET score = {score_function}
         """,subs,conn=conn)
 
+        if close_conn:
+            conn.commit()
+            conn.close()
+
+
+    def install_break_score(self,conn):
+        """
+        Installs the bna_break_score SQL function if it's missing or was
+        installed by a different version of pybna. The function is left alone
+        otherwise so that scoring doesn't need permission to create functions
+        once it's in place.
+
+        Parameters
+        ----------
+        conn : psycopg2 connection object
+            a DB connection object
+        """
+        version = self._run_sql(
+            """
+                SELECT obj_description(
+                    to_regprocedure('bna_break_score(FLOAT8,FLOAT8,FLOAT8[],FLOAT8[],FLOAT8[],FLOAT8,TEXT)'),
+                    'pg_proc'
+                )
+            """,
+            ret=True,
+            conn=conn
+        )[0][0]
+        if version != BREAK_SCORE_VERSION:
+            self._run_sql_script(
+                "bna_break_score.sql",
+                {"version": sql.Literal(BREAK_SCORE_VERSION)},
+                ["sql","destinations"],
+                conn=conn
+            )
+
+
+    def _break_score_call(self,hs_column,ls_column):
+        """
+        Builds a call to the bna_break_score SQL function (installed from
+        bna_break_score.sql) that scores high stress and low stress
+        destination counts using this category's break points. Gives the same
+        results as _concat_case.
+
+        Parameters
+        ----------
+        hs_column : str
+            the name of the column with high stress destination counts
+        ls_column : str
+            the name of the column with low stress destination counts
+
+        returns
+        a composed psycopg2 SQL object
+        """
+        breaks = dict(self.config.breaks)
+        breaks.pop(0,None)
+
+        # score at the start of each break's interval
+        base_scores = list()
+        cumul_score = 0
+        for brk, score in sorted(breaks.items()):
+            base_scores.append(float(cumul_score))
+            if self.config.method == "count":
+                cumul_score += score
+            else:
+                cumul_score = score
+
+        return sql.SQL("""
+            bna_break_score(
+                {hs_column},
+                {ls_column},
+                {breaks}::FLOAT8[],
+                {scores}::FLOAT8[],
+                {base_scores}::FLOAT8[],
+                {maxpoints},
+                {method}
+            )
+        """).format(**{
+            "hs_column": sql.Identifier(hs_column),
+            "ls_column": sql.Identifier(ls_column),
+            "breaks": sql.Literal([float(brk) for brk, score in sorted(breaks.items())]),
+            "scores": sql.Literal([float(score) for brk, score in sorted(breaks.items())]),
+            "base_scores": sql.Literal(base_scores),
+            "maxpoints": sql.Literal(self.maxpoints),
+            "method": sql.Literal(self.config.method)
+        })
+
 
     def _concat_case(self,hs_column,ls_column):
         """
@@ -7,9 +7,83 @@ import psycopg2
 from psycopg2 import sql
 from tqdm import tqdm
 import random, string
+import io
+from functools import partial
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 
 from .dbutils import DBUtils
+from .telemetry import phase
 from .destinationcategory import DestinationCategory
+from .scoring import break_score, combine_scores, with_scipy
+from .scoring import connectivity_matrices, sparse_destination_counts
+
+
+class DestinationRegistry(MutableMapping):
+    """
+    Dictionary of destination categories that builds each category the first
+    time it's used, so that code that only needs a few categories doesn't pay
+    for setting up the rest
+    """
+
+    def __init__(self):
+        self._factories = dict()
+        self._categories = dict()
+
+
+    def register(self,name,factory):
+        """
+        Adds a category (replacing any existing category with the same name)
+
+        Parameters
+        ----------
+        name : str
+            name of the category
+        factory : callable
+            called with no arguments to build the DestinationCategory
+        """
+        self._factories[name] = factory
+        self._categories.pop(name,None)
+
+
+    def is_loaded(self,name):
+        """
+        Whether the given category has been built yet
+        """
+        return name in self._categories
+
+
+    def __getitem__(self,name):
+        if name not in self._categories:
+            if self._factories.get(name) is None:
+                raise KeyError(name)
+            self._categories[name] = self._factories[name]()
+        return self._categories[name]
+
+
+    def __setitem__(self,name,destination):
+        self._factories[name] = None
+        self._categories[name] = destination
+
+
+    def __delitem__(self,name):
+        del self._factories[name]
+        self._categories.pop(name,None)
+
+
+    def __iter__(self):
+        return iter(list(self._factories))
+
+
+    def __len__(self):
+        return len(self._factories)
+
+
+    def __repr__(self):
+        return "DestinationRegistry({} categories, {} loaded)".format(len(self),len(self._categories))
+
 
 
 class Destinations(DBUtils):
@@ -23,6 +97,7 @@ class Destinations(DBUtils):
         self.srid = None
         self.db_connectivity_table = None
         self.destinations = None
+        self._score_counts = None
 
 
     def register_destinations(self,category=None,workspace_schema=None,destinations=None):
@@ -41,7 +116,7 @@ class Destinations(DBUtils):
         if category is None and destinations is None:
             if self.verbose:
                 print('Adding destinations')
-            self.destinations = dict()
+            self.destinations = DestinationRegistry()
 
         if destinations is None:
             destinations = [{
@@ -49,21 +124,70 @@ class Destinations(DBUtils):
                 "subcats": self.config.bna.destinations
             }]
 
-        self._register(destinations=destinations,category=category,workspace_schema=workspace_schema)
+        # look up every destination table in one query
+        catalog = self.get_table_catalog(self._destination_tables(destinations))
 
-        # assign maxpoints
-        for name, destination in self.destinations.items():
-            if (
-                (
-                    category is None or
-                    category == name
-                ) and
-                destination.has_subcats
-                ):
-                destination.maxpoints = self._get_maxpoints(destination)
+        self._register(
+            destinations=destinations,
+            category=category,
+            workspace_schema=workspace_schema,
+            catalog=catalog
+        )
+
+
+    def _destination_tables(self,destinations):
+        """
+        Lists the tables used by the given destinations and their subcategories
+
+        Parameters
+        ----------
+        destinations : list
+            a list of destinations
+
+        returns:
+        list of table names
+        """
+        tables = list()
+        for v in destinations:
+            config = self.parse_config(v)
+            if "table" in config and config.table not in tables:
+                tables.append(config.table)
+            if "subcats" in config:
+                for table in self._destination_tables(config.subcats):
+                    if table not in tables:
+                        tables.append(table)
+        return tables
+
+
+    def _build_destination(self,config,workspace_schema=None,catalog=None):
+        """
+        Creates the DestinationCategory for a destination config and assigns
+        maxpoints to categories with subcategories
+
+        Parameters
+        ----------
+        config : Munch
+            the destination config
+        workspace_schema : str, optional
+            schema to save interim working tables to
+        catalog : dict, optional
+            schemas and primary keys of the destination tables
+
+        returns:
+        DestinationCategory
+        """
+        destination = DestinationCategory(
+            config,
+            self.db_connection_string,
+            workspace_schema=workspace_schema,
+            catalog=catalog
+        )
+        if destination.has_subcats:
+            destination.maxpoints = self._get_maxpoints(destination)
+        return destination
 
 
-    def _register(self,destinations,category=None,workspace_schema=None):
+    def _register(self,destinations,category=None,workspace_schema=None,catalog=None):
         """
         Retrieve the destinations identified in the config file and register them.
 
@@ -75,24 +199,35 @@ class Destinations(DBUtils):
             a destination category to register. None -> re-register all destinations
         workspace_schema : str, optional
             schema to save interim working tables to
+        catalog : dict, optional
+            schemas and primary keys of the destination tables (see
+            DBUtils.get_table_catalog)
         """
         for v in destinations:
             config = self.parse_config(v)
             if category is None or config.name == category:
-                self.destinations[config.name] = DestinationCategory(
-                    config,
-                    self.db_connection_string,
-                    workspace_schema=workspace_schema
+                self.destinations.register(
+                    config.name,
+                    partial(
+                        self._build_destination,
+                        config,
+                        workspace_schema=workspace_schema,
+                        catalog=catalog
+                    )
                 )
             if "subcats" in config:
                 self._register(
                     category=category,
                     workspace_schema=workspace_schema,
-                    destinations=config.subcats
+                    destinations=config.subcats,
+                    catalog=catalog
                 )
 
 
-    def score(self,output_table,scenario_id=None,subtract=False,with_geoms=False,overwrite=False):
+    @phase("score")
+    def score(self,output_table,scenario_id=None,subtract=False,with_geoms=False,
+              overwrite=False,connectivity_table=None,sampled=False,engine="sql",
+              counting="per_category",concurrency=None):
         """
         Creates a new db table of scores for each block
 
@@ -108,14 +243,73 @@ class Destinations(DBUtils):
             a subtraction of that scenario from all other scenarios
         overwrite : bool, optional
             overwrite a pre-existing table
+        connectivity_table : str, optional
+            connectivity table to score from, e.g. the output of
+            calculate_preview_connectivity or calculate_sampled_connectivity
+            (if none use the connectivity table from the config file)
+        sampled : bool, optional
+            only score blocks that are origins in the connectivity table (use
+            with calculate_sampled_connectivity)
+        engine : str, optional
+            "sql" to calculate scores in the database or "numpy" to pull the
+            destination counts into memory, score them there, and write the
+            output table in one COPY. The numpy engine keeps the counts so
+            that rescore() can quickly recalculate scores with different
+            breaks or weights.
+        counting : str, optional
+            "per_category" to count destinations for each category in turn or
+            "single_pass" to collect the destinations for every category in
+            one table and count them all in a single pass over the
+            connectivity table, or "sparse" to load the connectivity into
+            sparse matrices and count every category in memory (requires
+            scipy and engine="numpy")
+        concurrency : int, optional
+            number of connections to count categories on at once (per-category
+            counting only). The connectivity is saved to the workspace schema
+            for the duration so destinations must be registered with a
+            workspace_schema.
         """
+        if engine not in ("sql","numpy"):
+            raise ValueError("Unknown scoring engine {}".format(engine))
+        if counting not in ("per_category","single_pass","sparse"):
+            raise ValueError("Unknown counting method {}".format(counting))
+        if counting == "sparse":
+            if engine != "numpy":
+                raise ValueError("Sparse counting requires engine=\"numpy\"")
+            if not with_scipy:
+                raise ValueError("Sparse counting requires scipy")
+        if concurrency is not None and concurrency > 1:
+            if counting != "per_category":
+                raise ValueError("Concurrent counting requires counting=\"per_category\"")
+            if not all(d.persist for d in self.destinations.values() if d.has_count):
+                raise ValueError("Concurrent counting requires destinations registered with a workspace_schema")
+
         # make a copy of sql substitutes
         subs = dict(self.sql_subs)
+        if connectivity_table is None:
+            connectivity_table = self.db_connectivity_table
+        else:
+            conn_schema, conn_table = self.parse_table_name(connectivity_table)
+            if conn_schema is None:
+                conn_schema = self.get_schema(conn_table)
+            subs["connectivity_schema"] = sql.Identifier(conn_schema)
+            subs["connectivity_table"] = sql.Identifier(conn_table)
+
+        if sampled:
+            subs["scores_filter"] = sql.SQL("""
+                EXISTS (
+                    SELECT 1
+                    FROM pg_temp.tmp_connectivity
+                    WHERE tmp_connectivity.source = blocks.{blocks_id_col}
+                )
+            """).format(**subs)
+        else:
+            subs["scores_filter"] = sql.SQL("TRUE")
 
         # check if a scenarios column exists
         if scenario_id is None:
             try:
-                self.get_column_type(self.db_connectivity_table,"scenario")
+                self.get_column_type(connectivity_table,"scenario")
                 subs["scenario_where"] = sql.SQL("WHERE scenario IS NULL")
             except:
                 subs["scenario_where"] = sql.SQL("")
@@ -141,22 +335,329 @@ class Destinations(DBUtils):
             raise psycopg2.ProgrammingError("Table {} already exists".format(output_table))
 
         # create temporary filtered connectivity table
-        if scenario_id is None:
-            self._run_sql_script("01_connectivity_table.sql",subs,["sql","scenarios"],conn=conn)
-        elif subtract:
-            self._run_sql_script("01_connectivity_table_scenario_subtract.sql",subs,["sql","scenarios"],conn=conn)
-        else:
-            self._run_sql_script("01_connectivity_table_scenario.sql",subs,["sql","scenarios"],conn=conn)
+        self._load_connectivity(subs,scenario_id=scenario_id,subtract=subtract,conn=conn)
 
         # generate high and low stress counts for all categories
         print("Counting destinations for each block")
+        cache_schema = self.config.bna.get("cache_schema")
+        connectivity = None
+        fingerprints = None
+        if cache_schema is not None:
+            fingerprints = self._input_fingerprints(subs,conn)
+            if counting == "per_category":
+                connectivity = {
+                    "table": sql.SQL("{connectivity_schema}.{connectivity_table}").format(**subs).as_string(conn),
+                    "version": self._connectivity_version(subs,scenario_id,conn=conn),
+                    "scenario": None if scenario_id is None else str(scenario_id),
+                    "subtract": subtract
+                }
+        if concurrency is not None and concurrency > 1:
+            cached = self._count_destinations_concurrently(
+                subs,
+                conn,
+                concurrency,
+                cache_schema=cache_schema,
+                calculate_score=(engine == "sql"),
+                connectivity=connectivity,
+                fingerprints=fingerprints
+            )
+        else:
+            cached = self._count_destinations(
+                subs,
+                conn,
+                counting=counting,
+                cache_schema=cache_schema,
+                calculate_score=(engine == "sql"),
+                connectivity=connectivity,
+                fingerprints=fingerprints
+            )
+        if connectivity is not None:
+            recomputed = [
+                name for name, destination in self.destinations.items()
+                if destination.has_count and name not in cached
+            ]
+            print("Recomputed: {}".format(", ".join(recomputed) if recomputed else "none"))
+            print("From cache: {}".format(", ".join(cached) if cached else "none"))
+
+        if engine == "numpy":
+            print("Calculating scores")
+            if counting == "sparse":
+                self._score_counts = self._sparse_score_counts(subs,conn,cache_schema=cache_schema,fingerprints=fingerprints)
+            else:
+                self._score_counts = self._fetch_score_counts(subs,conn)
+            self._write_scores(self._score_counts,subs,conn)
+        else:
+            print("Compiling destination data for all sources into output table")
+            subs["columns"], subs["tables"] = self._combined_columns()
+            self._run_sql_script("04_all_combined.sql",subs,["sql","destinations"],conn=conn)
+
+            # finally set any category scores
+            print("Calculating category scores")
+            self.aggregate_subcategories(self.destinations["overall"],subs,conn=conn)
+
+        if with_geoms:
+            self._copy_block_geoms(conn,subs)
+
+        conn.commit()
+        conn.close()
+
+
+    def _count_destinations(self,subs,conn,counting="per_category",cache_schema=None,
+                            calculate_score=True,reuse=False,connectivity=None,
+                            fingerprints=None):
+        """
+        Counts destinations for every category from pg_temp.tmp_connectivity
+        into the categories' workspace tables and optionally scores them
+
+        Parameters
+        ----------
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        counting : str, optional
+            counting method (see score()). Sparse counting is done in memory
+            later so nothing is counted here.
+        cache_schema : str, optional
+            schema to cache destination-block assignments in
+        calculate_score : bool, optional
+            whether to calculate each category's score in the database
+        reuse : bool, optional
+            reuse destination-block assignments made earlier on the same
+            connection (see DestinationCategory.assign_blocks)
+        connectivity : dict, optional
+            describes the connectivity being counted. If given (along with a
+            cache schema) categories whose inputs haven't changed are restored
+            from the cache instead of counted (per-category counting only).
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call (see
+            _input_fingerprints)
+
+        returns:
+        list of the categories restored from the cache
+        """
+        cached = list()
+        if counting == "single_pass":
+            self._count_all_connections(subs,conn,cache_schema=cache_schema,reuse=reuse,
+                                        fingerprints=fingerprints)
+        for name, destination in self.destinations.items():
+            if destination.has_count:
+                print(("   ...{}".format(name)))
+                if counting == "per_category":
+                    if self._count_category(destination,subs,conn,cache_schema,calculate_score,
+                                            reuse,connectivity,fingerprints):
+                        cached.append(name)
+                elif calculate_score:
+                    destination.calculate_score(subs,conn=conn)
+        return cached
+
+
+    def _count_category(self,destination,subs,conn,cache_schema=None,calculate_score=True,
+                        reuse=False,connectivity=None,fingerprints=None):
+        """
+        Counts destinations (and optionally calculates the score) for one
+        category, restoring the results from the cache schema instead if
+        the category's inputs haven't changed since they were cached
+
+        Parameters
+        ----------
+        destination : DestinationCategory
+            the category to count
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        cache_schema : str, optional
+            schema to cache destination-block assignments and results in
+        calculate_score : bool, optional
+            whether to calculate the score in the database
+        reuse : bool, optional
+            reuse destination-block assignments made earlier on the same
+            connection (see DestinationCategory.assign_blocks)
+        connectivity : dict, optional
+            describes the connectivity being counted (results are only cached
+            if given)
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+
+        returns:
+        True if the results were restored from the cache
+        """
+        use_cache = cache_schema is not None and connectivity is not None
+        if use_cache and destination.load_cached_scores(
+                subs,cache_schema,connectivity,scored=calculate_score,
+                fingerprints=fingerprints,conn=conn):
+            print("      using cached scores")
+            return True
+        destination.count_connections(subs,conn=conn,cache_schema=cache_schema,reuse=reuse,
+                                      fingerprints=fingerprints)
+        if calculate_score:
+            destination.calculate_score(subs,conn=conn)
+        if use_cache:
+            destination.save_cached_scores(subs,conn=conn)
+        return False
+
+
+    def _count_destinations_concurrently(self,subs,conn,concurrency,cache_schema=None,
+                                         calculate_score=True,connectivity=None,
+                                         fingerprints=None):
+        """
+        Counts destinations for every category on a pool of connections. The
+        connectivity in pg_temp.tmp_connectivity is saved to the workspace
+        schema (unless it's already a materialized scenario) so that each
+        connection can read it, and is dropped once the counts are done.
+
+        Parameters
+        ----------
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        concurrency : int
+            number of connections to count on
+        cache_schema : str, optional
+            schema to cache destination-block assignments in
+        calculate_score : bool, optional
+            whether to calculate each category's score in the database
+        connectivity : dict, optional
+            describes the connectivity being counted (see _count_destinations)
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call, shared
+            by the connections (see _input_fingerprints)
+
+        returns:
+        list of the categories restored from the cache
+        """
+        names = [name for name, d in self.destinations.items() if d.has_count]
+        if "resolved_table" in subs:
+            persisted = False
+        else:
+            persisted = True
+            workspace_schema = self.destinations[names[0]].workspace_schema
+            suffix = "".join(random.choice(string.ascii_lowercase) for _ in range(8))
+            subs["resolved_schema"] = sql.Identifier(workspace_schema)
+            subs["resolved_table"] = sql.Identifier("tmp_connectivity_" + suffix)
+            subs["resolved_index"] = sql.Identifier("idx_tmp_connectivity_" + suffix)
+            self._run_sql_script("persist_connectivity.sql",subs,["sql","scenarios"],conn=conn)
+        if cache_schema is not None:
+            cache_subs = dict(subs)
+            cache_subs["cache_schema"] = sql.Identifier(cache_schema)
+            self._run_sql_script("destination_blocks_cache.sql",cache_subs,["sql","destinations"],conn=conn)
+            self._run_sql_script("score_cache.sql",cache_subs,["sql","destinations"],conn=conn)
+        if calculate_score:
+            # install the scoring function (if needed) before the connections
+            # start scoring
+            self.destinations[names[0]].install_break_score(conn)
+        conn.commit()
+
+        cached = list()
+        try:
+            batches = [names[i::concurrency] for i in range(concurrency)]
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                futures = [
+                    pool.submit(self._count_category_batch,batch,subs,cache_schema,calculate_score,
+                                connectivity,fingerprints)
+                    for batch in batches if len(batch) > 0
+                ]
+                for future in futures:
+                    cached.extend(future.result())
+        finally:
+            if persisted:
+                self.drop_table(
+                    table=subs["resolved_table"].string,
+                    schema=subs["resolved_schema"].string,
+                    conn=conn
+                )
+                conn.commit()
+        return cached
+
+
+    def _count_category_batch(self,names,subs,cache_schema=None,calculate_score=True,
+                              connectivity=None,fingerprints=None):
+        """
+        Counts destinations for a batch of categories on a new connection,
+        reading the connectivity saved by _count_destinations_concurrently
+
+        Parameters
+        ----------
+        names : list
+            destination categories to count
+        subs : dict
+            list of SQL substitutions from the parent method
+        cache_schema : str, optional
+            schema to cache destination-block assignments in
+        calculate_score : bool, optional
+            whether to calculate each category's score in the database
+        connectivity : dict, optional
+            describes the connectivity being counted (see _count_destinations)
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+
+        returns:
+        list of the categories restored from the cache
+        """
+        # the connection has to be closed even on failure, otherwise its
+        # view keeps the saved connectivity from being dropped
+        cached = list()
+        conn = self.get_db_connection()
+        try:
+            self._run_sql_script("01_connectivity_view.sql",subs,["sql","scenarios"],conn=conn)
+            for name in names:
+                print(("   ...{}".format(name)))
+                if self._count_category(self.destinations[name],dict(subs),conn,cache_schema,
+                                        calculate_score,connectivity=connectivity,
+                                        fingerprints=fingerprints):
+                    cached.append(name)
+                conn.commit()
+        finally:
+            conn.close()
+        return cached
+
+
+    def _input_fingerprints(self,subs,conn):
+        """
+        Fingerprints the blocks table and each distinct destination table once
+        for a scoring call so that the categories' caches (see
+        DestinationCategory.assign_blocks and load_cached_scores) don't scan
+        them again for every category
+
+        Parameters
+        ----------
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+
+        returns:
+        dict of (schema, table) -> fingerprint
+        """
+        tables = [(subs["blocks_schema"].string,subs["blocks_table"].string)]
+        for destination in self.destinations.values():
+            if destination.has_count and hasattr(destination,"sql_subs"):
+                tables.append((
+                    destination.sql_subs["destinations_schema"].string,
+                    destination.sql_subs["destinations_table"].string
+                ))
+
+        fingerprints = dict()
+        for schema, table in tables:
+            if (schema,table) not in fingerprints:
+                fingerprints[(schema,table)] = self.get_table_fingerprint(table,schema=schema,conn=conn)
+        return fingerprints
+
+
+    def _combined_columns(self):
+        """
+        Builds the columns and joins that combine the categories' workspace
+        tables into the scores table (see 04_all_combined.sql)
+
+        returns:
+        tuple of composed SQL (columns, tables)
+        """
         columns = sql.SQL("")
         tables = sql.SQL("")
         for name, destination in self.destinations.items():
             if destination.has_count:
-                print(("   ...{}".format(name)))
-                destination.count_connections(subs,conn=conn)
-                destination.calculate_score(subs,conn=conn)
                 columns += sql.SQL("""
                     ,{table}.hs AS {hs}
                     ,{table}.ls AS {ls}
@@ -183,15 +684,537 @@ class Destinations(DBUtils):
                     "score": sql.Identifier(name + "_score")
                 })
 
-        print("Compiling destination data for all sources into output table")
-        subs["columns"] = columns
-        subs["tables"] = tables
-        self._run_sql_script("04_all_combined.sql",subs,["sql","destinations"],conn=conn)
+        return columns, tables
+
+
+    @phase("score")
+    def score_scenario_incremental(self,base_scores_table,scenario_id,output_table,
+                                   overwrite=False,counting="per_category"):
+        """
+        Creates a table of scores for a scenario by copying the base scores
+        and recalculating only the blocks whose connectivity changes under the
+        scenario (i.e. origins with rows for the scenario in the connectivity
+        table). Gives the same result as score(output_table,scenario_id=...)
+        as long as the base scores are current.
+
+        Parameters
+        ----------
+        base_scores_table : str
+            scores for the base condition from score() (optionally
+            schema-qualified)
+        scenario_id
+            the id of the scenario for which scores are calculated
+        output_table : str
+            table to create (optionally schema-qualified)
+        overwrite : bool, optional
+            overwrite a pre-existing table
+        counting : str, optional
+            "per_category" or "single_pass" (see score())
+        """
+        if counting not in ("per_category","single_pass"):
+            raise ValueError("Unknown counting method {}".format(counting))
+
+        subs = dict(self.sql_subs)
+        subs["scenario_id"] = sql.Literal(scenario_id)
+
+        base_schema, base_table = self.parse_table_name(base_scores_table)
+        if base_schema is None:
+            base_schema = self.get_schema(base_table)
+        subs["base_scores_schema"] = sql.Identifier(base_schema)
+        subs["base_scores_table"] = sql.Identifier(base_table)
+
+        schema, table = self.parse_table_name(output_table)
+        if schema is None:
+            schema = self.get_default_schema()
+        subs["scores_schema"] = sql.Identifier(schema)
+        subs["scores_table"] = sql.Identifier(table)
+
+        conn = self.get_db_connection()
+
+        if overwrite:
+            self.drop_table(table=table,schema=schema,conn=conn)
+        elif self.table_exists(output_table):
+            raise psycopg2.ProgrammingError("Table {} already exists".format(output_table))
+
+        print("Copying base scores")
+        self._run_sql_script("05_copy_base_scores.sql",subs,["sql","destinations"],conn=conn)
+        self._run_sql_script("01_connectivity_table_scenario_incremental.sql",subs,["sql","scenarios"],conn=conn)
+        affected = self._run_sql("SELECT COUNT(*) FROM pg_temp.tmp_affected",ret=True,conn=conn)[0][0]
+        print("   ...{} blocks affected by scenario {}".format(affected,scenario_id))
+
+        print("Counting destinations for affected blocks")
+        cache_schema = self.config.bna.get("cache_schema")
+        self._count_destinations(
+            subs,
+            conn,
+            counting=counting,
+            cache_schema=cache_schema,
+            fingerprints=None if cache_schema is None else self._input_fingerprints(subs,conn)
+        )
+        subs["columns"], subs["tables"] = self._affected_columns()
+        subs["update_filter"] = sql.SQL("TRUE")
+
+        print("Updating scores of affected blocks")
+        self._run_sql_script("05_update_affected.sql",subs,["sql","destinations"],conn=conn)
 
-        # finally set any category scores
         print("Calculating category scores")
+        subs["scores_where"] = sql.SQL("WHERE {} IN (SELECT block_id FROM pg_temp.tmp_affected)").format(
+            self.sql_subs["blocks_id_col"]
+        )
         self.aggregate_subcategories(self.destinations["overall"],subs,conn=conn)
 
+        conn.commit()
+        conn.close()
+
+
+    @phase("score")
+    def score_scenarios(self,scenario_ids,output_table,overwrite=False,
+                        concurrency=None,counting="per_category",base_name="base"):
+        """
+        Scores the base condition and many scenarios into one long table with
+        a row for each scenario and block. The base is counted and scored
+        once. Each scenario then starts from the base scores and only the
+        blocks whose connectivity changes under the scenario are recounted
+        (see score_scenario_incremental).
+
+        Parameters
+        ----------
+        scenario_ids : list
+            scenarios to score
+        output_table : str
+            table to create (optionally schema-qualified), keyed by scenario
+            and block id
+        overwrite : bool, optional
+            overwrite a pre-existing table
+        concurrency : int, optional
+            number of scenarios to score at once, each on its own db
+            connection (not available with a workspace schema, since the
+            category tables would collide)
+        counting : str, optional
+            "per_category" or "single_pass" (see score())
+        base_name : str, optional
+            value of the scenario column for the base scores
+        """
+        if counting not in ("per_category","single_pass"):
+            raise ValueError("Unknown counting method {}".format(counting))
+        if not hasattr(scenario_ids,"__iter__") or isinstance(scenario_ids,str):
+            scenario_ids = [scenario_ids]
+        if base_name in [str(s) for s in scenario_ids]:
+            raise ValueError("Scenario {} has the same name as the base scores".format(base_name))
+        if concurrency is not None and concurrency > 1:
+            if any(getattr(d,"persist",False) for d in self.destinations.values()):
+                raise ValueError("Scenarios can't be scored concurrently with a workspace schema")
+
+        subs = dict(self.sql_subs)
+        schema, table = self.parse_table_name(output_table)
+        if schema is None:
+            schema = self.get_default_schema()
+        subs["scores_schema"] = sql.Identifier(schema)
+        subs["scores_table"] = sql.Identifier(table)
+        subs["base_name"] = sql.Literal(base_name)
+        cache_schema = self.config.bna.get("cache_schema")
+
+        conn = self.get_db_connection()
+        if overwrite:
+            self.drop_table(table=table,schema=schema,conn=conn)
+        elif self.table_exists(output_table):
+            raise psycopg2.ProgrammingError("Table {} already exists".format(output_table))
+
+        print("Scoring base condition")
+        base_subs = dict(subs)
+        base_subs["scores_schema"] = sql.Identifier("pg_temp")
+        base_subs["scores_table"] = sql.Identifier("tmp_base_scores")
+        base_subs["scores_filter"] = sql.SQL("TRUE")
+        base_subs["scenario_where"] = sql.SQL("WHERE scenario IS NULL")
+        fingerprints = None
+        if cache_schema is not None:
+            fingerprints = self._input_fingerprints(subs,conn)
+        self._load_connectivity(base_subs,conn=conn)
+        self._count_destinations(base_subs,conn,counting=counting,cache_schema=cache_schema,
+                                 reuse=True,fingerprints=fingerprints)
+        base_subs["columns"], base_subs["tables"] = self._combined_columns()
+        self._run_sql_script("04_all_combined.sql",base_subs,["sql","destinations"],conn=conn)
+        self.aggregate_subcategories(self.destinations["overall"],base_subs,conn=conn)
+        self._run_sql_script("06_scenario_scores_table.sql",subs,["sql","destinations"],conn=conn)
+        conn.commit()
+
+        score_columns = [self.sql_subs["blocks_id_col"]]
+        for name, destination in self.destinations.items():
+            if destination.has_count:
+                score_columns.extend([sql.Identifier(name + "_" + c) for c in ["hs","ls","score"]])
+        for name, destination in self.destinations.items():
+            if destination.has_subcats:
+                score_columns.append(sql.Identifier(name + "_score"))
+        subs["score_columns"] = sql.SQL(",").join(score_columns)
+
+        if concurrency is None or concurrency < 2:
+            self._score_scenario_batch(scenario_ids,subs,counting,fingerprints=fingerprints,conn=conn)
+        else:
+            batches = [scenario_ids[i::concurrency] for i in range(concurrency)]
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                futures = [
+                    pool.submit(self._score_scenario_batch,batch,subs,counting,fingerprints)
+                    for batch in batches if len(batch) > 0
+                ]
+                for future in futures:
+                    future.result()
+
+        conn.commit()
+        conn.close()
+
+
+    def _score_scenario_batch(self,scenario_ids,subs,counting,fingerprints=None,conn=None):
+        """
+        Adds scenarios to a long table of scenario scores, recounting only the
+        blocks each scenario affects. Destination-block assignments are
+        reused from one scenario to the next.
+
+        Parameters
+        ----------
+        scenario_ids : list
+            scenarios to score
+        subs : dict
+            list of SQL substitutions from score_scenarios
+        counting : str
+            counting method (see score())
+        fingerprints : dict, optional
+            table fingerprints taken by score_scenarios
+        conn : psycopg2 connection object, optional
+            a DB connection object. If none start a new connection and close it
+            when complete
+        """
+        if conn is None:
+            close_conn = True
+            conn = self.get_db_connection()
+        else:
+            close_conn = False
+
+        for scenario_id in scenario_ids:
+            print("Scoring scenario {}".format(scenario_id))
+            scenario_subs = dict(subs)
+            scenario_subs["scenario_id"] = sql.Literal(scenario_id)
+            scenario_subs["scenario_text"] = sql.Literal(str(scenario_id))
+            self._run_sql_script("01_connectivity_table_scenario_incremental.sql",scenario_subs,["sql","scenarios"],conn=conn)
+            self._count_destinations(
+                scenario_subs,
+                conn,
+                counting=counting,
+                cache_schema=self.config.bna.get("cache_schema"),
+                reuse=True,
+                fingerprints=fingerprints
+            )
+            self._run_sql_script("06_insert_scenario.sql",scenario_subs,["sql","destinations"],conn=conn)
+            scenario_subs["columns"], scenario_subs["tables"] = self._affected_columns()
+            scenario_subs["update_filter"] = sql.SQL("scores.scenario = {}").format(scenario_subs["scenario_text"])
+            self._run_sql_script("05_update_affected.sql",scenario_subs,["sql","destinations"],conn=conn)
+            scenario_subs["scores_where"] = sql.SQL("""
+                WHERE
+                    scenario = {}
+                    AND {} IN (SELECT block_id FROM pg_temp.tmp_affected)
+            """).format(scenario_subs["scenario_text"],self.sql_subs["blocks_id_col"])
+            self.aggregate_subcategories(self.destinations["overall"],scenario_subs,conn=conn)
+            conn.commit()
+
+        if close_conn:
+            conn.close()
+
+
+    def _affected_columns(self):
+        """
+        Builds the assignments and joins that copy the categories' workspace
+        tables into the scores of affected blocks (see 05_update_affected.sql)
+
+        returns:
+        tuple of composed SQL (columns, tables)
+        """
+        columns = list()
+        tables = sql.SQL("")
+        for name, destination in self.destinations.items():
+            if destination.has_count:
+                for col in ["hs","ls","score"]:
+                    columns.append(sql.SQL("{} = {}.{}").format(
+                        sql.Identifier(name + "_" + col),
+                        sql.Identifier(destination.workspace_table),
+                        sql.Identifier(col)
+                    ))
+                tables += sql.SQL("""
+                    LEFT JOIN {schema}.{table} ON affected.block_id = {table}.block_id
+                """).format(**{
+                    "schema": sql.Identifier(destination.workspace_schema),
+                    "table": sql.Identifier(destination.workspace_table)
+                })
+        return sql.SQL(",").join(columns), tables
+
+
+    def _count_all_connections(self,subs,conn,cache_schema=None,reuse=False,fingerprints=None):
+        """
+        Counts high and low stress destinations for every category in a
+        single pass over the connectivity table and writes the counts to each
+        category's workspace table (the same tables created by
+        DestinationCategory.count_connections)
+
+        Parameters
+        ----------
+        subs : dict
+            dictionary of sql substitutes
+        conn : psycopg2 connection object
+            a DB connection object
+        cache_schema : str, optional
+            schema to cache destination-block assignments in
+        reuse : bool, optional
+            reuse destination-block assignments made earlier on the same
+            connection
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+        """
+        dirs = ["sql","destinations","single_pass"]
+        categories = [
+            (name,destination) for name, destination in self.destinations.items()
+            if destination.has_count
+        ]
+
+        print("   ...collecting destinations")
+        self._run_sql_script("01_create_values.sql",subs,dirs,conn=conn)
+        for name, destination in categories:
+            category_subs = dict(subs)
+            category_subs.update(destination.sql_subs)
+            category_subs["category"] = sql.Literal(name)
+            if destination.config.method == "count":
+                destination.assign_blocks(category_subs,cache_schema=cache_schema,reuse=reuse,
+                                          fingerprints=fingerprints,conn=conn)
+                self._run_sql_script("02_count_values.sql",category_subs,dirs,conn=conn)
+            else:
+                self._run_sql_script("02_percentage_values.sql",category_subs,dirs,conn=conn)
+
+        print("   ...counting all categories")
+        self._run_sql_script("03_count_all.sql",subs,dirs,conn=conn)
+
+        for name, destination in categories:
+            category_subs = dict(subs)
+            category_subs.update(destination.sql_subs)
+            category_subs["category"] = sql.Literal(name)
+            if destination.config.method == "count":
+                category_subs["hs"] = sql.SQL("count_hs")
+                category_subs["ls"] = sql.SQL("count_ls")
+            else:
+                # cast the sums back to the type the per-category count gives
+                sum_type = self._sum_type(category_subs,conn)
+                category_subs["hs"] = sql.SQL("sum_hs::") + sql.SQL(sum_type)
+                category_subs["ls"] = sql.SQL("sum_ls::") + sql.SQL(sum_type)
+            self._run_sql_script("04_split_counts.sql",category_subs,dirs,conn=conn)
+
+        self._run_sql("DROP TABLE pg_temp.tmp_all_counts",subs,conn=conn)
+
+
+    def _sum_type(self,subs,conn):
+        """
+        Returns the database type of the sum of a percentage-based category's
+        values (i.e. the type of its hs and ls counts)
+
+        Parameters
+        ----------
+        subs : dict
+            sql substitutes including the category's substitutes
+        conn : psycopg2 connection object
+            a DB connection object
+
+        returns:
+        str
+        """
+        return self._run_sql(
+            "SELECT pg_typeof(SUM({val}))::TEXT FROM {destinations_schema}.{destinations_table} WHERE FALSE",
+            subs,
+            ret=True,
+            conn=conn
+        )[0][0]
+
+
+    def _sparse_score_counts(self,subs,conn,cache_schema=None,fingerprints=None):
+        """
+        Counts destinations for every category in memory using sparse
+        matrices of the connectivity (see scoring.sparse_destination_counts).
+        Returns counts in the same form as _fetch_score_counts.
+
+        Parameters
+        ----------
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        cache_schema : str, optional
+            schema to cache destination-block assignments in
+        fingerprints : dict, optional
+            table fingerprints already taken during this scoring call
+
+        returns:
+        dict with the "block_ids" and, for each destination with counts, a
+        dict of "hs" and "ls" arrays (NaN for NULL) and the database "type"
+        of the counts
+        """
+        rows = self._run_sql_script("04_block_ids.sql",subs,["sql","destinations"],ret=True,conn=conn)
+        block_ids = pd.Index([r[0] for r in rows])
+
+        print("   ...loading connectivity")
+        connections = self._copy_frame(
+            "SELECT source, target, low_stress FROM pg_temp.tmp_connectivity",
+            subs,
+            ["source","target","low_stress"],
+            conn
+        )
+        # ids are compared as text so that every table maps to the same index
+        index = pd.Index(pd.unique(pd.concat([
+            pd.Series(block_ids.astype(str)),
+            connections["source"],
+            connections["target"]
+        ],ignore_index=True)))
+        hs, ls = connectivity_matrices(
+            index.get_indexer(connections["source"]),
+            index.get_indexer(connections["target"]),
+            connections["low_stress"] == "t",
+            len(index)
+        )
+        del connections
+
+        print("   ...loading destinations")
+        counted = list()
+        valued = list()
+        counts = list()
+        values = list()
+        for name, destination in self.destinations.items():
+            if not destination.has_count:
+                continue
+            category_subs = dict(subs)
+            category_subs.update(destination.sql_subs)
+            if destination.config.method == "count":
+                destination.assign_blocks(category_subs,cache_schema=cache_schema,
+                                          fingerprints=fingerprints,conn=conn)
+                df = self._copy_frame(
+                    "SELECT dest_id, block_id FROM {dest_blocks_schema}.{dest_blocks_table}",
+                    category_subs,
+                    ["dest_id","block_id"],
+                    conn
+                )
+                blocks = index.get_indexer(df["block_id"])
+                counts.append((df["dest_id"].to_numpy()[blocks >= 0],blocks[blocks >= 0]))
+                counted.append(name)
+            else:
+                df = self._copy_frame(
+                    """
+                        SELECT {destinations_id_col}, {val}
+                        FROM {destinations_schema}.{destinations_table} destinations
+                        WHERE {destinations_filter}
+                    """,
+                    category_subs,
+                    ["id","val"],
+                    conn
+                )
+                blocks = index.get_indexer(df["id"])
+                vals = pd.to_numeric(df["val"]).to_numpy(dtype=float)
+                values.append((blocks[blocks >= 0],vals[blocks >= 0]))
+                valued.append((name,self._sum_type(category_subs,conn)))
+
+        print("   ...counting all categories")
+        count_results, value_results = sparse_destination_counts(hs,ls,counts,values)
+
+        rows = index.get_indexer(block_ids.astype(str))
+        results = {
+            "block_ids": block_ids,
+            "destinations": dict()
+        }
+        for name, (hs_totals, ls_totals) in zip(counted,count_results):
+            results["destinations"][name] = {
+                "hs": hs_totals[rows],
+                "ls": ls_totals[rows],
+                "type": "bigint"
+            }
+        for (name, dtype), (hs_totals, ls_totals) in zip(valued,value_results):
+            results["destinations"][name] = {
+                "hs": hs_totals[rows],
+                "ls": ls_totals[rows],
+                "type": dtype
+            }
+
+        # keep the categories in the same order as _fetch_score_counts
+        results["destinations"] = {
+            name: results["destinations"][name]
+            for name in self.destinations
+            if name in results["destinations"]
+        }
+        return results
+
+
+    def _copy_frame(self,query,subs,columns,conn):
+        """
+        Reads the results of a query into a DataFrame with COPY. All values
+        are read as text.
+
+        Parameters
+        ----------
+        query : str
+            the query (without a trailing semicolon)
+        subs : dict
+            sql substitutes
+        columns : list
+            column names for the DataFrame
+        conn : psycopg2 connection object
+            a DB connection object
+
+        returns:
+        pandas DataFrame
+        """
+        buf = io.StringIO()
+        cur = conn.cursor()
+        cur.copy_expert(
+            sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT CSV)").format(
+                sql.SQL(query).format(**subs)
+            ).as_string(conn),
+            buf
+        )
+        cur.close()
+        buf.seek(0)
+        return pd.read_csv(buf,header=None,names=columns,dtype=str,keep_default_na=False,na_values=[""])
+
+
+    @phase("score")
+    def rescore(self,output_table,with_geoms=False,overwrite=False):
+        """
+        Recalculates block scores from the destination counts kept by the
+        last call to score(engine="numpy"), using the current breaks and
+        weights. Change these in the destination categories first, e.g.
+            bna.destinations["schools"].config.breaks = {1: 50, 2: 30}
+            bna.destinations["opportunity"].config.weight = 25
+
+        Parameters
+        ----------
+        output_table : str
+            table to create (optionally schema-qualified)
+        with_geoms : bool, optional
+            copy the block geometries to the output table
+        overwrite : bool, optional
+            overwrite a pre-existing table
+        """
+        if self._score_counts is None:
+            raise ValueError("No destination counts found. Run score() with engine=\"numpy\" first.")
+
+        # weights may have changed
+        for name, destination in self.destinations.items():
+            if destination.has_subcats:
+                destination.maxpoints = self._get_maxpoints(destination)
+
+        subs = dict(self.sql_subs)
+        schema, table = self.parse_table_name(output_table)
+        if schema is None:
+            schema = self.get_default_schema()
+        subs["scores_schema"] = sql.Identifier(schema)
+        subs["scores_table"] = sql.Identifier(table)
+
+        conn = self.get_db_connection()
+        if overwrite:
+            self.drop_table(table=table,schema=schema,conn=conn)
+        elif self.table_exists(output_table):
+            raise psycopg2.ProgrammingError("Table {} already exists".format(output_table))
+
+        self._write_scores(self._score_counts,subs,conn)
         if with_geoms:
             self._copy_block_geoms(conn,subs)
 
@@ -199,6 +1222,148 @@ class Destinations(DBUtils):
         conn.close()
 
 
+    def _fetch_score_counts(self,subs,conn):
+        """
+        Reads the high and low stress destination counts from the workspace
+        tables into arrays aligned to the blocks being scored
+
+        Parameters
+        ----------
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+
+        returns:
+        dict with the "block_ids" and, for each destination with counts, a
+        dict of "hs" and "ls" arrays (NaN for NULL) and the database "type"
+        of the counts
+        """
+        rows = self._run_sql_script("04_block_ids.sql",subs,["sql","destinations"],ret=True,conn=conn)
+        block_ids = pd.Index([r[0] for r in rows])
+        counts = {
+            "block_ids": block_ids,
+            "destinations": dict()
+        }
+
+        cur = conn.cursor()
+        for name, destination in self.destinations.items():
+            if not destination.has_count:
+                continue
+            dest_subs = {
+                "schema": sql.Identifier(destination.workspace_schema),
+                "table": sql.Identifier(destination.workspace_table)
+            }
+            cur.execute(sql.SQL("""
+                SELECT format_type(atttypid,atttypmod)
+                FROM pg_attribute
+                WHERE
+                    attrelid = '{schema}.{table}'::REGCLASS
+                    AND attname = 'hs'
+            """).format(**dest_subs))
+            dtype = cur.fetchone()[0]
+            cur.execute(sql.SQL("SELECT block_id, hs, ls FROM {schema}.{table}").format(**dest_subs))
+            df = pd.DataFrame(cur.fetchall(),columns=["block_id","hs","ls"])
+            df = df.set_index("block_id").reindex(block_ids)
+            counts["destinations"][name] = {
+                "hs": df["hs"].to_numpy(dtype=float,na_value=np.nan),
+                "ls": df["ls"].to_numpy(dtype=float,na_value=np.nan),
+                "type": dtype
+            }
+        cur.close()
+
+        return counts
+
+
+    def _write_scores(self,counts,subs,conn):
+        """
+        Scores each destination in memory and writes the output table with a
+        single COPY. The table matches the one built by 04_all_combined.sql
+        and aggregate_subcategories.
+
+        Parameters
+        ----------
+        counts : dict
+            destination counts from _fetch_score_counts
+        subs : dict
+            list of SQL substitutions from the parent method
+        conn : psycopg2 connection object
+            psycopg2 connection object from the parent method
+        """
+        scores = dict()
+        for name, dest_counts in counts["destinations"].items():
+            destination = self.destinations[name]
+            scores[name] = break_score(
+                dest_counts["hs"],
+                dest_counts["ls"],
+                destination.config.breaks,
+                destination.maxpoints,
+                destination.config.method
+            )
+        self._combine_subcategory_scores(self.destinations["overall"],scores)
+
+        id_col = subs["blocks_id_col"].string
+        data = {id_col: counts["block_ids"]}
+        columns = [sql.SQL("{} {} PRIMARY KEY").format(sql.Identifier(id_col),subs["blocks_id_type"])]
+        for name, destination in self.destinations.items():
+            if name not in counts["destinations"]:
+                continue
+            dest_counts = counts["destinations"][name]
+            for k in ["hs","ls"]:
+                if dest_counts["type"] in ("smallint","integer","bigint"):
+                    data[name+"_"+k] = pd.array(dest_counts[k]).astype("Int64")
+                else:
+                    data[name+"_"+k] = dest_counts[k]
+                columns.append(sql.SQL("{} {}").format(
+                    sql.Identifier(name+"_"+k),
+                    sql.SQL(dest_counts["type"])
+                ))
+            data[name+"_score"] = scores[name]
+            columns.append(sql.SQL("{} FLOAT").format(sql.Identifier(name+"_score")))
+        for name, destination in self.destinations.items():
+            if destination.has_subcats:
+                data[name+"_score"] = scores[name]
+                columns.append(sql.SQL("{} FLOAT").format(sql.Identifier(name+"_score")))
+
+        buf = io.StringIO()
+        pd.DataFrame(data).to_csv(buf,index=False,header=False,na_rep="")
+        buf.seek(0)
+
+        subs["columns"] = sql.SQL(",").join(columns)
+        cur = conn.cursor()
+        cur.execute(sql.SQL("CREATE TABLE {scores_schema}.{scores_table} ({columns})").format(**subs))
+        cur.copy_expert(
+            sql.SQL("COPY {scores_schema}.{scores_table} FROM STDIN WITH (FORMAT CSV)").format(**subs).as_string(conn),
+            buf
+        )
+        cur.close()
+
+
+    def _combine_subcategory_scores(self,destination,scores):
+        """
+        Calculates category scores from their subcategories in memory (see
+        aggregate_subcategories), adding them to scores
+
+        Parameters
+        ----------
+        destination : DestinationCategory
+            the destination to calculate subcategory scores for
+        scores : dict
+            destination name -> array of scores
+        """
+        if "subcats" in destination.config:
+            for subcat in destination.config.subcats:
+                self._combine_subcategory_scores(self.destinations[subcat["name"]],scores)
+
+            subcats = [self.destinations[subcat["name"]] for subcat in destination.config.subcats]
+            scores[destination.config.name] = combine_scores(
+                [scores[d.config.name] for d in subcats],
+                [d.config.weight for d in subcats],
+                [d.maxpoints for d in subcats],
+                destination.maxpoints
+            )
+
+
     def aggregate_subcategories(self,destination,subs,conn):
         """
         Iteratively calculates category scores from all component subcategories
@@ -210,7 +1375,8 @@ class Destinations(DBUtils):
         destination : str
             the destination to calculate subcategory scores for
         subs : dict
-            list of SQL substitutions from the parent method
+            list of SQL substitutions from the parent method (scores_where
+            optionally limits the blocks that are updated)
         conn : psycopg2 connection object
             psycopg2 connection object from the parent method
         """
@@ -249,6 +1415,7 @@ class Destinations(DBUtils):
             subs["numerator"] = sql.SQL(" + ").join(num)
             subs["denominator"] = sql.SQL(" + ").join(den)
             subs["maxpoints"] = sql.Literal(destination.maxpoints)
+            subs.setdefault("scores_where",sql.SQL(""))
             q = sql.SQL("""
                 update {scores_schema}.{scores_table}
                 set
@@ -258,6 +1425,7 @@ class Destinations(DBUtils):
                             when {check_zero} then 0
                             else {maxpoints} * ({numerator})::FLOAT/({denominator})
                             end
+                {scores_where}
             """).format(**subs)
 
             self._run_sql(q.as_string(conn),conn=conn)
@@ -317,7 +1485,9 @@ class Destinations(DBUtils):
         self._run_sql_script("05_add_geoms.sql",subs,["sql","destinations"],conn=conn)
 
 
-    def aggregate(self,output_table,scores_table,scenario_name="base",overwrite=False):
+    @phase("aggregate")
+    def aggregate(self,output_table,scores_table,scenario_name="base",overwrite=False,
+                  single_pass=False):
         """
         Creates a new db table of aggregate scores for the entire area
 
@@ -331,7 +1501,14 @@ class Destinations(DBUtils):
             scenario name to be included with these scores
         overwrite : bool, optional
             overwrite a pre-existing table
+        single_pass : bool, optional
+            aggregate every category in one pass over the scores table (see
+            aggregate_scenarios)
         """
+        if single_pass:
+            self.aggregate_scenarios(output_table,{scenario_name: scores_table},overwrite=overwrite)
+            return
+
         # make a copy of sql substitutes
         subs = dict(self.sql_subs)
 
@@ -384,6 +1561,190 @@ class Destinations(DBUtils):
         conn.commit()
         conn.close()
 
+    def aggregate_scenarios(self,output_table,scores_tables,overwrite=False):
+        """
+        Calculates aggregate scores for many scenarios in a single pass over
+        their block scores and adds them to the table of aggregate scores,
+        replacing any earlier results for the same scenarios. Gives the same
+        results as calling aggregate() for each scenario.
+
+        Parameters
+        ----------
+        output_table : str
+            table of aggregate scores (optionally schema-qualified), created
+            if it doesn't exist
+        scores_tables : str or dict
+            either a long-format table of block scores with a scenario column
+            (e.g. from score_scenarios) or a dict of scenario name -> table
+            of block scores
+        overwrite : bool, optional
+            overwrite a pre-existing table instead of adding to it
+        """
+        subs = dict(self.sql_subs)
+
+        agg_schema, agg_table = self.parse_table_name(output_table)
+        if agg_schema is None:
+            agg_schema = self.get_default_schema()
+        subs["agg_schema"] = sql.Identifier(agg_schema)
+        subs["agg_table"] = sql.Identifier(agg_table)
+
+        columns = [sql.Identifier(c) for c in self._aggregate_columns(self.destinations["overall"])]
+        subs["columns"] = sql.SQL(",").join(columns)
+        subs["aggregates"] = sql.SQL(",").join([
+            sql.SQL("SUM(COALESCE(scores.{col},0) * scores.ratio) AS {col}").format(col=c)
+            for c in columns
+        ])
+        subs["add_columns"] = sql.SQL(",").join([
+            sql.SQL("ADD COLUMN IF NOT EXISTS {} FLOAT").format(c)
+            for c in columns
+        ])
+
+        # the block scores of every scenario
+        if isinstance(scores_tables,str):
+            scores_tables = {None: scores_tables}
+        queries = list()
+        for i, (scenario_name, scores_table) in enumerate(scores_tables.items()):
+            if not self.table_exists(scores_table):
+                raise ValueError("Could not find table {}".format(scores_table))
+            scores_schema, scores_table = self.parse_table_name(scores_table)
+            if scores_schema is None:
+                scores_schema = self.get_schema(scores_table)
+            if scenario_name is None:
+                scenario = sql.SQL("scenario::TEXT")
+            else:
+                scenario = sql.Literal(str(scenario_name))
+            queries.append(sql.SQL("""
+                SELECT
+                    {scenario} AS scenario,
+                    {order} AS scenario_order,
+                    {blocks_id_col},
+                    {columns}
+                FROM {scores_schema}.{scores_table}
+            """).format(
+                scenario=scenario,
+                order=sql.Literal(i),
+                blocks_id_col=subs["blocks_id_col"],
+                columns=subs["columns"],
+                scores_schema=sql.Identifier(scores_schema),
+                scores_table=sql.Identifier(scores_table)
+            ))
+        subs["scores_query"] = sql.SQL(" UNION ALL ").join(queries)
+
+        conn = self.get_db_connection()
+        if overwrite:
+            self.drop_table(table=agg_table,schema=agg_schema,conn=conn)
+        if overwrite or not self.table_exists(output_table):
+            self._run_sql_script("01_make_table.sql",subs,["sql","aggregate"],conn=conn)
+
+        print("Aggregating scores")
+        self._run_sql_script("20_aggregate_all.sql",subs,["sql","aggregate"],conn=conn)
+
+        conn.commit()
+        conn.close()
+
+
+    def _aggregate_columns(self,destination):
+        """
+        Lists the score columns of a category and its subcategories in the
+        order aggregate() adds them to the table of aggregate scores
+
+        Parameters
+        ----------
+        destination : DestinationCategory
+            the category
+
+        returns:
+        list of column names
+        """
+        columns = list()
+        if "subcats" in destination.config:
+            for subcat in destination.config.subcats:
+                columns.extend(self._aggregate_columns(self.destinations[subcat["name"]]))
+        columns.append(destination.config.name + "_score")
+        return columns
+
+
+    def estimate_sampling_error(self,scores_table,fraction=None,z=1.96):
+        """
+        Estimates the uncertainty of aggregate scores calculated from a
+        sample of blocks (see calculate_sampled_connectivity). Each score is
+        treated as a population-weighted ratio estimate, matching aggregate().
+
+        Parameters
+        ----------
+        scores_table : str
+            table holding block scores for the sampled blocks (optionally
+            schema-qualified)
+        fraction : float, optional
+            share of blocks that were sampled, used for the finite population
+            correction (if none no correction is applied)
+        z : float, optional
+            z-score for the confidence interval (default 1.96 for 95%)
+
+        returns:
+        dict of score column -> dict with the estimate, its standard error,
+        and the bounds of the confidence interval
+        """
+        subs = dict(self.sql_subs)
+        if not self.table_exists(scores_table):
+            raise ValueError("Could not find table {}".format(scores_table))
+        scores_schema, scores_table = self.parse_table_name(scores_table)
+        if scores_schema is None:
+            scores_schema = self.get_schema(scores_table)
+        subs["scores_schema"] = sql.Identifier(scores_schema)
+        subs["scores_table"] = sql.Identifier(scores_table)
+
+        conn = self.get_db_connection()
+        cur = conn.cursor()
+        cur.execute(sql.SQL("""
+            SELECT
+                COALESCE(blocks.{blocks_population_col},0)::FLOAT AS _population,
+                scores.*
+            FROM
+                {scores_schema}.{scores_table} scores,
+                {blocks_schema}.{blocks_table} blocks
+            WHERE scores.{blocks_id_col} = blocks.{blocks_id_col}
+        """).format(**subs))
+        columns = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+
+        n = len(rows)
+        if n < 2:
+            raise ValueError("At least two sampled blocks are needed to estimate error")
+        weights = np.array([row[0] for row in rows],dtype=np.float64)
+        total = weights.sum()
+        if total == 0:
+            raise ValueError("Sampled blocks have no population")
+        if fraction is None:
+            correction = 1.0
+        else:
+            correction = 1.0 - fraction
+
+        errors = dict()
+        for i, column in enumerate(columns):
+            if not column.endswith("_score"):
+                continue
+            values = np.array([0 if row[i] is None else row[i] for row in rows],dtype=np.float64)
+            estimate = (weights*values).sum() / total
+            residuals = weights*(values-estimate)
+            variance = correction * n/(n-1.0) * (residuals**2).sum() / total**2
+            se = float(np.sqrt(variance))
+            errors[column] = {
+                "estimate": float(estimate),
+                "standard_error": se,
+                "lower": float(estimate) - z*se,
+                "upper": float(estimate) + z*se
+            }
+
+        if self.verbose:
+            for column, e in errors.items():
+                print("{}: {:.2f} +/- {:.2f}".format(column,e["estimate"],z*e["standard_error"]))
+
+        return errors
+
+
     def _aggregate_category_score(self,destination,subs,add_columns,conn):
         """
         Iteratively calculates aggregate category scores.
@@ -0,0 +1,1177 @@
+###################################################################
+# In-process routing engine for connectivity calculations. Holds the
+# BNA network in memory and replaces the pgr_drivingdistance step
+# with a bounded Dijkstra search that stops as soon as every
+# candidate destination block has been settled.
+###################################################################
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+HIGH_STRESS = 99
+SNAPSHOT_VERSION = 1
+
+
+class RoutingGraph:
+    """Directed, weighted graph of BNA network edges held in memory"""
+
+    def __init__(self,node_ids,offsets,targets,costs,stresses):
+        """
+        Stores the network in compressed sparse row (CSR) form. The outgoing
+        edges of the node at index i are found at positions offsets[i] to
+        offsets[i+1] of the targets, costs, and stresses arrays.
+
+        Parameters
+        ----------
+        node_ids : numpy array
+            sorted array of node ids
+        offsets : numpy array
+            CSR row offsets (one longer than node_ids)
+        targets : numpy array
+            index (into node_ids) of the target of each edge
+        costs : numpy array
+            cost of each edge
+        stresses : numpy array
+            stress of each edge
+        """
+        self.node_ids = node_ids
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+        self.stresses = stresses
+        self._masks = dict()
+
+
+    def __repr__(self):
+        return "RoutingGraph  |  {} nodes  |  {} edges".format(len(self.node_ids),len(self.targets))
+
+
+    @classmethod
+    def from_edges(cls,edges):
+        """
+        Builds a graph from an iterable of edges
+
+        Parameters
+        ----------
+        edges : iterable
+            iterable of (source, target, cost, stress) tuples
+
+        returns:
+        RoutingGraph
+        """
+        edges = list(edges)
+        if len(edges) == 0:
+            empty = np.array([],dtype=np.int64)
+            return cls(empty,np.zeros(1,dtype=np.int64),empty,np.array([],dtype=np.float64),empty)
+
+        sources = np.array([e[0] for e in edges],dtype=np.int64)
+        targets = np.array([e[1] for e in edges],dtype=np.int64)
+        costs = np.array([e[2] for e in edges],dtype=np.float64)
+        stresses = np.array([-1 if e[3] is None else e[3] for e in edges],dtype=np.int64)
+
+        node_ids = np.unique(np.concatenate([sources,targets]))
+        source_idx = np.searchsorted(node_ids,sources)
+        target_idx = np.searchsorted(node_ids,targets)
+
+        order = np.argsort(source_idx,kind="stable")
+        counts = np.bincount(source_idx,minlength=len(node_ids))
+        offsets = np.zeros(len(node_ids)+1,dtype=np.int64)
+        np.cumsum(counts,out=offsets[1:])
+
+        return cls(node_ids,offsets,target_idx[order],costs[order],stresses[order])
+
+
+    def fingerprint(self):
+        """
+        Returns a dictionary summarizing the graph contents that can be used
+        to check whether data derived from the graph is still valid.
+        """
+        return {
+            "nodes": int(len(self.node_ids)),
+            "edges": int(len(self.targets)),
+            "cost": round(float(self.costs.sum()),3),
+            "stress": int(self.stresses.sum())
+        }
+
+
+    def stress_mask(self,max_stress):
+        """
+        Returns boolean masks selecting the edges with a stress greater than
+        zero and no greater than max_stress and the nodes touched by those
+        edges. Only the masks are cached on the graph so the CSR arrays
+        themselves can stay memory-mapped and shared between processes.
+
+        Parameters
+        ----------
+        max_stress : int
+            the highest stress to include
+
+        returns:
+        tuple of numpy arrays (edge mask, node mask)
+        """
+        if max_stress in self._masks:
+            return self._masks[max_stress]
+
+        edges = (self.stresses > 0) & (self.stresses <= max_stress)
+        nodes = np.zeros(len(self.node_ids),dtype=bool)
+        sources = np.repeat(np.arange(len(self.node_ids)),np.diff(self.offsets))
+        nodes[sources[edges]] = True
+        nodes[self.targets[edges]] = True
+
+        self._masks[max_stress] = (edges,nodes)
+        return self._masks[max_stress]
+
+
+    def node_index(self,node_id):
+        """
+        Returns the index of node_id in node_ids or None if the node isn't in
+        the graph
+
+        Parameters
+        ----------
+        node_id : int
+            the node id to look up
+
+        returns:
+        int or None
+        """
+        i = int(np.searchsorted(self.node_ids,node_id))
+        if i < len(self.node_ids) and self.node_ids[i] == node_id:
+            return i
+        return None
+
+
+    def adjacency(self,max_stress):
+        """
+        Returns the subgraph of edges with a stress greater than zero and no
+        greater than max_stress as a dictionary of node id -> list of
+        (target node id, cost) tuples. Every node touched by an edge in the
+        subgraph is a key in the dictionary. This copies the subgraph into
+        python objects so it's only meant for one-off preprocessing such as
+        building a ContractionHierarchy. Searches use the CSR arrays
+        directly (see block_costs).
+
+        Parameters
+        ----------
+        max_stress : int
+            the highest stress to include
+
+        returns:
+        dict
+        """
+        edge_mask, node_mask = self.stress_mask(max_stress)
+        sources = np.repeat(self.node_ids,np.diff(self.offsets))[edge_mask].tolist()
+        targets = self.node_ids[self.targets[edge_mask]].tolist()
+        costs = self.costs[edge_mask].tolist()
+
+        adj = {n: [] for n in self.node_ids[node_mask].tolist()}
+        for s, t, c in zip(sources,targets,costs):
+            adj[s].append((t,c))
+        return adj
+
+
+class NetworkSnapshot:
+    """
+    Binary copy of the network saved as a directory of .npy files that can be
+    memory-mapped by any process that needs to route
+    """
+
+    arrays = [
+        "node_ids",
+        "offsets",
+        "targets",
+        "costs",
+        "stresses",
+        "source_road_ids",
+        "target_road_ids",
+        "node_road_ids"
+    ]
+
+    def __init__(self,graph,source_road_ids,target_road_ids,node_road_ids,meta):
+        """
+        Parameters
+        ----------
+        graph : RoutingGraph
+            the network
+        source_road_ids : numpy array
+            road id of the source of each edge (in the graph's edge order)
+        target_road_ids : numpy array
+            road id of the target of each edge (in the graph's edge order)
+        node_road_ids : numpy array
+            road id of each node (aligned with graph.node_ids)
+        meta : dict
+            snapshot version and fingerprint of the edges table
+        """
+        self.graph = graph
+        self.source_road_ids = source_road_ids
+        self.target_road_ids = target_road_ids
+        self.node_road_ids = node_road_ids
+        self.meta = meta
+
+
+    def __repr__(self):
+        return "NetworkSnapshot v{}  |  {}".format(self.meta.get("version"),self.graph)
+
+
+    @classmethod
+    def from_rows(cls,edges,nodes,fingerprint):
+        """
+        Builds a snapshot from edge and node rows
+
+        Parameters
+        ----------
+        edges : iterable
+            iterable of (source, target, cost, stress, source road id,
+            target road id) tuples
+        nodes : iterable
+            iterable of (node id, road id) tuples
+        fingerprint : dict
+            fingerprint of the edges table (see DBUtils.get_table_fingerprint)
+
+        returns:
+        NetworkSnapshot
+        """
+        edges = list(edges)
+        graph = RoutingGraph.from_edges([e[:4] for e in edges])
+
+        # edges are stored in order of source node by from_edges
+        sources = np.array([e[0] for e in edges],dtype=np.int64)
+        order = np.argsort(np.searchsorted(graph.node_ids,sources),kind="stable")
+        source_road_ids = np.array([-1 if e[4] is None else e[4] for e in edges],dtype=np.int64)[order]
+        target_road_ids = np.array([-1 if e[5] is None else e[5] for e in edges],dtype=np.int64)[order]
+
+        node_road_ids = np.full(len(graph.node_ids),-1,dtype=np.int64)
+        for node_id, road_id in nodes:
+            i = np.searchsorted(graph.node_ids,node_id)
+            if i < len(graph.node_ids) and graph.node_ids[i] == node_id and road_id is not None:
+                node_road_ids[i] = road_id
+
+        meta = {"version": SNAPSHOT_VERSION, "fingerprint": fingerprint}
+        return cls(graph,source_road_ids,target_road_ids,node_road_ids,meta)
+
+
+    def save(self,path):
+        """
+        Writes the snapshot to a directory. The metadata file is written last
+        so an interrupted write leaves no valid snapshot behind.
+
+        Parameters
+        ----------
+        path : str
+            the directory to write to
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        meta_path = os.path.join(path,"snapshot.json")
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        for name in self.arrays:
+            if name in ("source_road_ids","target_road_ids","node_road_ids"):
+                array = getattr(self,name)
+            else:
+                array = getattr(self.graph,name)
+            np.save(os.path.join(path,name+".npy"),np.ascontiguousarray(array))
+
+        with open(meta_path,"w") as f:
+            json.dump(self.meta,f)
+
+
+    @classmethod
+    def load(cls,path,fingerprint=None,mmap=True):
+        """
+        Loads a snapshot written by save(). Returns None if there's no
+        snapshot at the path, it was written by a different version, or it
+        doesn't match the given fingerprint.
+
+        Parameters
+        ----------
+        path : str
+            the directory holding the snapshot
+        fingerprint : dict, optional
+            current fingerprint of the edges table
+        mmap : bool, optional
+            memory-map the arrays rather than reading them into memory
+
+        returns:
+        NetworkSnapshot or None
+        """
+        meta_path = os.path.join(path,"snapshot.json")
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            return None
+        if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+            return None
+
+        if mmap:
+            mmap_mode = "r"
+        else:
+            mmap_mode = None
+        arrays = {
+            name: np.load(os.path.join(path,name+".npy"),mmap_mode=mmap_mode)
+            for name in cls.arrays
+        }
+        graph = RoutingGraph(
+            arrays["node_ids"],
+            arrays["offsets"],
+            arrays["targets"],
+            arrays["costs"],
+            arrays["stresses"]
+        )
+        return cls(
+            graph,
+            arrays["source_road_ids"],
+            arrays["target_road_ids"],
+            arrays["node_road_ids"],
+            meta
+        )
+
+
+    def flip_stress(self,road_ids,stress):
+        """
+        Returns a copy of the graph with every edge that starts or ends on one
+        of the given roads set to the given stress (matches
+        25_flip_low_stress.sql). Other arrays are shared with the snapshot.
+
+        Parameters
+        ----------
+        road_ids : list
+            ids of roads to flip
+        stress : int
+            stress to assign
+
+        returns:
+        RoutingGraph
+        """
+        road_ids = np.array(list(road_ids),dtype=np.int64)
+        flip = np.isin(self.source_road_ids,road_ids) | np.isin(self.target_road_ids,road_ids)
+        return RoutingGraph(
+            self.graph.node_ids,
+            self.graph.offsets,
+            self.graph.targets,
+            self.graph.costs,
+            np.where(flip,stress,self.graph.stresses)
+        )
+
+
+def contract_chains(edges,keep_nodes):
+    """
+    Collapses chains of degree-2 nodes into single edges. A node is removed if
+    it isn't in keep_nodes and either
+        1) it has one incoming and one outgoing edge to different neighbors
+           (a one-way chain), or
+        2) it has incoming and outgoing edges to exactly two neighbors (a
+           two-way chain)
+    and the edges passing through it in each direction share the same stress.
+    Costs along a chain are summed, so shortest path costs between the
+    remaining nodes are unchanged for any stress threshold.
+
+    Parameters
+    ----------
+    edges : iterable
+        iterable of (edge id, source, target, cost, stress) tuples
+    keep_nodes : set
+        node ids that must not be removed (e.g. nodes attached to blocks)
+
+    returns:
+    list of (source, target, cost, stress, list of edge ids) tuples
+    """
+    contracted = dict()
+    ins = dict()
+    outs = dict()
+    next_key = 0
+
+    def add(source,target,cost,stress,edge_ids):
+        nonlocal next_key
+        key = next_key
+        next_key += 1
+        contracted[key] = (source,target,cost,stress,edge_ids)
+        outs.setdefault(source,set()).add(key)
+        ins.setdefault(target,set()).add(key)
+        outs.setdefault(target,set())
+        ins.setdefault(source,set())
+
+    def remove(key):
+        source, target = contracted[key][0], contracted[key][1]
+        outs[source].discard(key)
+        ins[target].discard(key)
+        del contracted[key]
+
+    for edge_id, source, target, cost, stress in edges:
+        add(source,target,cost,stress,[edge_id])
+
+    for v in list(outs.keys()):
+        if v in keep_nodes:
+            continue
+        v_in = [contracted[k] + (k,) for k in ins[v]]
+        v_out = [contracted[k] + (k,) for k in outs[v]]
+
+        # one-way chain
+        if len(v_in) == 1 and len(v_out) == 1:
+            e1, e2 = v_in[0], v_out[0]
+            u, w = e1[0], e2[1]
+            if u == v or w == v or u == w or e1[3] != e2[3]:
+                continue
+            remove(e1[5])
+            remove(e2[5])
+            add(u,w,e1[2]+e2[2],e1[3],e1[4]+e2[4])
+
+        # two-way chain
+        elif len(v_in) == 2 and len(v_out) == 2:
+            in_from = {e[0]: e for e in v_in}
+            out_to = {e[1]: e for e in v_out}
+            if len(in_from) != 2 or set(in_from.keys()) != set(out_to.keys()) or v in in_from:
+                continue
+            u, w = in_from.keys()
+            forward = (in_from[u],out_to[w])
+            backward = (in_from[w],out_to[u])
+            if forward[0][3] != forward[1][3] or backward[0][3] != backward[1][3]:
+                continue
+            for e1, e2 in (forward,backward):
+                remove(e1[5])
+                remove(e2[5])
+                add(e1[0],e2[1],e1[2]+e2[2],e1[3],e1[4]+e2[4])
+
+    return list(contracted.values())
+
+
+def block_costs(graph,max_stress,sources,node_blocks,max_cost,block_bounds=None,
+                early_termination=True):
+    """
+    Multi-source Dijkstra search that returns the lowest cost to each block
+    reachable within max_cost. This matches pgr_drivingdistance with
+    equicost followed by taking the minimum cost over each block's nodes.
+
+    If early_termination is set the search stops as soon as every candidate
+    block has been settled or when the cost at the front of the search exceeds
+    the bound of every unsettled block.
+
+    The search runs on node indices over the graph's CSR arrays so nothing
+    is copied out of a (possibly memory-mapped) graph.
+
+    Parameters
+    ----------
+    graph : RoutingGraph
+        the network to route on
+    max_stress : int
+        the highest stress in the subgraph to route on
+    sources : iterable
+        node ids to start the search from
+    node_blocks : dict
+        node id -> list of ids of the candidate blocks the node belongs to
+    max_cost : float
+        the largest cost to search
+    block_bounds : dict, optional
+        block id -> the largest cost at which that block is still of interest.
+        Blocks not in the dict are bounded by max_cost. If given, only blocks
+        in the dict are candidates for early termination.
+    early_termination : bool, optional
+        stop searching once the candidate blocks have been resolved
+
+    returns:
+    dict of block id -> cost
+    """
+    costs = dict()
+    edge_mask, node_mask = graph.stress_mask(max_stress)
+    sources = [graph.node_index(s) for s in sources]
+    sources = [s for s in sources if s is not None and node_mask[s]]
+    if len(sources) == 0:
+        return costs
+
+    index_blocks = dict()
+    for node_id, blocks in node_blocks.items():
+        i = graph.node_index(node_id)
+        if i is not None:
+            index_blocks[i] = blocks
+
+    if block_bounds is None:
+        pending = set(b for blocks in node_blocks.values() for b in blocks)
+        bounds = [(-max_cost,b) for b in pending]
+    else:
+        pending = set(block_bounds.keys())
+        bounds = [(-min(max_cost,bound),b) for b, bound in block_bounds.items()]
+    heapq.heapify(bounds)
+
+    # memoryviews index without copying and yield plain python numbers
+    offsets = memoryview(graph.offsets)
+    targets = memoryview(graph.targets)
+    edge_costs = memoryview(graph.costs)
+    edge_mask = memoryview(edge_mask)
+    dist = dict()
+    heap = [(0,s) for s in sources]
+    heapq.heapify(heap)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u in dist:
+            continue
+        if early_termination:
+            # drop settled blocks from the top of the bounds heap
+            while bounds and bounds[0][1] not in pending:
+                heapq.heappop(bounds)
+            if not bounds or d > -bounds[0][0]:
+                break
+        dist[u] = d
+
+        if u in index_blocks:
+            for b in index_blocks[u]:
+                if b not in costs:
+                    costs[b] = d
+                    pending.discard(b)
+
+        lo = offsets[u]
+        hi = offsets[u+1]
+        for v, c, keep in zip(targets[lo:hi],edge_costs[lo:hi],edge_mask[lo:hi]):
+            nd = d + c
+            if keep and nd <= max_cost and v not in dist:
+                heapq.heappush(heap,(nd,v))
+
+    return costs
+
+
+def node_costs(graph,max_stress,source,max_cost):
+    """
+    Single-source Dijkstra search that returns the lowest cost to every node
+    reachable from source within max_cost.
+
+    Parameters
+    ----------
+    graph : RoutingGraph
+        the network to route on
+    max_stress : int
+        the highest stress in the subgraph to route on
+    source : int
+        node id to start the search from
+    max_cost : float
+        the largest cost to search
+
+    returns:
+    dict of node id -> cost
+    """
+    dist = dict()
+    edge_mask, node_mask = graph.stress_mask(max_stress)
+    source = graph.node_index(source)
+    if source is None or not node_mask[source]:
+        return dist
+    offsets = memoryview(graph.offsets)
+    targets = memoryview(graph.targets)
+    edge_costs = memoryview(graph.costs)
+    edge_mask = memoryview(edge_mask)
+    heap = [(0,source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u in dist:
+            continue
+        dist[u] = d
+        lo = offsets[u]
+        hi = offsets[u+1]
+        for v, c, keep in zip(targets[lo:hi],edge_costs[lo:hi],edge_mask[lo:hi]):
+            nd = d + c
+            if keep and nd <= max_cost and v not in dist:
+                heapq.heappush(heap,(nd,v))
+    return dict(zip(graph.node_ids[list(dist.keys())].tolist(),dist.values()))
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over the edges of a network up to a given stress
+    for answering bounded one-to-many cost queries
+    """
+
+    def __init__(self,node_ids,rank,up_offsets,up_targets,up_costs,
+                 down_offsets,down_targets,down_costs,max_cost,meta=None):
+        """
+        Both halves of the hierarchy are stored in CSR form (see RoutingGraph)
+        with targets given as indices into node_ids. The up graph holds edges
+        leading to higher ranked nodes, the down graph holds reversed edges
+        leading from higher ranked nodes.
+
+        Parameters
+        ----------
+        node_ids : numpy array
+            sorted array of node ids
+        rank : numpy array
+            the order in which each node was contracted
+        up_offsets, up_targets, up_costs : numpy arrays
+            CSR arrays of the upward graph
+        down_offsets, down_targets, down_costs : numpy arrays
+            CSR arrays of the reversed downward graph
+        max_cost : float
+            the largest cost the hierarchy can answer queries for (shortcuts
+            longer than this were not created)
+        meta : dict, optional
+            information about how the hierarchy was built
+        """
+        self.node_ids = node_ids
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_costs = up_costs
+        self.down_offsets = down_offsets
+        self.down_targets = down_targets
+        self.down_costs = down_costs
+        self.max_cost = max_cost
+        if meta is None:
+            meta = dict()
+        self.meta = meta
+        self._index = None
+        self._rank = None
+        self._up = None
+        self._down = None
+
+
+    def __repr__(self):
+        return "ContractionHierarchy  |  {} nodes  |  {} up edges  |  {} down edges".format(
+            len(self.node_ids),len(self.up_targets),len(self.down_targets)
+        )
+
+
+    @classmethod
+    def from_adjacency(cls,adj,max_cost,witness_limit=100,meta=None):
+        """
+        Builds a hierarchy by contracting nodes in order of importance
+        (edge difference plus the number of already contracted neighbors).
+        Priorities are updated lazily. A shortcut is added around a contracted
+        node unless a witness path of equal or lower cost is found by a local
+        search limited to witness_limit settled nodes. Shortcuts costing more
+        than max_cost are never needed and are skipped.
+
+        Parameters
+        ----------
+        adj : dict
+            adjacency dictionary as returned by RoutingGraph.adjacency
+        max_cost : float
+            the largest cost that will be queried
+        witness_limit : int, optional
+            number of nodes to settle in each witness search. Lower values
+            build faster but add more (unneeded) shortcuts.
+        meta : dict, optional
+            information to store with the hierarchy
+
+        returns:
+        ContractionHierarchy
+        """
+        start = time.time()
+        node_ids = np.array(sorted(adj.keys()),dtype=np.int64)
+        index = {n: i for i, n in enumerate(node_ids.tolist())}
+        n = len(node_ids)
+
+        out_e = [dict() for _ in range(n)]
+        in_e = [dict() for _ in range(n)]
+        for s, edges in adj.items():
+            i = index[s]
+            for t, c in edges:
+                j = index[t]
+                if i == j or c > max_cost:
+                    continue
+                if j not in out_e[i] or c < out_e[i][j]:
+                    out_e[i][j] = c
+                    in_e[j][i] = c
+
+        def witness(u,v,limit):
+            # bounded search from u that avoids v
+            dist = dict()
+            heap = [(0,u)]
+            while heap and len(dist) < witness_limit:
+                d, x = heapq.heappop(heap)
+                if x in dist:
+                    continue
+                dist[x] = d
+                for y, c in out_e[x].items():
+                    nd = d + c
+                    if y != v and nd <= limit and y not in dist:
+                        heapq.heappush(heap,(nd,y))
+            return dist
+
+        def shortcuts(v):
+            found = list()
+            for u, cu in in_e[v].items():
+                candidates = {
+                    w: cu + cw for w, cw in out_e[v].items()
+                    if w != u and cu + cw <= max_cost
+                }
+                if len(candidates) == 0:
+                    continue
+                dist = witness(u,v,max(candidates.values()))
+                for w, c in candidates.items():
+                    if w not in dist or dist[w] > c:
+                        found.append((u,w,c))
+            return found
+
+        deleted = [0]*n
+        def priority(v,found):
+            return len(found) - len(in_e[v]) - len(out_e[v]) + deleted[v]
+
+        heap = [(priority(v,shortcuts(v)),v) for v in range(n)]
+        heapq.heapify(heap)
+        rank = np.zeros(n,dtype=np.int64)
+        order = 0
+        up = [None]*n
+        down = [None]*n
+        while heap:
+            p, v = heapq.heappop(heap)
+            found = shortcuts(v)
+            new_p = priority(v,found)
+            if heap and new_p > heap[0][0]:
+                heapq.heappush(heap,(new_p,v))
+                continue
+
+            # contract v, all remaining neighbors rank higher
+            rank[v] = order
+            order += 1
+            up[v] = list(out_e[v].items())
+            down[v] = list(in_e[v].items())
+            for w in out_e[v]:
+                del in_e[w][v]
+                deleted[w] += 1
+            for u in in_e[v]:
+                del out_e[u][v]
+                deleted[u] += 1
+            for u, w, c in found:
+                if w not in out_e[u] or c < out_e[u][w]:
+                    out_e[u][w] = c
+                    in_e[w][u] = c
+            out_e[v] = dict()
+            in_e[v] = dict()
+
+        if meta is None:
+            meta = dict()
+        meta["max_cost"] = max_cost
+        meta["build_time"] = time.time() - start
+        up_arrays = cls._to_csr(up)
+        down_arrays = cls._to_csr(down)
+        return cls(node_ids,rank,*up_arrays,*down_arrays,max_cost=max_cost,meta=meta)
+
+
+    @staticmethod
+    def _to_csr(rows):
+        """
+        Converts a list of lists of (index, cost) tuples to CSR arrays
+        """
+        offsets = np.zeros(len(rows)+1,dtype=np.int64)
+        np.cumsum([len(r) for r in rows],out=offsets[1:])
+        targets = np.array([t for r in rows for t, c in r],dtype=np.int64)
+        costs = np.array([c for r in rows for t, c in r],dtype=np.float64)
+        return offsets, targets, costs
+
+
+    def save(self,path):
+        """
+        Saves the hierarchy to a .npz file
+
+        Parameters
+        ----------
+        path : str
+            the file to save to
+        """
+        np.savez(
+            path,
+            node_ids=self.node_ids,
+            rank=self.rank,
+            up_offsets=self.up_offsets,
+            up_targets=self.up_targets,
+            up_costs=self.up_costs,
+            down_offsets=self.down_offsets,
+            down_targets=self.down_targets,
+            down_costs=self.down_costs,
+            max_cost=np.array(self.max_cost),
+            meta=np.array(json.dumps(self.meta))
+        )
+
+
+    @classmethod
+    def load(cls,path):
+        """
+        Loads a hierarchy saved with save()
+
+        Parameters
+        ----------
+        path : str
+            the file to load
+
+        returns:
+        ContractionHierarchy
+        """
+        with np.load(path) as f:
+            return cls(
+                f["node_ids"],
+                f["rank"],
+                f["up_offsets"],
+                f["up_targets"],
+                f["up_costs"],
+                f["down_offsets"],
+                f["down_targets"],
+                f["down_costs"],
+                max_cost=float(f["max_cost"]),
+                meta=json.loads(str(f["meta"]))
+            )
+
+
+    def _prepare(self):
+        """
+        Unpacks the CSR arrays into lists for fast traversal
+        """
+        if self._index is not None:
+            return
+        # the index is set last, other threads take it as the sign of being ready
+        self._rank = self.rank.tolist()
+        self._up = self._from_csr(self.up_offsets,self.up_targets,self.up_costs)
+        self._down = self._from_csr(self.down_offsets,self.down_targets,self.down_costs)
+        self._index = {n: i for i, n in enumerate(self.node_ids.tolist())}
+
+
+    @staticmethod
+    def _from_csr(offsets,targets,costs):
+        offsets = offsets.tolist()
+        pairs = list(zip(targets.tolist(),costs.tolist()))
+        return [pairs[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+
+    @staticmethod
+    def _search(graph,sources,max_cost):
+        """
+        Dijkstra search on one half of the hierarchy
+        """
+        dist = dict()
+        heap = [(0,s) for s in sources]
+        heapq.heapify(heap)
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in dist:
+                continue
+            dist[u] = d
+            for v, c in graph[u]:
+                nd = d + c
+                if nd <= max_cost and v not in dist:
+                    heapq.heappush(heap,(nd,v))
+        return dist
+
+
+    def block_costs(self,sources,node_blocks,max_cost,block_bounds=None):
+        """
+        Returns the lowest cost to each block reachable within max_cost. Same
+        inputs and results as the block_costs function.
+
+        The query runs an upward search from the sources, then collects the
+        part of the hierarchy above the target nodes with a single backward
+        search and sweeps it from the highest ranked node down, relaxing the
+        downward edges (restricted PHAST).
+
+        Parameters
+        ----------
+        sources : iterable
+            node ids to start the search from
+        node_blocks : dict
+            node id -> list of ids of the candidate blocks the node belongs to
+        max_cost : float
+            the largest cost to search (no more than the max_cost of the
+            hierarchy)
+        block_bounds : dict, optional
+            block id -> the largest cost at which that block is still of
+            interest. If given, blocks not in the dict are skipped.
+
+        returns:
+        dict of block id -> cost
+        """
+        if max_cost > self.max_cost:
+            raise ValueError("Hierarchy was built for costs up to {}".format(self.max_cost))
+        self._prepare()
+
+        costs = dict()
+        sources = [self._index[s] for s in sources if s in self._index]
+        if len(sources) == 0:
+            return costs
+
+        targets = dict()
+        for node_id, blocks in node_blocks.items():
+            if node_id not in self._index:
+                continue
+            if block_bounds is not None:
+                blocks = [b for b in blocks if b in block_bounds]
+                if len(blocks) == 0:
+                    continue
+            targets[self._index[node_id]] = blocks
+        if len(targets) == 0:
+            return costs
+        if block_bounds is not None:
+            max_cost = min(max_cost,max(block_bounds.values()))
+
+        forward = self._search(self._up,sources,max_cost)
+        # every node on a path to a target within max_cost is found by a
+        # backward search from all targets at once
+        relevant = self._search(self._down,targets.keys(),max_cost)
+
+        rank = self._rank
+        dist = dict()
+        for v in sorted(relevant.keys(),key=rank.__getitem__,reverse=True):
+            d = forward.get(v)
+            for u, c in self._down[v]:
+                if u in dist:
+                    nd = dist[u] + c
+                    if d is None or nd < d:
+                        d = nd
+            if d is not None and d <= max_cost:
+                dist[v] = d
+
+        for v, blocks in targets.items():
+            if v not in dist:
+                continue
+            for b in blocks:
+                if b not in costs or dist[v] < costs[b]:
+                    costs[b] = dist[v]
+
+        return costs
+
+class NodeCostCache:
+    """Bounded least-recently-used cache of per-node cost vectors"""
+
+    def __init__(self,maxsize):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            the maximum number of cost vectors to hold
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        # blocks may be routed from several threads at once
+        self._lock = threading.Lock()
+
+
+    def __repr__(self):
+        stats = self.stats()
+        return "{} cost vectors  |  hit rate {:.1%}  |  ~{:.1f} MB".format(
+            stats["vectors"],stats["hit_rate"],stats["bytes"]/1024**2
+        )
+
+
+    def get(self,key,compute):
+        """
+        Returns the cost vector for the given key, calling compute() to build
+        it if it isn't already in the cache
+
+        Parameters
+        ----------
+        key : tuple
+            cache key, generally (node id, max stress)
+        compute : callable
+            function that returns the cost vector
+        """
+        with self._lock:
+            if key in self._vectors:
+                self.hits += 1
+                self._vectors.move_to_end(key)
+                return self._vectors[key]
+            self.misses += 1
+
+        vector = compute()
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            if len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+        return vector
+
+
+    def stats(self):
+        """
+        Returns a dictionary of cache statistics: lookups, hits, misses,
+        hit rate, number of cached vectors, and approximate memory use in
+        bytes.
+        """
+        lookups = self.hits + self.misses
+        # each entry also holds a float object for the cost
+        size = sum(
+            sys.getsizeof(v) + len(v)*sys.getsizeof(0.0)
+            for v in self._vectors.values()
+        )
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits)/lookups if lookups > 0 else 0.0,
+            "vectors": len(self._vectors),
+            "bytes": size
+        }
+
+
+class Router:
+    """Calculates block-to-block costs on an in-memory copy of the network"""
+
+    def __init__(self,graph,max_distance,max_stress,max_detour,
+                 detour_agnostic_threshold,early_termination=True,
+                 cache_size=None,hierarchies=None):
+        """
+        Parameters
+        ----------
+        graph : RoutingGraph
+            the network to route on
+        max_distance : float
+            the maximum distance to search for block connections
+        max_stress : int
+            the highest stress considered low stress
+        max_detour : float
+            the ratio of low stress to high stress cost at which a low stress
+            connection is still counted (e.g. 1.25)
+        detour_agnostic_threshold : float
+            low stress costs under this value are counted regardless of detour
+        early_termination : bool, optional
+            stop each search once the candidate blocks have been resolved
+        cache_size : int, optional
+            if given, keep up to this many per-node cost vectors in memory and
+            assemble block costs from them. Neighboring blocks share nodes so
+            the same vectors are reused by many origins. Cached vectors are
+            complete to max_distance so early termination is not applied.
+        hierarchies : dict, optional
+            max stress -> ContractionHierarchy to query in place of Dijkstra
+            for that stress level
+        """
+        self.graph = graph
+        self.max_distance = max_distance
+        self.max_stress = max_stress
+        self.max_detour = max_detour
+        self.detour_agnostic_threshold = detour_agnostic_threshold
+        self.early_termination = early_termination
+        if cache_size:
+            self.cache = NodeCostCache(cache_size)
+        else:
+            self.cache = None
+        if hierarchies is None:
+            hierarchies = dict()
+        self.hierarchies = hierarchies
+
+
+    def costs(self,origin_nodes,blocks_nodes,high_stress=True):
+        """
+        Returns the high and low stress costs from the origin block to each
+        candidate block.
+
+        When high stress costs are available the low stress search is bounded
+        per block by the detour allowance: once the search has gone beyond
+        max_detour times the high stress cost (or the detour agnostic
+        threshold, whichever is larger) for every unresolved block, no further
+        low stress connections can be counted and the search stops. Blocks
+        without a high stress connection can't have a low stress one either
+        and are dropped from the low stress search.
+
+        Parameters
+        ----------
+        origin_nodes : iterable
+            node ids belonging to the origin block
+        blocks_nodes : iterable
+            (block id, node id) pairs for the candidate blocks
+        high_stress : bool, optional
+            whether to run the high stress search (scenarios skip it)
+
+        returns:
+        tuple of dicts (block id -> high stress cost, block id -> low stress cost)
+        """
+        node_blocks = dict()
+        for block_id, node_id in blocks_nodes:
+            if node_id in node_blocks:
+                node_blocks[node_id].append(block_id)
+            else:
+                node_blocks[node_id] = [block_id]
+
+        if high_stress:
+            hs_costs = self._block_costs(HIGH_STRESS,origin_nodes,node_blocks)
+            bounds = {
+                b: max(self.detour_agnostic_threshold,self.max_detour*c)
+                for b, c in hs_costs.items()
+            }
+        else:
+            hs_costs = dict()
+            bounds = None
+
+        ls_costs = self._block_costs(self.max_stress,origin_nodes,node_blocks,bounds)
+
+        return hs_costs, ls_costs
+
+
+    def _block_costs(self,max_stress,origin_nodes,node_blocks,block_bounds=None):
+        """
+        Returns block costs on the subgraph up to max_stress using the
+        hierarchy for that stress if there is one, the cost vector cache if
+        enabled, or a bounded Dijkstra search otherwise
+
+        Parameters
+        ----------
+        max_stress : int
+            the highest stress in the subgraph to route on
+        origin_nodes : iterable
+            node ids belonging to the origin block
+        node_blocks : dict
+            node id -> list of ids of the candidate blocks the node belongs to
+        block_bounds : dict, optional
+            block id -> the largest cost at which that block is still of
+            interest (see block_costs)
+
+        returns:
+        dict of block id -> cost
+        """
+        if max_stress in self.hierarchies:
+            return self.hierarchies[max_stress].block_costs(
+                origin_nodes,
+                node_blocks,
+                self.max_distance,
+                block_bounds=block_bounds
+            )
+        if self.cache is not None:
+            return self._cached_block_costs(max_stress,origin_nodes,node_blocks)
+        return block_costs(
+            self.graph,
+            max_stress,
+            origin_nodes,
+            node_blocks,
+            self.max_distance,
+            block_bounds=block_bounds,
+            early_termination=self.early_termination
+        )
+
+
+    def _cached_block_costs(self,max_stress,origin_nodes,node_blocks):
+        """
+        Assembles block costs as the minimum over the cached cost vectors of
+        the origin nodes
+
+        Parameters
+        ----------
+        max_stress : int
+            the highest stress in the subgraph to route on
+        origin_nodes : iterable
+            node ids belonging to the origin block
+        node_blocks : dict
+            node id -> list of ids of the candidate blocks the node belongs to
+
+        returns:
+        dict of block id -> cost
+        """
+        vectors = [
+            self.cache.get(
+                (n,max_stress),
+                lambda n=n: node_costs(self.graph,max_stress,n,self.max_distance)
+            )
+            for n in origin_nodes
+        ]
+
+        costs = dict()
+        for node_id, blocks in node_blocks.items():
+            node_cost = None
+            for vector in vectors:
+                if node_id in vector and (node_cost is None or vector[node_id] < node_cost):
+                    node_cost = vector[node_id]
+            if node_cost is None:
+                continue
+            for b in blocks:
+                if b not in costs or node_cost < costs[b]:
+                    costs[b] = node_cost
+        return costs
@@ -0,0 +1,259 @@
+###################################################################
+# Vectorized destination scoring. These functions reproduce the
+# scoring done in SQL by DestinationCategory._concat_case and
+# Destinations.aggregate_subcategories on numpy arrays so that
+# scores can be recalculated in memory. Destination counts can also
+# be calculated in memory from sparse connectivity matrices (this
+# requires scipy).
+###################################################################
+import numpy as np
+import pandas as pd
+try:
+    with_scipy = True
+    from scipy import sparse
+except ImportError:
+    with_scipy = False
+
+
+def break_score(hs,ls,breaks,maxpoints,method):
+    """
+    Scores each block from its high stress and low stress destination counts
+    using piecewise-linear break points. Mirrors the CASE statement built by
+    DestinationCategory._concat_case, including the order in which its
+    conditions are tested.
+
+    Parameters
+    ----------
+    hs : numpy array
+        high stress counts (NaN for NULL)
+    ls : numpy array
+        low stress counts (NaN for NULL)
+    breaks : dict
+        break point -> score
+    maxpoints : float
+        maximum score
+    method : str
+        "count" or "percentage"
+
+    returns:
+    numpy array of scores (NaN for NULL)
+    """
+    if method not in ("count","percentage"):
+        raise ValueError("Unknown scoring method {}".format(method))
+    hs = np.asarray(hs,dtype=float)
+    ls = np.asarray(ls,dtype=float)
+    hs0 = np.nan_to_num(hs)
+    ls0 = np.nan_to_num(ls)
+
+    breaks = dict(breaks)
+    breaks[0] = 0
+
+    conditions = list()
+    choices = list()
+    with np.errstate(divide="ignore",invalid="ignore"):
+        conditions.append((hs0 == 0) & (ls0 == 0))
+        choices.append(np.nan)
+        conditions.append(ls0 >= hs0)
+        choices.append(maxpoints)
+
+        # scores at the boundaries
+        cumul_score = 0
+        for brk, score in sorted(breaks.items()):
+            conditions.append(ls0 == brk)
+            if method == "count":
+                choices.append(score + cumul_score)
+                cumul_score += score
+            else:
+                choices.append(score)
+
+        # scores within the boundaries
+        del breaks[0]
+        if method == "count":
+            val = ls0
+        else:
+            # comparisons against NULL are never true in SQL
+            val = np.where(np.isnan(hs),np.nan,ls0/hs)
+        cumul_score = 0
+        prev_break = 0
+        for brk, score in sorted(breaks.items()):
+            conditions.append(val < brk)
+            choices.append(cumul_score + ((val - prev_break)/(brk - prev_break)) * (score - cumul_score))
+            if method == "count":
+                cumul_score += score
+            else:
+                cumul_score = score
+            prev_break = brk
+
+        # scores above the top break
+        brk, score = sorted(breaks.items())[-1]
+        default = np.nan
+        if np.isclose(maxpoints,cumul_score):
+            conditions.append(val > brk)
+            choices.append(maxpoints)
+        elif maxpoints > cumul_score:
+            if method == "count":
+                default = cumul_score + ((ls0 - brk)/(hs - brk)) * (maxpoints - cumul_score)
+            else:
+                default = cumul_score + ((ls0/hs) - brk)/(1 - brk) * (maxpoints - cumul_score)
+
+        conditions = [np.nan_to_num(c,nan=0).astype(bool) for c in conditions]
+        choices = [np.broadcast_to(np.asarray(c,dtype=float),hs.shape) for c in choices]
+        return np.select(conditions,choices,default=default)
+
+
+def combine_scores(scores,weights,maxpoints,category_maxpoints):
+    """
+    Combines subcategory scores into a category score using the subcategory
+    weights. Mirrors Destinations.aggregate_subcategories: the category is
+    NULL if every subcategory is NULL, zero if every subcategory is zero or
+    NULL, and otherwise the weighted average of the non-NULL subcategories
+    scaled to the category's maxpoints.
+
+    Parameters
+    ----------
+    scores : list of numpy arrays
+        subcategory scores (NaN for NULL)
+    weights : list
+        weight of each subcategory
+    maxpoints : list
+        maxpoints of each subcategory
+    category_maxpoints : float
+        maxpoints of the category
+
+    returns:
+    numpy array of scores (NaN for NULL)
+    """
+    scores = np.vstack([np.asarray(s,dtype=float) for s in scores])
+    weights = np.asarray(weights,dtype=float)[:,np.newaxis]
+    maxpoints = np.asarray(maxpoints,dtype=float)[:,np.newaxis]
+
+    nulls = np.isnan(scores)
+    filled = np.nan_to_num(scores)
+    numerator = (weights*filled/maxpoints).sum(axis=0)
+    denominator = np.where(nulls,0,weights).sum(axis=0)
+
+    with np.errstate(divide="ignore",invalid="ignore"):
+        return np.select(
+            [nulls.all(axis=0),(filled == 0).all(axis=0)],
+            [np.nan,0.0],
+            default=category_maxpoints*numerator/denominator
+        )
+
+
+def connectivity_matrices(sources,targets,low_stress,size):
+    """
+    Builds sparse source x target matrices of high stress (all) and low
+    stress connections. Repeated connections are kept as counts so that sums
+    match the SQL joins.
+
+    Parameters
+    ----------
+    sources : numpy array
+        block index of each connection's source
+    targets : numpy array
+        block index of each connection's target
+    low_stress : numpy array
+        boolean, whether each connection is low stress
+    size : int
+        number of blocks
+
+    returns:
+    tuple of scipy.sparse CSR matrices (high stress, low stress)
+    """
+    if not with_scipy:
+        raise ValueError("Sparse scoring requires scipy")
+    sources = np.asarray(sources)
+    targets = np.asarray(targets)
+    low_stress = np.asarray(low_stress,dtype=bool)
+    hs = sparse.csr_matrix(
+        (np.ones(len(sources)),(sources,targets)),
+        shape=(size,size)
+    )
+    ls = sparse.csr_matrix(
+        (np.ones(low_stress.sum()),(sources[low_stress],targets[low_stress])),
+        shape=(size,size)
+    )
+    return hs, ls
+
+
+def sparse_destination_counts(hs,ls,counts,values):
+    """
+    Calculates the high and low stress destination totals for every category
+    from sparse connectivity matrices. Matches 02_count_based_score.sql and
+    02_percentage_based_score.sql combined by 03_combine_counts.sql.
+
+    Destinations that fall in a single block are tallied by block in a dense
+    block x category matrix so that all categories are counted with one
+    product per matrix. Destinations that span several blocks are counted
+    through a block x destination incidence matrix so that each is counted
+    once per source (the SQL uses COUNT(DISTINCT ...)).
+
+    Parameters
+    ----------
+    hs : scipy.sparse matrix
+        source x target high stress connections (see connectivity_matrices)
+    ls : scipy.sparse matrix
+        source x target low stress connections
+    counts : list
+        for each count-based category, a tuple of arrays (destination ids,
+        block index) with a row for each block a destination falls in
+    values : list
+        for each percentage-based category, a tuple of arrays (block index,
+        value) with NaN for NULL values
+
+    returns:
+    tuple of lists (count totals, value totals) with a tuple of arrays
+    (hs, ls) for each category (NaN for NULL)
+    """
+    if not with_scipy:
+        raise ValueError("Sparse scoring requires scipy")
+    size = hs.shape[1]
+
+    # destinations in a single block are tallied by block, the rest go into
+    # an incidence matrix
+    tallies = np.zeros((size,len(counts)))
+    incidence = list()
+    for i, (dest_ids, blocks) in enumerate(counts):
+        pairs = pd.DataFrame({"dest": dest_ids, "block": blocks}).drop_duplicates()
+        n_blocks = pairs.groupby("dest")["block"].transform("size").to_numpy()
+        tallies[:,i] = np.bincount(pairs["block"][n_blocks == 1],minlength=size)
+        multi = pairs[n_blocks > 1]
+        codes, uniques = pd.factorize(multi["dest"])
+        incidence.append(sparse.csr_matrix(
+            (np.ones(len(codes)),(multi["block"].to_numpy(),codes)),
+            shape=(size,len(uniques))
+        ))
+
+    # sums and numbers of the non-NULL values in each block (a total is
+    # NULL if no non-NULL values are reached)
+    k = len(values)
+    block_values = np.zeros((size,2*k))
+    for i, (blocks, vals) in enumerate(values):
+        vals = np.asarray(vals,dtype=float)
+        np.add.at(block_values[:,i],blocks,np.nan_to_num(vals))
+        np.add.at(block_values[:,k+i],blocks,~np.isnan(vals))
+
+    totals = dict()
+    for stress, matrix in [("hs",hs),("ls",ls)]:
+        reached = matrix.copy()
+        reached.data = np.ones(len(reached.data))
+        count_totals = reached @ tallies
+        for i, m in enumerate(incidence):
+            if m.shape[1] > 0:
+                count_totals[:,i] += (reached @ m).getnnz(axis=1)
+        count_totals[count_totals == 0] = np.nan
+
+        value_totals = matrix @ block_values
+        sums = value_totals[:,:k]
+        sums[value_totals[:,k:] == 0] = np.nan
+        totals[stress] = (count_totals,sums)
+
+    count_results = [
+        (totals["hs"][0][:,i],totals["ls"][0][:,i])
+        for i in range(len(counts))
+    ]
+    value_results = [
+        (totals["hs"][1][:,i],totals["ls"][1][:,i])
+        for i in range(k)
+    ]
+    return count_results, value_results
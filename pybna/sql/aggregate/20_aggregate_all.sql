@@ -0,0 +1,38 @@
+--
+-- population-weighted aggregate of every category for every scenario in a
+-- single pass over the block scores
+--
+DROP TABLE IF EXISTS tmp_agg_all;
+CREATE TEMP TABLE tmp_agg_all AS (
+    SELECT
+        scores.scenario,
+        MIN(scores.scenario_order) AS scenario_order,
+        {aggregates}
+    FROM (
+        SELECT
+            scores.*,
+            COALESCE(blocks.{blocks_population_col},0)::FLOAT
+                / SUM(blocks.{blocks_population_col}) OVER (PARTITION BY scores.scenario) AS ratio
+        FROM
+            ({scores_query}) scores,
+            {blocks_schema}.{blocks_table} blocks
+        WHERE scores.{blocks_id_col} = blocks.{blocks_id_col}
+    ) scores
+    GROUP BY scores.scenario
+);
+
+ALTER TABLE {agg_schema}.{agg_table} {add_columns};
+
+DELETE FROM {agg_schema}.{agg_table}
+WHERE scenario IN (SELECT scenario FROM tmp_agg_all);
+
+INSERT INTO {agg_schema}.{agg_table} (scenario,{columns})
+SELECT
+    scenario,
+    {columns}
+FROM tmp_agg_all
+ORDER BY
+    scenario_order,
+    scenario;
+
+DROP TABLE tmp_agg_all;
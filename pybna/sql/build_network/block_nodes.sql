@@ -0,0 +1,14 @@
+-- nodes attached to any block, using the same rules as connectivity routing
+SELECT DISTINCT nodes.{nodes_id_col}
+FROM
+    {blocks_schema}.{blocks_table} blocks,
+    {roads_schema}.{roads_table} roads,
+    {nodes_schema}.{nodes_table} nodes
+WHERE
+    ST_DWithin(blocks.{blocks_geom_col},roads.{roads_geom_col},{blocks_roads_tolerance})
+    AND (
+        ST_Contains(ST_Buffer(blocks.{blocks_geom_col},{blocks_roads_tolerance}),roads.{roads_geom_col})
+        OR ST_Length(ST_Intersection(ST_Buffer(blocks.{blocks_geom_col},{blocks_roads_tolerance}),roads.{roads_geom_col})) > {blocks_min_road_length}
+    )
+    AND nodes.road_id = roads.{roads_id_col}
+;
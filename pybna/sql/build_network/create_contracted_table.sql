@@ -0,0 +1,10 @@
+DROP TABLE IF EXISTS {edges_schema}.{edges_contracted_table};
+
+CREATE TABLE {edges_schema}.{edges_contracted_table} (
+    {edges_id_col} SERIAL PRIMARY KEY,
+    {edges_source_col} INTEGER,
+    {edges_target_col} INTEGER,
+    {edges_cost_col} INTEGER,
+    {edges_stress_col} INTEGER,
+    edge_ids INTEGER[]
+);
@@ -0,0 +1,2 @@
+CREATE INDEX {contracted_index} ON {edges_schema}.{edges_contracted_table} ({edges_source_col});
+ANALYZE {edges_schema}.{edges_contracted_table};
@@ -0,0 +1,9 @@
+SELECT
+    {edges_source_col},
+    {edges_target_col},
+    {edges_cost_col},
+    {edges_stress_col},
+    source_road_id,
+    target_road_id
+FROM {edges_schema}.{edges_table}
+;
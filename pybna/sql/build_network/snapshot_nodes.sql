@@ -0,0 +1,5 @@
+SELECT
+    {nodes_id_col},
+    road_id
+FROM {nodes_schema}.{nodes_table}
+;
@@ -13,7 +13,7 @@ FROM
         ON link.{edges_id_col} = tmp_flip_stress.id
 WHERE
     block.{blocks_id_col}={block_id}
-    AND ST_DWithin(block.{blocks_geom_col},link.{edges_geom_col},{connectivity_max_distance})
+    AND ST_DWithin(block.{blocks_geom_col},link.{edges_geom_col},{network_subset_distance})
     AND COALESCE(tmp_flip_stress.stress,{edges_stress_col}) <= {max_stress}
     AND COALESCE(tmp_flip_stress.stress,{edges_stress_col}) > 0
     AND {network_filter}
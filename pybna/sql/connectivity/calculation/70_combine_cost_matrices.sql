@@ -26,6 +26,7 @@ SELECT
         OR ls_cost <= {connectivity_detour_agnostic_threshold}
         OR ls_cost <= ({connectivity_max_detour} * hs_cost)
     )::BOOLEAN AS ls
+    {connectivity_band_select}
 INTO TEMP TABLE tmp_connectivity
 FROM
     tmp_blocks oblocks,
@@ -0,0 +1,12 @@
+-- pairs that fail the detour test have no low stress band
+UPDATE tmp_connectivity
+SET ls_band = NULL
+WHERE NOT ls
+;
+
+UPDATE tmp_connectivity
+SET
+    hs_band = (SELECT MIN(band) FROM unnest({connectivity_bands}::FLOAT[]) band),
+    ls_band = (SELECT MIN(band) FROM unnest({connectivity_bands}::FLOAT[]) band)
+WHERE source = target
+;
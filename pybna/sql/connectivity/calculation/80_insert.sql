@@ -3,8 +3,13 @@ INSERT INTO {connectivity_schema}.{connectivity_table} (
     {connectivity_target_col},
     high_stress,
     low_stress
+    {connectivity_band_columns}
 )
-SELECT * FROM tmp_connectivity
+SELECT
+    source,
+    target,
+    hs,
+    ls
+    {connectivity_band_values}
+FROM tmp_connectivity
 ;
-
-DROP TABLE tmp_connectivity;
@@ -5,6 +5,7 @@ INSERT INTO {connectivity_schema}.{connectivity_table} (
     low_stress,
     scenario,
     subtract
+    {connectivity_band_columns}
 )
 SELECT
     source,
@@ -13,7 +14,6 @@ SELECT
     ls,
     {scenario_id},
     {scenario_subtract}
+    {connectivity_band_values}
 FROM tmp_connectivity
 ;
-
-DROP TABLE tmp_connectivity;
@@ -0,0 +1,20 @@
+-- every block takes on the connectivity of its zone
+INSERT INTO {connectivity_schema}.{connectivity_table} (
+    {connectivity_source_col},
+    {connectivity_target_col},
+    high_stress,
+    low_stress
+)
+SELECT
+    oblocks.block_id,
+    dblocks.block_id,
+    zone_connectivity.high_stress,
+    zone_connectivity.low_stress
+FROM
+    {zones_schema}.{zone_connectivity_table} zone_connectivity,
+    {zones_schema}.{zone_blocks_table} oblocks,
+    {zones_schema}.{zone_blocks_table} dblocks
+WHERE
+    zone_connectivity.{connectivity_source_col} = oblocks.zone_id
+    AND zone_connectivity.{connectivity_target_col} = dblocks.zone_id
+;
@@ -0,0 +1,15 @@
+-- assigns blocks to zones by block group (the leading digits of the block id)
+DROP TABLE IF EXISTS {zones_schema}.{zone_blocks_table};
+CREATE TABLE {zones_schema}.{zone_blocks_table} AS (
+    SELECT
+        blocks.{blocks_id_col} AS block_id,
+        DENSE_RANK() OVER (
+            ORDER BY LEFT(blocks.{blocks_id_col}::TEXT,{block_group_length})
+        )::INTEGER AS zone_id
+    FROM {blocks_schema}.{blocks_table} blocks
+    WHERE EXISTS (
+        SELECT 1
+        FROM {boundary_schema}.{boundary_table} bound
+        WHERE ST_DWithin(bound.{boundary_geom_col},blocks.{blocks_geom_col},{connectivity_max_distance})
+    )
+);
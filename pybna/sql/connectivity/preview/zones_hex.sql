@@ -0,0 +1,32 @@
+-- assigns blocks to zones by the hexagon their interior falls in
+DROP TABLE IF EXISTS pg_temp.tmp_block_points;
+CREATE TEMP TABLE pg_temp.tmp_block_points AS (
+    SELECT
+        blocks.{blocks_id_col} AS block_id,
+        ST_PointOnSurface(blocks.{blocks_geom_col}) AS geom
+    FROM {blocks_schema}.{blocks_table} blocks
+    WHERE EXISTS (
+        SELECT 1
+        FROM {boundary_schema}.{boundary_table} bound
+        WHERE ST_DWithin(bound.{boundary_geom_col},blocks.{blocks_geom_col},{connectivity_max_distance})
+    )
+);
+CREATE INDEX tsidx_tmp_block_points ON pg_temp.tmp_block_points USING GIST (geom);
+ANALYZE pg_temp.tmp_block_points;
+
+DROP TABLE IF EXISTS {zones_schema}.{zone_blocks_table};
+CREATE TABLE {zones_schema}.{zone_blocks_table} AS (
+    SELECT DISTINCT ON (tmp_block_points.block_id)
+        tmp_block_points.block_id,
+        DENSE_RANK() OVER (ORDER BY hex.i, hex.j)::INTEGER AS zone_id
+    FROM
+        ST_HexagonGrid(
+            {hex_size},
+            (SELECT ST_SetSRID(ST_Extent(geom)::GEOMETRY,{srid}) FROM pg_temp.tmp_block_points)
+        ) hex,
+        pg_temp.tmp_block_points
+    WHERE ST_Intersects(hex.geom,tmp_block_points.geom)
+    ORDER BY tmp_block_points.block_id, hex.i, hex.j
+);
+
+DROP TABLE pg_temp.tmp_block_points;
@@ -0,0 +1,19 @@
+-- builds zone geometries from their blocks
+CREATE INDEX {zone_blocks_index} ON {zones_schema}.{zone_blocks_table} (block_id);
+ANALYZE {zones_schema}.{zone_blocks_table};
+
+DROP TABLE IF EXISTS {zones_schema}.{zones_table};
+CREATE TABLE {zones_schema}.{zones_table} AS (
+    SELECT
+        zone_blocks.zone_id,
+        COUNT(*) AS blocks,
+        ST_Multi(ST_Union(blocks.{blocks_geom_col})) AS geom
+    FROM
+        {zones_schema}.{zone_blocks_table} zone_blocks,
+        {blocks_schema}.{blocks_table} blocks
+    WHERE zone_blocks.block_id = blocks.{blocks_id_col}
+    GROUP BY zone_blocks.zone_id
+);
+ALTER TABLE {zones_schema}.{zones_table} ADD PRIMARY KEY (zone_id);
+CREATE INDEX {zones_index} ON {zones_schema}.{zones_table} USING GIST (geom);
+ANALYZE {zones_schema}.{zones_table};
@@ -0,0 +1,11 @@
+SELECT
+    link.{edges_source_col},
+    link.{edges_target_col},
+    link.{edges_cost_col},
+    COALESCE(tmp_flip_stress.stress,link.{edges_stress_col})
+FROM
+    {edges_schema}.{edges_table} link
+    LEFT JOIN tmp_flip_stress
+        ON link.{edges_id_col} = tmp_flip_stress.id
+WHERE {network_filter}
+;
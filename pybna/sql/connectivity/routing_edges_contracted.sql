@@ -0,0 +1,7 @@
+SELECT
+    link.{edges_source_col},
+    link.{edges_target_col},
+    link.{edges_cost_col},
+    link.{edges_stress_col}
+FROM {edges_schema}.{edges_contracted_table} link
+;
@@ -0,0 +1,29 @@
+--
+-- assigns each destination to the blocks it intersects
+--
+DROP TABLE IF EXISTS pg_temp.tmp_dests;
+CREATE TEMP TABLE pg_temp.tmp_dests AS (
+    SELECT
+        {destinations_id_col} AS id,
+        {destinations_geom_col} AS geom
+    FROM {destinations_schema}.{destinations_table} destinations
+    WHERE {destinations_filter}
+);
+CREATE INDEX tsidx_tmp_dests ON pg_temp.tmp_dests USING GIST (geom);
+ANALYZE pg_temp.tmp_dests;
+
+
+DROP TABLE IF EXISTS {dest_blocks_schema}.{dest_blocks_table};
+CREATE TABLE {dest_blocks_schema}.{dest_blocks_table} AS (
+    SELECT
+        tmp_dests.id AS dest_id,
+        blocks.{blocks_id_col} AS block_id
+    FROM
+        pg_temp.tmp_dests,
+        {blocks_schema}.{blocks_table} blocks
+    WHERE ST_Intersects(tmp_dests.geom,blocks.{blocks_geom_col})
+);
+CREATE INDEX {dest_blocks_index} ON {dest_blocks_schema}.{dest_blocks_table} (block_id);
+ANALYZE {dest_blocks_schema}.{dest_blocks_table};
+
+DROP TABLE pg_temp.tmp_dests;
@@ -0,0 +1,11 @@
+--
+-- restores a category's counts and scores from the cache
+--
+DROP TABLE IF EXISTS {workspace_schema}.{workspace_table};
+CREATE TABLE {workspace_schema}.{workspace_table} AS (
+    SELECT *
+    FROM {cache_schema}.{cached_scores_table}
+);
+
+CREATE INDEX {index} ON {workspace_schema}.{workspace_table} (block_id);
+ANALYZE {workspace_schema}.{workspace_table};
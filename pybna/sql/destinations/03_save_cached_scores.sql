@@ -0,0 +1,13 @@
+--
+-- saves a category's counts and scores to the cache
+--
+DROP TABLE IF EXISTS {cache_schema}.{cached_scores_table};
+CREATE TABLE {cache_schema}.{cached_scores_table} AS (
+    SELECT *
+    FROM {workspace_schema}.{workspace_table}
+);
+
+INSERT INTO {cache_schema}.score_cache (category, inputs)
+VALUES ({category},{score_inputs})
+ON CONFLICT (category) DO UPDATE
+SET inputs = EXCLUDED.inputs, created = NOW();
@@ -9,5 +9,6 @@ WHERE EXISTS (
     SELECT 1
     FROM {boundary_schema}.{boundary_table} bound
     WHERE st_intersects(blocks.{blocks_geom_col},bound.{boundary_geom_col})
-);
+)
+AND {scores_filter};
 ALTER TABLE {scores_schema}.{scores_table} ADD PRIMARY KEY ({blocks_id_col});
@@ -0,0 +1,11 @@
+--
+-- lists the blocks to be scored (matches the blocks in 04_all_combined.sql)
+--
+SELECT blocks.{blocks_id_col}
+FROM {blocks_schema}.{blocks_table} blocks
+WHERE EXISTS (
+    SELECT 1
+    FROM {boundary_schema}.{boundary_table} bound
+    WHERE st_intersects(blocks.{blocks_geom_col},bound.{boundary_geom_col})
+)
+AND {scores_filter};
@@ -0,0 +1,8 @@
+--
+-- starts a scenario's scores from the base scores
+--
+CREATE TABLE {scores_schema}.{scores_table} AS (
+    SELECT *
+    FROM {base_scores_schema}.{base_scores_table}
+);
+ALTER TABLE {scores_schema}.{scores_table} ADD PRIMARY KEY ({blocks_id_col});
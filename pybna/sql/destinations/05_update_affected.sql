@@ -0,0 +1,11 @@
+--
+-- replaces the counts and scores of blocks affected by a scenario
+--
+UPDATE {scores_schema}.{scores_table} scores
+SET {columns}
+FROM
+    pg_temp.tmp_affected affected
+    {tables}
+WHERE
+    scores.{blocks_id_col} = affected.block_id
+    AND {update_filter};
@@ -0,0 +1,9 @@
+--
+-- starts a scenario's scores from the base scores
+--
+INSERT INTO {scores_schema}.{scores_table} (scenario,{score_columns})
+SELECT
+    {scenario_text},
+    {score_columns}
+FROM {scores_schema}.{scores_table}
+WHERE scenario = {base_name};
@@ -0,0 +1,10 @@
+--
+-- starts a long table of scenario scores with the base scores
+--
+CREATE TABLE {scores_schema}.{scores_table} AS (
+    SELECT
+        {base_name}::TEXT AS scenario,
+        base_scores.*
+    FROM pg_temp.tmp_base_scores base_scores
+);
+ALTER TABLE {scores_schema}.{scores_table} ADD PRIMARY KEY (scenario,{blocks_id_col});
@@ -0,0 +1,69 @@
+--
+-- scores a block from its high stress and low stress destination totals
+-- using piecewise-linear break points. Matches the CASE statement built by
+-- DestinationCategory._concat_case.
+--
+-- breaks are sorted and exclude zero. scores holds the score for each break
+-- and base_scores the score at the start of each break's interval (the
+-- running total of the scores below it for count-based categories and the
+-- score of the break below it for percentage-based categories).
+--
+-- The function is a single expression so that the planner can inline it
+-- (and fold the parts that only depend on the constant arguments).
+--
+CREATE OR REPLACE FUNCTION bna_break_score(
+    hs FLOAT8,
+    ls FLOAT8,
+    breaks FLOAT8[],
+    scores FLOAT8[],
+    base_scores FLOAT8[],
+    maxpoints FLOAT8,
+    method TEXT
+)
+RETURNS FLOAT8 AS $func$
+    SELECT CASE
+        WHEN COALESCE(hs,0) = 0 AND COALESCE(ls,0) = 0 THEN NULL
+        WHEN COALESCE(ls,0) >= COALESCE(hs,0) THEN maxpoints
+
+        -- scores at the boundaries
+        WHEN COALESCE(ls,0) = 0 THEN 0
+        WHEN array_position(breaks,COALESCE(ls,0)) IS NOT NULL THEN
+            CASE method
+            WHEN 'count' THEN
+                scores[array_position(breaks,COALESCE(ls,0))]
+                + base_scores[array_position(breaks,COALESCE(ls,0))]
+            ELSE scores[array_position(breaks,COALESCE(ls,0))]
+            END
+
+        -- scores within the boundaries
+        WHEN width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks) < cardinality(breaks) THEN
+            base_scores[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks) + 1]
+            + (
+                ((CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END) - COALESCE(breaks[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks)],0))
+                / (breaks[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks) + 1] - COALESCE(breaks[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks)],0))
+            ) * (
+                scores[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks) + 1]
+                - base_scores[width_bucket(CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END,breaks) + 1]
+            )
+
+        -- scores above the top break (same tolerance as numpy.isclose)
+        WHEN abs(maxpoints - (CASE method WHEN 'count' THEN base_scores[cardinality(breaks)] + scores[cardinality(breaks)] ELSE scores[cardinality(breaks)] END))
+                <= 1e-8 + 1e-5 * abs(CASE method WHEN 'count' THEN base_scores[cardinality(breaks)] + scores[cardinality(breaks)] ELSE scores[cardinality(breaks)] END) THEN
+            CASE
+            WHEN (CASE method WHEN 'count' THEN COALESCE(ls,0) ELSE COALESCE(ls,0)/hs END) > breaks[cardinality(breaks)] THEN maxpoints
+            END
+        WHEN maxpoints > (CASE method WHEN 'count' THEN base_scores[cardinality(breaks)] + scores[cardinality(breaks)] ELSE scores[cardinality(breaks)] END) THEN
+            CASE method
+            WHEN 'count' THEN
+                (base_scores[cardinality(breaks)] + scores[cardinality(breaks)])
+                + ((COALESCE(ls,0) - breaks[cardinality(breaks)])/(hs - breaks[cardinality(breaks)]))
+                * (maxpoints - (base_scores[cardinality(breaks)] + scores[cardinality(breaks)]))
+            ELSE
+                scores[cardinality(breaks)]
+                + ((COALESCE(ls,0)/hs) - breaks[cardinality(breaks)])/(1 - breaks[cardinality(breaks)])
+                * (maxpoints - scores[cardinality(breaks)])
+            END
+        END
+$func$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+COMMENT ON FUNCTION bna_break_score(FLOAT8,FLOAT8,FLOAT8[],FLOAT8[],FLOAT8[],FLOAT8,TEXT) IS {version};
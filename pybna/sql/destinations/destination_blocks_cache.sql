@@ -0,0 +1,9 @@
+--
+-- registry of cached destination-block assignments
+--
+CREATE SCHEMA IF NOT EXISTS {cache_schema};
+CREATE TABLE IF NOT EXISTS {cache_schema}.destination_blocks_cache (
+    category TEXT PRIMARY KEY,
+    inputs TEXT,
+    created TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,9 @@
+--
+-- registry of cached destination counts and scores
+--
+CREATE SCHEMA IF NOT EXISTS {cache_schema};
+CREATE TABLE IF NOT EXISTS {cache_schema}.score_cache (
+    category TEXT PRIMARY KEY,
+    inputs TEXT,
+    created TIMESTAMP DEFAULT NOW()
+);
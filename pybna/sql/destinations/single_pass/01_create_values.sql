@@ -0,0 +1,10 @@
+--
+-- long-format table of destination values by block for all categories
+--
+DROP TABLE IF EXISTS pg_temp.tmp_dest_values;
+CREATE TEMP TABLE pg_temp.tmp_dest_values (
+    category TEXT,
+    block_id {blocks_id_type},
+    dest_num INTEGER,
+    val FLOAT8
+);
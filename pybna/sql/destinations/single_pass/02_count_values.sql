@@ -0,0 +1,9 @@
+--
+-- adds the blocks holding each destination of a count-based category
+--
+INSERT INTO pg_temp.tmp_dest_values (category, block_id, dest_num)
+SELECT
+    {category},
+    block_id,
+    DENSE_RANK() OVER (ORDER BY dest_id)
+FROM {dest_blocks_schema}.{dest_blocks_table};
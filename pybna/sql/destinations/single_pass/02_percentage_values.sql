@@ -0,0 +1,10 @@
+--
+-- adds the value in each block for a percentage-based category
+--
+INSERT INTO pg_temp.tmp_dest_values (category, block_id, val)
+SELECT
+    {category},
+    {destinations_id_col},
+    {val}
+FROM {destinations_schema}.{destinations_table} destinations
+WHERE {destinations_filter};
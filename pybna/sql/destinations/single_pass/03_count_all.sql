@@ -0,0 +1,30 @@
+--
+-- counts high and low stress destinations for every category in a single
+-- pass over the connectivity table. low stress counts are NULL (not zero)
+-- where there is no low stress connection, matching the per-category
+-- counts.
+--
+CREATE INDEX tidx_tmp_dest_values ON pg_temp.tmp_dest_values (block_id);
+ANALYZE pg_temp.tmp_dest_values;
+
+DROP TABLE IF EXISTS pg_temp.tmp_all_counts;
+CREATE TEMP TABLE pg_temp.tmp_all_counts AS (
+    SELECT
+        connections.source AS block_id,
+        dests.category,
+        COUNT(DISTINCT dests.dest_num) AS count_hs,
+        NULLIF(COUNT(DISTINCT dests.dest_num) FILTER (WHERE connections.low_stress),0) AS count_ls,
+        SUM(dests.val) AS sum_hs,
+        SUM(dests.val) FILTER (WHERE connections.low_stress) AS sum_ls
+    FROM
+        pg_temp.tmp_connectivity connections,
+        pg_temp.tmp_dest_values dests
+    WHERE connections.target = dests.block_id
+    GROUP BY
+        connections.source,
+        dests.category
+);
+CREATE INDEX tidx_tmp_all_counts ON pg_temp.tmp_all_counts (category);
+ANALYZE pg_temp.tmp_all_counts;
+
+DROP TABLE pg_temp.tmp_dest_values;
@@ -0,0 +1,16 @@
+--
+-- copies one category's counts into its workspace table
+--
+DROP TABLE IF EXISTS {workspace_schema}.{workspace_table};
+CREATE TABLE {workspace_schema}.{workspace_table} AS (
+    SELECT
+        block_id,
+        {hs} AS hs,
+        {ls} AS ls,
+        NULL::FLOAT AS score
+    FROM pg_temp.tmp_all_counts
+    WHERE category = {category}
+);
+
+CREATE INDEX {index} ON {workspace_schema}.{workspace_table} (block_id);
+ANALYZE {workspace_schema}.{workspace_table};
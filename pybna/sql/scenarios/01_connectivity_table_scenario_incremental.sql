@@ -0,0 +1,32 @@
+--
+-- connectivity for a scenario limited to the origin blocks whose
+-- connectivity differs from the base condition
+--
+DROP TABLE IF EXISTS pg_temp.tmp_affected;
+CREATE TEMP TABLE pg_temp.tmp_affected AS (
+    SELECT DISTINCT {connectivity_source_col} AS block_id
+    FROM {connectivity_schema}.{connectivity_table}
+    WHERE scenario = {scenario_id}
+);
+CREATE INDEX tidx_affected ON pg_temp.tmp_affected (block_id);
+ANALYZE pg_temp.tmp_affected;
+
+DROP TABLE IF EXISTS pg_temp.tmp_connectivity;
+CREATE TEMP TABLE pg_temp.tmp_connectivity AS (
+    SELECT DISTINCT ON (source,target)
+        {connectivity_source_col} AS source,
+        {connectivity_target_col} AS target,
+        high_stress,
+        low_stress
+    FROM {connectivity_schema}.{connectivity_table}
+    WHERE
+        (scenario = {scenario_id} OR scenario IS NULL)
+        AND {connectivity_source_col} IN (SELECT block_id FROM pg_temp.tmp_affected)
+    ORDER BY
+        source,
+        target,
+        (scenario = {scenario_id}) ASC
+);
+
+CREATE INDEX tidx_conn ON pg_temp.tmp_connectivity (source,target) WHERE low_stress;
+ANALYZE pg_temp.tmp_connectivity;
@@ -0,0 +1,12 @@
+--
+-- points the temporary connectivity at connectivity that has already been
+-- resolved and saved (e.g. a materialized scenario)
+--
+CREATE TEMP VIEW tmp_connectivity AS (
+    SELECT
+        source,
+        target,
+        high_stress,
+        low_stress
+    FROM {resolved_schema}.{resolved_table}
+);
@@ -0,0 +1,17 @@
+--
+-- versions of the base and scenario connectivity in each connectivity table.
+-- a version is removed whenever pyBNA rewrites that part of the table and a
+-- new one is issued the next time it's read, so connectivity derived from it
+-- (materialized scenarios, cached scores) can be checked without a scan
+--
+CREATE SCHEMA IF NOT EXISTS {cache_schema};
+CREATE TABLE IF NOT EXISTS {cache_schema}.connectivity_versions (
+    connectivity TEXT,
+    scope TEXT,
+    version TEXT,
+    PRIMARY KEY (connectivity, scope)
+);
+
+INSERT INTO {cache_schema}.connectivity_versions (connectivity, scope, version)
+VALUES ({connectivity_name},{version_scope},md5(random()::TEXT || clock_timestamp()::TEXT))
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,29 @@
+--
+-- resolves the base and scenario connectivity for a scenario once so it can
+-- be reused by later sessions
+--
+DROP MATERIALIZED VIEW IF EXISTS {cache_schema}.{scenario_view};
+CREATE MATERIALIZED VIEW {cache_schema}.{scenario_view} AS (
+    SELECT DISTINCT ON (source,target)
+        {connectivity_source_col} AS source,
+        {connectivity_target_col} AS target,
+        high_stress,
+        low_stress
+    FROM {connectivity_schema}.{connectivity_table}
+    WHERE {scenario_filter}
+    ORDER BY
+        source,
+        target,
+        (scenario = {scenario_id}) ASC
+);
+
+CREATE INDEX {scenario_view_index} ON {cache_schema}.{scenario_view} (source,target) WHERE low_stress;
+ANALYZE {cache_schema}.{scenario_view};
+
+INSERT INTO {cache_schema}.scenario_connectivity (scenario, subtract, view_name, connectivity)
+VALUES ({scenario_text},{subtract},{scenario_view_name},{connectivity_version})
+ON CONFLICT (scenario, subtract) DO UPDATE
+SET
+    view_name = EXCLUDED.view_name,
+    connectivity = EXCLUDED.connectivity,
+    refreshed = NOW();
@@ -0,0 +1,10 @@
+--
+-- saves the temporary connectivity so other connections can read it
+--
+CREATE TABLE {resolved_schema}.{resolved_table} AS (
+    SELECT *
+    FROM pg_temp.tmp_connectivity
+);
+
+CREATE INDEX {resolved_index} ON {resolved_schema}.{resolved_table} (source,target) WHERE low_stress;
+ANALYZE {resolved_schema}.{resolved_table};
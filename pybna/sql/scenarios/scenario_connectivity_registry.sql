@@ -0,0 +1,15 @@
+--
+-- registry of materialized scenario connectivity
+--
+CREATE SCHEMA IF NOT EXISTS {cache_schema};
+CREATE TABLE IF NOT EXISTS {cache_schema}.scenario_connectivity (
+    scenario TEXT,
+    subtract BOOLEAN,
+    view_name TEXT,
+    connectivity TEXT,
+    refreshed TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (scenario, subtract)
+);
+
+-- registries from before the connectivity version was recorded
+ALTER TABLE {cache_schema}.scenario_connectivity ADD COLUMN IF NOT EXISTS connectivity TEXT;
@@ -0,0 +1,100 @@
+--
+-- lays out the street grid: jittered nodes, cells (some with a diagonal
+-- street), and the candidate street edges between nodes
+--
+SELECT setseed({seed});
+
+DROP TABLE IF EXISTS pg_temp.tmp_syn_nodes;
+CREATE TEMP TABLE pg_temp.tmp_syn_nodes AS (
+    SELECT
+        i * ({size} + 1) + j + 1 AS node_id,
+        i,
+        j,
+        ST_SetSRID(
+            ST_MakePoint(
+                {origin_x} + i * {block_length}
+                    + CASE WHEN i IN (0,{size}) THEN 0 ELSE (random() - 0.5) * 2 * {jitter} END,
+                {origin_y} + j * {block_length}
+                    + CASE WHEN j IN (0,{size}) THEN 0 ELSE (random() - 0.5) * 2 * {jitter} END
+            ),
+            {srid}
+        ) AS geom
+    FROM
+        generate_series(0,{size}) i,
+        generate_series(0,{size}) j
+);
+CREATE INDEX tidx_tmp_syn_nodes ON pg_temp.tmp_syn_nodes (i,j);
+ANALYZE pg_temp.tmp_syn_nodes;
+
+DROP TABLE IF EXISTS pg_temp.tmp_syn_cells;
+CREATE TEMP TABLE pg_temp.tmp_syn_cells AS (
+    SELECT
+        i,
+        j,
+        random() < {diagonal_share} AS diagonal
+    FROM
+        generate_series(0,{size} - 1) i,
+        generate_series(0,{size} - 1) j
+);
+
+DROP TABLE IF EXISTS pg_temp.tmp_syn_edges;
+CREATE TEMP TABLE pg_temp.tmp_syn_edges AS (
+    -- east-west streets take the class of their row
+    SELECT
+        a.node_id AS source,
+        b.node_id AS target,
+        ({row_classes}::TEXT[])[a.j + 1] AS functional_class,
+        ({row_bike}::BOOLEAN[])[a.j + 1] AS bike,
+        ({row_oneway}::BOOLEAN[])[a.j + 1] AS oneway,
+        FALSE AS diagonal,
+        ST_MakeLine(a.geom,b.geom) AS geom
+    FROM
+        pg_temp.tmp_syn_nodes a,
+        pg_temp.tmp_syn_nodes b
+    WHERE
+        b.i = a.i + 1
+        AND b.j = a.j
+    UNION ALL
+    -- north-south streets take the class of their column
+    SELECT
+        a.node_id,
+        b.node_id,
+        ({col_classes}::TEXT[])[a.i + 1],
+        ({col_bike}::BOOLEAN[])[a.i + 1],
+        ({col_oneway}::BOOLEAN[])[a.i + 1],
+        FALSE,
+        ST_MakeLine(a.geom,b.geom)
+    FROM
+        pg_temp.tmp_syn_nodes a,
+        pg_temp.tmp_syn_nodes b
+    WHERE
+        b.i = a.i
+        AND b.j = a.j + 1
+    UNION ALL
+    -- diagonal local streets
+    SELECT
+        a.node_id,
+        b.node_id,
+        'residential',
+        FALSE,
+        FALSE,
+        TRUE,
+        ST_MakeLine(a.geom,b.geom)
+    FROM
+        pg_temp.tmp_syn_cells c,
+        pg_temp.tmp_syn_nodes a,
+        pg_temp.tmp_syn_nodes b
+    WHERE
+        c.diagonal
+        AND a.i = c.i
+        AND a.j = c.j
+        AND b.i = c.i + 1
+        AND b.j = c.j + 1
+);
+
+-- break up the local grid to create dead ends and superblocks
+DELETE FROM pg_temp.tmp_syn_edges
+WHERE
+    functional_class = 'residential'
+    AND NOT diagonal
+    AND random() < {drop_share};
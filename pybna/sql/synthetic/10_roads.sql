@@ -0,0 +1,88 @@
+--
+-- writes the street edges to the roads table
+--
+CREATE TABLE {roads_schema}.{roads_table} (
+    {roads_id_col} INTEGER PRIMARY KEY,
+    {roads_geom_col} geometry(linestring,{srid}),
+    osmid BIGINT[],
+    functional_class TEXT,
+    path_id INTEGER,
+    {roads_oneway_col} TEXT,
+    {roads_source_col} INTEGER,
+    {roads_target_col} INTEGER,
+    width FLOAT,
+    speed_limit INTEGER,
+    ft_bike_infra TEXT,
+    ft_bike_infra_width FLOAT,
+    tf_bike_infra TEXT,
+    tf_bike_infra_width FLOAT,
+    ft_lanes INTEGER,
+    tf_lanes INTEGER,
+    ft_cross_lanes INTEGER,
+    tf_cross_lanes INTEGER,
+    twltl_cross_lanes INTEGER,
+    ft_park BOOLEAN,
+    tf_park BOOLEAN,
+    {roads_stress_seg_fwd} INTEGER,
+    {roads_stress_cross_fwd} INTEGER,
+    {roads_stress_seg_bwd} INTEGER,
+    {roads_stress_cross_bwd} INTEGER,
+    xwalk INTEGER
+);
+
+INSERT INTO {roads_schema}.{roads_table} (
+    {roads_id_col},
+    {roads_geom_col},
+    functional_class,
+    {roads_oneway_col},
+    {roads_source_col},
+    {roads_target_col},
+    width,
+    speed_limit,
+    ft_bike_infra,
+    ft_bike_infra_width,
+    tf_bike_infra,
+    tf_bike_infra_width,
+    ft_lanes,
+    tf_lanes,
+    ft_park,
+    tf_park
+)
+SELECT
+    row_number() OVER (ORDER BY source, target),
+    geom,
+    functional_class,
+    CASE WHEN oneway THEN {roads_oneway_fwd} END,
+    source,
+    target,
+    CASE functional_class
+        WHEN 'primary' THEN 70
+        WHEN 'secondary' THEN 60
+        WHEN 'tertiary' THEN 44
+        ELSE 36
+        END,
+    CASE functional_class
+        WHEN 'primary' THEN 40
+        WHEN 'secondary' THEN 35
+        WHEN 'tertiary' THEN 30
+        ELSE 25
+        END,
+    CASE WHEN bike THEN 'lane' END,
+    CASE WHEN bike THEN 5 END,
+    CASE WHEN bike AND NOT oneway THEN 'lane' END,
+    CASE WHEN bike AND NOT oneway THEN 5 END,
+    CASE
+        WHEN functional_class IN ('primary','secondary') THEN 2
+        ELSE 1
+        END,
+    CASE
+        WHEN oneway THEN 0
+        WHEN functional_class IN ('primary','secondary') THEN 2
+        ELSE 1
+        END,
+    functional_class != 'primary',
+    functional_class != 'primary' AND NOT oneway
+FROM pg_temp.tmp_syn_edges;
+
+CREATE INDEX {roads_geom_idx} ON {roads_schema}.{roads_table} USING GIST ({roads_geom_col});
+ANALYZE {roads_schema}.{roads_table};
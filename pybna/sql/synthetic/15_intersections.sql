@@ -0,0 +1,33 @@
+--
+-- writes the nodes that have streets to the intersections table, with
+-- signals where arterials meet and stop signs where collectors meet
+--
+CREATE TABLE {ints_schema}.{ints_table} (
+    {ints_id_col} INTEGER PRIMARY KEY,
+    {ints_geom_col} geometry(point,{srid}),
+    control TEXT,
+    island BOOLEAN
+);
+
+INSERT INTO {ints_schema}.{ints_table}
+SELECT
+    n.node_id,
+    n.geom,
+    CASE
+        WHEN ({row_classes}::TEXT[])[n.j + 1] IN ('primary','secondary')
+            AND ({col_classes}::TEXT[])[n.i + 1] IN ('primary','secondary')
+            THEN 'signal'
+        WHEN ({row_classes}::TEXT[])[n.j + 1] IN ('primary','secondary','tertiary')
+            AND ({col_classes}::TEXT[])[n.i + 1] IN ('primary','secondary','tertiary')
+            THEN CASE WHEN random() < 0.5 THEN 'signal' ELSE 'stop' END
+        END,
+    FALSE
+FROM pg_temp.tmp_syn_nodes n
+WHERE EXISTS (
+    SELECT 1
+    FROM pg_temp.tmp_syn_edges e
+    WHERE n.node_id IN (e.source,e.target)
+);
+
+CREATE INDEX {ints_geom_idx} ON {ints_schema}.{ints_table} USING GIST ({ints_geom_col});
+ANALYZE {ints_schema}.{ints_table};
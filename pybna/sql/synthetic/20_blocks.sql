@@ -0,0 +1,56 @@
+--
+-- writes the grid cells to the census blocks table (cells with a diagonal
+-- street become two blocks) with population concentrated away from the
+-- center of the city
+--
+CREATE TABLE {blocks_schema}.{blocks_table} (
+    {blocks_id_col} TEXT PRIMARY KEY,
+    {blocks_population_col} INTEGER,
+    {blocks_geom_col} geometry(multipolygon,{srid})
+);
+
+DROP TABLE IF EXISTS pg_temp.tmp_syn_blocks;
+CREATE TEMP TABLE pg_temp.tmp_syn_blocks AS (
+    SELECT
+        c.i,
+        c.j,
+        0 AS part,
+        ST_MakePolygon(ST_MakeLine(ARRAY[n00.geom,n10.geom,n11.geom,n01.geom,n00.geom])) AS geom
+    FROM
+        pg_temp.tmp_syn_cells c
+        JOIN pg_temp.tmp_syn_nodes n00 ON n00.i = c.i AND n00.j = c.j
+        JOIN pg_temp.tmp_syn_nodes n10 ON n10.i = c.i + 1 AND n10.j = c.j
+        JOIN pg_temp.tmp_syn_nodes n11 ON n11.i = c.i + 1 AND n11.j = c.j + 1
+        JOIN pg_temp.tmp_syn_nodes n01 ON n01.i = c.i AND n01.j = c.j + 1
+    WHERE NOT c.diagonal
+    UNION ALL
+    SELECT
+        c.i,
+        c.j,
+        part,
+        CASE part
+            WHEN 1 THEN ST_MakePolygon(ST_MakeLine(ARRAY[n00.geom,n10.geom,n11.geom,n00.geom]))
+            ELSE ST_MakePolygon(ST_MakeLine(ARRAY[n00.geom,n11.geom,n01.geom,n00.geom]))
+            END
+    FROM
+        pg_temp.tmp_syn_cells c
+        JOIN pg_temp.tmp_syn_nodes n00 ON n00.i = c.i AND n00.j = c.j
+        JOIN pg_temp.tmp_syn_nodes n10 ON n10.i = c.i + 1 AND n10.j = c.j
+        JOIN pg_temp.tmp_syn_nodes n11 ON n11.i = c.i + 1 AND n11.j = c.j + 1
+        JOIN pg_temp.tmp_syn_nodes n01 ON n01.i = c.i AND n01.j = c.j + 1,
+        generate_series(1,2) part
+    WHERE c.diagonal
+);
+
+INSERT INTO {blocks_schema}.{blocks_table}
+SELECT
+    lpad((row_number() OVER (ORDER BY i, j, part))::TEXT,15,'0'),
+    floor(
+        random() * 120
+        * LEAST(1, 0.2 + ST_Distance(ST_Centroid(geom),ST_SetSRID(ST_MakePoint({center_x},{center_y}),{srid})) / {radius})
+    )::INTEGER,
+    ST_Multi(geom)
+FROM pg_temp.tmp_syn_blocks;
+
+CREATE INDEX {blocks_geom_idx} ON {blocks_schema}.{blocks_table} USING GIST ({blocks_geom_col});
+ANALYZE {blocks_schema}.{blocks_table};
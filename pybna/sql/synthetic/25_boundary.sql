@@ -0,0 +1,11 @@
+--
+-- writes the extent of the city to the boundary table
+--
+CREATE TABLE {boundary_schema}.{boundary_table} (
+    id SERIAL PRIMARY KEY,
+    {boundary_geom_col} geometry(multipolygon,{srid})
+);
+
+INSERT INTO {boundary_schema}.{boundary_table} ({boundary_geom_col})
+SELECT ST_Multi(ST_SetSRID(ST_Expand(ST_Extent(geom)::geometry,1),{srid}))
+FROM pg_temp.tmp_syn_nodes;
@@ -0,0 +1,17 @@
+--
+-- writes a per-block value (e.g. jobs) for a percentage-based destination,
+-- concentrated toward the center of the city
+--
+CREATE TABLE {destinations_schema}.{destinations_table} (
+    {destinations_id_col} TEXT PRIMARY KEY,
+    {val} INTEGER
+);
+
+INSERT INTO {destinations_schema}.{destinations_table}
+SELECT
+    {blocks_id_col},
+    floor(
+        power(random(),3) * 500
+        * GREATEST(0.05, 1 - ST_Distance(ST_Centroid({blocks_geom_col}),ST_SetSRID(ST_MakePoint({center_x},{center_y}),{srid})) / {radius})
+    )::INTEGER
+FROM {blocks_schema}.{blocks_table};
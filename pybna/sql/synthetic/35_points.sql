@@ -0,0 +1,17 @@
+--
+-- writes destination points for a count-based destination, each placed in
+-- a randomly selected block
+--
+CREATE TABLE {destinations_schema}.{destinations_table} (
+    {destinations_id_col} SERIAL PRIMARY KEY,
+    {destinations_geom_col} geometry(point,{srid})
+);
+
+INSERT INTO {destinations_schema}.{destinations_table} ({destinations_geom_col})
+SELECT ST_PointOnSurface(geom)
+FROM pg_temp.tmp_syn_blocks
+ORDER BY random()
+LIMIT {count};
+
+CREATE INDEX {destinations_geom_idx} ON {destinations_schema}.{destinations_table} USING GIST ({destinations_geom_col});
+ANALYZE {destinations_schema}.{destinations_table};
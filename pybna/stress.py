@@ -11,6 +11,7 @@ import pandas as pd
 
 from .conf import Conf
 from .dbutils import DBUtils
+from .telemetry import phase
 from .core import FORWARD_DIRECTION
 from .core import BACKWARD_DIRECTION
 
@@ -241,6 +242,7 @@ class Stress(Conf):
         conn.close()
 
 
+    @phase("segment_stress")
     def segment_stress(self,table=None,table_filter=None,dry=None):
         """
         Creates a new table of LTS scores for each direction (forward/backward).
@@ -436,6 +438,7 @@ class Stress(Conf):
         self._run_sql_script("path.sql",subs,dirs=["sql","stress","segment"],conn=conn)
 
 
+    @phase("crossing_stress")
     def crossing_stress(self,table=None,angle=20,table_filter=None,dry=None):
         """
         Calculates stress for crossings
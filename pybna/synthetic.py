@@ -0,0 +1,263 @@
+###################################################################
+# Generates a synthetic city (roads, intersections, census blocks,
+# and destinations) for testing and benchmarking pyBNA without
+# real-world data
+###################################################################
+import os
+import yaml
+import random
+from psycopg2 import sql
+
+from .conf import Conf
+from .dbutils import DBUtils
+
+
+FUNCTIONAL_CLASSES = ["primary","secondary","tertiary","residential"]
+
+
+class SyntheticCity(Conf):
+    """Standalone class to generate synthetic pyBNA datasets"""
+
+    def __init__(self, config=None, verbose=False, debug=False,
+                 host=None, db_name=None, user=None, password=None):
+        """
+        Reads the config file and sets up a connection to the database. The
+        generated data is written to the tables named in the config file, so
+        the same config can then be used to run pyBNA on the synthetic city.
+
+        Parameters
+        ----------
+        config : str, optional
+            path to the config file
+        verbose : bool, optional
+            output useful messages
+        debug : bool, optional
+            set to debug mode
+        host : str, optional
+            hostname or address (overrides the config file if given)
+        db : str, optional
+            name of database on server (overrides the config file if given)
+        user : str, optional
+            username to connect to database (overrides the config file if given)
+        password : str, optional
+            password to connect to database (overrides the config file if given)
+        """
+        Conf.__init__(self)
+        self.verbose = verbose
+        self.debug = debug
+        self.module_dir = os.path.dirname(os.path.abspath(__file__))
+        if config is None:
+            config = os.path.join(self.module_dir,"config.yaml")
+        self.config = self.parse_config(yaml.safe_load(open(config)))
+        print("Connecting to database")
+        if host is None:
+            host = self.config.db.host
+        if db_name is None:
+            db_name = self.config.db.dbname
+        if user is None:
+            user = self.config.db.user
+        if password is None:
+            password = self.config.db.password
+        db_connection_string = " ".join([
+            "dbname=" + db_name,
+            "user=" + user,
+            "host=" + host,
+            "password=" + password
+        ])
+        if self.debug:
+            print("DB connection: {}".format(db_connection_string))
+        DBUtils.__init__(self,db_connection_string,self.verbose,self.debug)
+        self.sql_subs = self.make_bna_substitutions(self.config)
+
+
+    def __repr__(self):
+        return "pyBNA SyntheticCity connected with {%s}" % self.db_connection_string
+
+
+    def generate(self,size=20,block_length=120,irregularity=0.2,stress_mix=None,
+                 bike_lane_share=0.2,oneway_share=0.1,destination_density=0.02,
+                 origin=(0,0),seed=None,overwrite=False):
+        """
+        Generates a square city of size x size blocks and writes the
+        boundary, roads, intersections, census blocks, and destinations to
+        the tables named in the config. Streets are laid out as a grid with
+        each east-west row and north-south column assigned a functional class
+        (so arterials form continuous corridors). Irregularity jitters the
+        intersections, removes some local street segments, and adds some
+        diagonal streets.
+
+        Any network tables left from a previous city are dropped so that
+        pyBNA rebuilds them.
+
+        Parameters
+        ----------
+        size : int, optional
+            number of blocks along each side of the city
+        block_length : float, optional
+            spacing between streets (in the units of the projection)
+        irregularity : float, optional
+            between 0 (a perfect grid) and 1
+        stress_mix : dict, optional
+            share of streets in each functional class, e.g.
+            {"primary": 0.1, "secondary": 0.1, "tertiary": 0.2, "residential": 0.6}
+        bike_lane_share : float, optional
+            share of non-residential streets with bike lanes
+        oneway_share : float, optional
+            share of non-arterial streets that are one-way
+        destination_density : float, optional
+            number of destinations per block for count-based destinations
+        origin : tuple, optional
+            coordinates of the southwest corner of the city
+        seed : int, optional
+            random seed (the same seed and options produce the same city)
+        overwrite : bool, optional
+            whether to overwrite existing tables
+        """
+        if stress_mix is None:
+            stress_mix = {
+                "primary": 0.08,
+                "secondary": 0.12,
+                "tertiary": 0.15,
+                "residential": 0.65
+            }
+        for k in stress_mix:
+            if k not in FUNCTIONAL_CLASSES:
+                raise ValueError("Unknown functional class {} in stress mix".format(k))
+        if not 0 <= irregularity <= 1:
+            raise ValueError("Irregularity must be between 0 and 1")
+        if seed is None:
+            seed = random.randint(0,1000000)
+
+        # assign a class to each row and column of the grid
+        rng = random.Random(seed)
+        classes = list(stress_mix.keys())
+        weights = [stress_mix[k] for k in classes]
+        lines = dict()
+        for axis in ["row","col"]:
+            lines[axis] = {
+                "classes": rng.choices(classes,weights=weights,k=size+1),
+                "bike": list(),
+                "oneway": list()
+            }
+            for c in lines[axis]["classes"]:
+                lines[axis]["bike"].append(c != "residential" and rng.random() < bike_lane_share)
+                lines[axis]["oneway"].append(c in ("tertiary","residential") and rng.random() < oneway_share)
+
+        subs = dict(self.sql_subs)
+        subs["seed"] = sql.Literal(float(seed % 1000000)/1000000)
+        subs["size"] = sql.Literal(size)
+        subs["block_length"] = sql.Literal(block_length)
+        subs["jitter"] = sql.Literal(0.25*irregularity*block_length)
+        subs["drop_share"] = sql.Literal(0.25*irregularity)
+        subs["diagonal_share"] = sql.Literal(0.1*irregularity)
+        subs["origin_x"] = sql.Literal(origin[0])
+        subs["origin_y"] = sql.Literal(origin[1])
+        subs["center_x"] = sql.Literal(origin[0] + size*block_length/2)
+        subs["center_y"] = sql.Literal(origin[1] + size*block_length/2)
+        subs["radius"] = sql.Literal(size*block_length/2)
+        for axis in ["row","col"]:
+            subs[axis+"_classes"] = sql.Literal(lines[axis]["classes"])
+            subs[axis+"_bike"] = sql.Literal(lines[axis]["bike"])
+            subs[axis+"_oneway"] = sql.Literal(lines[axis]["oneway"])
+        subs["roads_geom_idx"] = sql.Identifier("sidx_"+self.sql_subs["roads_table"].string)
+        subs["ints_geom_idx"] = sql.Identifier("sidx_"+self.sql_subs["ints_table"].string)
+        subs["blocks_geom_idx"] = sql.Identifier("sidx_"+self.sql_subs["blocks_table"].string)
+
+        # destinations
+        default_schema = self.get_default_schema()
+        block_values = list()
+        points = list()
+        for dest in self._destination_configs(self.config.bna.destinations):
+            if "table" not in dest:
+                continue
+            schema, table = self.parse_table_name(dest.table)
+            if table == subs["blocks_table"].string and schema in (None,subs["blocks_schema"].string):
+                continue
+            if schema is None:
+                schema = default_schema
+            if dest.method == "percentage":
+                block_values.append((dest,schema,table))
+            elif dest.method == "count":
+                points.append((dest,schema,table))
+
+        conn = self.get_db_connection()
+        tables = [
+            (subs["boundary_schema"].string,subs["boundary_table"].string),
+            (subs["roads_schema"].string,subs["roads_table"].string),
+            (subs["ints_schema"].string,subs["ints_table"].string),
+            (subs["blocks_schema"].string,subs["blocks_table"].string)
+        ]
+        tables.extend([(schema,table) for dest, schema, table in block_values + points])
+        for schema, table in tables:
+            if self.table_exists(table,schema):
+                if overwrite:
+                    self.drop_table(table,schema,conn=conn)
+                else:
+                    conn.close()
+                    raise ValueError("Table {}.{} already exists".format(schema,table))
+            self._run_sql(
+                "CREATE SCHEMA IF NOT EXISTS {schema}",
+                {"schema": sql.Identifier(schema)},
+                conn=conn
+            )
+        for schema, table in [
+            (subs["edges_schema"].string,subs["edges_table"].string),
+            (subs["edges_schema"].string,subs["edges_contracted_table"].string),
+            (subs["nodes_schema"].string,subs["nodes_table"].string)
+        ]:
+            self.drop_table(table,schema,conn=conn)
+
+        print("Laying out streets")
+        self._run_sql_script("01_grid.sql",subs,["sql","synthetic"],conn=conn)
+        print("Writing roads and intersections")
+        self._run_sql_script("10_roads.sql",subs,["sql","synthetic"],conn=conn)
+        self._run_sql_script("15_intersections.sql",subs,["sql","synthetic"],conn=conn)
+        print("Writing census blocks")
+        self._run_sql_script("20_blocks.sql",subs,["sql","synthetic"],conn=conn)
+        self._run_sql_script("25_boundary.sql",subs,["sql","synthetic"],conn=conn)
+
+        print("Writing destinations")
+        for dest, schema, table in block_values:
+            dest_subs = dict(subs)
+            dest_subs["destinations_schema"] = sql.Identifier(schema)
+            dest_subs["destinations_table"] = sql.Identifier(table)
+            dest_subs["destinations_id_col"] = sql.Identifier(dest.get("uid",subs["blocks_id_col"].string))
+            dest_subs["val"] = sql.Identifier(dest.datafield)
+            self._run_sql_script("30_block_values.sql",dest_subs,["sql","synthetic"],conn=conn)
+        for dest, schema, table in points:
+            geom = dest.get("geom","geom")
+            if not isinstance(geom,str):
+                geom = geom[0]
+            dest_subs = dict(subs)
+            dest_subs["destinations_schema"] = sql.Identifier(schema)
+            dest_subs["destinations_table"] = sql.Identifier(table)
+            dest_subs["destinations_id_col"] = sql.Identifier(dest.get("uid","id"))
+            dest_subs["destinations_geom_col"] = sql.Identifier(geom)
+            dest_subs["destinations_geom_idx"] = sql.Identifier("sidx_"+table)
+            dest_subs["count"] = sql.Literal(max(1,int(round(destination_density*size*size))))
+            self._run_sql_script("35_points.sql",dest_subs,["sql","synthetic"],conn=conn)
+
+        conn.commit()
+        conn.close()
+
+
+    def _destination_configs(self,destinations):
+        """
+        Flattens the destination categories from the config into a list that
+        includes subcategories
+
+        Parameters
+        ----------
+        destinations : list
+            list of destination configs
+
+        returns:
+        list of destination configs
+        """
+        flat = list()
+        for v in destinations:
+            dest = self.parse_config(v)
+            flat.append(dest)
+            if "subcats" in dest:
+                flat.extend(self._destination_configs(dest.subcats))
+        return flat
@@ -0,0 +1,122 @@
+###################################################################
+# Helpers for consuming pyBNA progress events programmatically.
+# See DBUtils.add_event_callback for the events that are emitted.
+###################################################################
+import json
+import time
+import functools
+from collections import deque
+
+
+def phase(name):
+    """
+    Decorator that wraps a pyBNA method in a named phase so that phase_start
+    and phase_end events are emitted around it
+
+    Parameters
+    ----------
+    name : str
+        name of the phase
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self,*args,**kwargs):
+            with self._phase(name):
+                return method(self,*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+class JSONLinesSink:
+    """Event callback that appends each event to a file as a line of JSON"""
+
+    def __init__(self,path,flush=True):
+        """
+        Parameters
+        ----------
+        path : str
+            file to append events to
+        flush : bool, optional
+            flush after every event so the file can be followed while a run is
+            in progress
+        """
+        self.path = path
+        self.flush = flush
+        self._file = open(path,"a")
+
+
+    def __call__(self,event):
+        self._file.write(json.dumps(event,default=str))
+        self._file.write("\n")
+        if self.flush:
+            self._file.flush()
+
+
+    def close(self):
+        self._file.close()
+
+
+class ProgressTracker:
+    """Tracks throughput and estimated time remaining for a run of blocks"""
+
+    def __init__(self,total,window=50,slowdown_ratio=0.5):
+        """
+        Parameters
+        ----------
+        total : int
+            number of blocks in the run
+        window : int, optional
+            number of recent blocks used to measure the current rate
+        slowdown_ratio : float, optional
+            report a slowdown when the recent rate falls below this share of
+            the average rate for the run
+        """
+        self.total = total
+        self.done = 0
+        self.start = time.time()
+        self.slowdown_ratio = slowdown_ratio
+        self._recent = deque(maxlen=window)
+        self._slow = False
+
+
+    def update(self,n=1):
+        """
+        Records finished blocks and returns a dictionary of progress details:
+        done, total, rate and recent_rate (blocks per second), eta (seconds),
+        and slowdown (True the first time the recent rate drops below the
+        slowdown ratio, until it recovers)
+
+        Parameters
+        ----------
+        n : int, optional
+            number of blocks finished
+        """
+        now = time.time()
+        self.done += n
+        self._recent.append(now)
+
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else None
+        recent_rate = None
+        if len(self._recent) > 1 and self._recent[-1] > self._recent[0]:
+            recent_rate = (len(self._recent)-1) / (self._recent[-1] - self._recent[0])
+
+        if rate:
+            eta = (self.total - self.done) / rate
+        else:
+            eta = None
+
+        slowdown = False
+        if rate and recent_rate is not None and len(self._recent) == self._recent.maxlen:
+            slow = recent_rate < self.slowdown_ratio * rate
+            slowdown = slow and not self._slow
+            self._slow = slow
+
+        return {
+            "done": self.done,
+            "total": self.total,
+            "rate": rate,
+            "recent_rate": recent_rate,
+            "eta": eta,
+            "slowdown": slowdown
+        }
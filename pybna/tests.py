@@ -2,11 +2,15 @@
 # Methods for testing various parts of the pyBNA library
 #
 import os, random, string
+import time
+import shutil
 import tempfile
 import yaml
 from psycopg2 import sql
 from .stress import Stress
 from .dbutils import DBUtils
+from .pybna import pyBNA
+from .synthetic import SyntheticCity
 import pandas as pd
 
 def test_segment_stress(out_file=None,config=None,host=None,db_name=None,user=None,
@@ -348,3 +352,423 @@ def test_crossing_stress(out_file=None,config=None,host=None,db_name=None,user=N
         result.to_excel(out_file)
     else:
         return result
+
+
+def test_connectivity_engines(engines=None,size=12,seed=0,concurrency=4,
+                              check=True,config=None,host=None,db_name=None,
+                              user=None,password=None):
+    """
+    Runs connectivity with the pgRouting reference and with each alternative
+    engine or network storage format on the same network and compares the
+    results. The high stress and low stress pair sets must be identical. By
+    default a synthetic city is generated first.
+
+    pgRouting only routes on the edges within the search distance of each
+    block while the python engines search the whole network (see
+    Connectivity._router_cost_steps). The python engines are therefore
+    compared with a second pgRouting run whose network subset is widened by
+    the length of the longest road, which holds every edge a route within
+    the search distance can use. The pgrouting_unbounded row reports how
+    many pairs the narrower subset changes; it isn't checked.
+
+    WARNING: this overwrites the tables named in the config file. Only run it
+    against a throwaway database with PostGIS and pgRouting installed.
+
+    Engines are:
+        python: in-process routing from the edges table
+        python_async: in-process routing with concurrent blocks
+        pgrouting_async: pgRouting with concurrent blocks
+        snapshot: in-process routing from a binary network snapshot
+        contracted: in-process routing on the contracted network
+        hierarchy: in-process routing with contraction hierarchies
+
+    Parameters
+    ----------
+    engines : list, optional
+        engines to test (if none test all of them)
+    size : int, optional
+        size of the synthetic city (if none use the existing data)
+    seed : int, optional
+        random seed for the synthetic city
+    concurrency : int, optional
+        concurrency for the async engines
+    check : bool, optional
+        raise an AssertionError if any engine doesn't match the reference
+    config : str, optional
+        path to the config file, if not given use the default config.yaml
+    host : str, optional
+        host to connect to
+    db_name : str, optional
+        database name
+    user : str, optional
+        database user
+    password : str, optional
+        database password
+
+    Returns
+    -------
+    pandas DataFrame with the time, speedup, and any differing pairs for
+    each engine
+    """
+    db = {"host": host, "db_name": db_name, "user": user, "password": password}
+    if size is not None:
+        city = SyntheticCity(config=config,**db)
+        city.generate(size=size,seed=seed,overwrite=True)
+        stress = Stress(config=config,**db)
+        stress.segment_stress()
+        stress.crossing_stress()
+    bna = pyBNA(config=config,force_net_build=size is not None,**db)
+    bna.config.bna.network.pop("snapshot",None)
+    bna.config.bna.connectivity.pop("hierarchy",None)
+    contracted_table = bna.sql_subs["edges_contracted_table"].string
+    edges_schema = bna.sql_subs["edges_schema"].string
+    bna.drop_table(contracted_table,edges_schema)
+
+    # pgRouting subset wide enough to match the python engines
+    max_distance = bna.config.bna.connectivity.max_distance
+    if bna.config.bna.connectivity.get("bands"):
+        max_distance = max(float(b) for b in bna.config.bna.connectivity.bands)
+    longest_road = bna._run_sql(
+        "SELECT MAX(ST_Length({roads_geom_col})) FROM {roads_schema}.{roads_table}",
+        bna.sql_subs,
+        ret=True
+    )[0][0]
+    unbounded_subs = dict(bna.sql_subs)
+    unbounded_subs["network_subset_distance"] = sql.Literal(max_distance+(longest_road or 0))
+
+    tmpdir = tempfile.mkdtemp()
+    schema = bna.sql_subs["connectivity_schema"].string
+    prefix = "".join(random.choice(string.ascii_lowercase) for i in range(7))
+
+    def setup_snapshot():
+        bna.config.bna.network["snapshot"] = os.path.join(tmpdir,"snapshot")
+        bna.write_network_snapshot()
+    def teardown_snapshot():
+        bna.config.bna.network.pop("snapshot")
+    def setup_hierarchy():
+        bna.config.bna.connectivity["hierarchy"] = os.path.join(tmpdir,"hierarchy")
+        bna.build_routing_hierarchy()
+    def teardown_hierarchy():
+        bna.config.bna.connectivity.pop("hierarchy")
+
+    variants = [
+        ("python",{"engine": "python"},None,None),
+        ("python_async",{"engine": "python", "concurrency": concurrency},None,None),
+        ("pgrouting_async",{"engine": "pgrouting", "concurrency": concurrency},None,None),
+        ("snapshot",{"engine": "python"},setup_snapshot,teardown_snapshot),
+        ("contracted",{"engine": "python"},lambda: bna.build_network(contract=True),lambda: bna.drop_table(contracted_table,edges_schema)),
+        ("hierarchy",{"engine": "python"},setup_hierarchy,teardown_hierarchy)
+    ]
+    if engines is not None:
+        for engine in engines:
+            if engine not in [v[0] for v in variants]:
+                raise ValueError("Unknown engine {}".format(engine))
+        variants = [v for v in variants if v[0] in engines]
+
+    def run(name,kwargs):
+        table = schema + "." + prefix + "_" + name
+        start = time.time()
+        bna._calculate_connectivity(connectivity_table=table,**kwargs)
+        return table, time.time() - start
+
+    results = list()
+    tables = list()
+    try:
+        reference, reference_time = run("pgrouting",{"engine": "pgrouting"})
+        tables.append(reference)
+        results.append({
+            "engine": "pgrouting",
+            "setup": 0.0,
+            "time": reference_time,
+            "speedup": 1.0
+        })
+        unbounded, unbounded_time = run("pgrouting_unbounded",{"engine": "pgrouting", "subs": unbounded_subs})
+        tables.append(unbounded)
+        result = {
+            "engine": "pgrouting_unbounded",
+            "setup": 0.0,
+            "time": unbounded_time,
+            "speedup": reference_time/unbounded_time if unbounded_time > 0 else None
+        }
+        result.update(_compare_connectivity(bna,reference,unbounded))
+        results.append(result)
+        for name, kwargs, setup, teardown in variants:
+            start = time.time()
+            if setup is not None:
+                setup()
+            setup_time = time.time() - start
+            try:
+                table, run_time = run(name,kwargs)
+                tables.append(table)
+            finally:
+                if teardown is not None:
+                    teardown()
+            result = {
+                "engine": name,
+                "setup": setup_time,
+                "time": run_time,
+                "speedup": reference_time/run_time if run_time > 0 else None
+            }
+            if kwargs["engine"] == "python":
+                result.update(_compare_connectivity(bna,unbounded,table))
+            else:
+                result.update(_compare_connectivity(bna,reference,table))
+            results.append(result)
+    finally:
+        conn = bna.get_db_connection()
+        for table in tables:
+            bna.drop_table(table,conn=conn)
+        conn.commit()
+        conn.close()
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+    results = pd.DataFrame(results).set_index("engine")
+    print(results)
+
+    if check:
+        diff_cols = ["high_stress_missing","high_stress_extra","low_stress_missing","low_stress_extra"]
+        checked = results.drop("pgrouting_unbounded")
+        mismatched = checked[checked[diff_cols].fillna(0).sum(axis=1) > 0]
+        if len(mismatched) > 0:
+            raise AssertionError("Connectivity differs from pgRouting for: {}".format(
+                ", ".join(mismatched.index)
+            ))
+    return results
+
+
+def _compare_connectivity(db,reference,table):
+    """
+    Counts the high stress and low stress pairs in table that are missing
+    from or extra to the reference connectivity table
+
+    Parameters
+    ----------
+    db : pyBNA
+        pyBNA object
+    reference : str
+        the reference connectivity table (schema-qualified)
+    table : str
+        the connectivity table to compare (schema-qualified)
+
+    Returns
+    -------
+    dict
+    """
+    ref_schema, ref_table = db.parse_table_name(reference)
+    schema, table = db.parse_table_name(table)
+    subs = {
+        "ref_schema": sql.Identifier(ref_schema),
+        "ref_table": sql.Identifier(ref_table),
+        "schema": sql.Identifier(schema),
+        "table": sql.Identifier(table),
+        "source": db.sql_subs["connectivity_source_col"],
+        "target": db.sql_subs["connectivity_target_col"]
+    }
+    conn = db.get_db_connection()
+    counts = db._run_sql(
+        """
+            SELECT
+                (
+                    SELECT COUNT(*) FROM (
+                        SELECT {source}, {target} FROM {ref_schema}.{ref_table} WHERE high_stress
+                        EXCEPT
+                        SELECT {source}, {target} FROM {schema}.{table} WHERE high_stress
+                    ) x
+                ),
+                (
+                    SELECT COUNT(*) FROM (
+                        SELECT {source}, {target} FROM {schema}.{table} WHERE high_stress
+                        EXCEPT
+                        SELECT {source}, {target} FROM {ref_schema}.{ref_table} WHERE high_stress
+                    ) x
+                ),
+                (
+                    SELECT COUNT(*) FROM (
+                        SELECT {source}, {target} FROM {ref_schema}.{ref_table} WHERE low_stress
+                        EXCEPT
+                        SELECT {source}, {target} FROM {schema}.{table} WHERE low_stress
+                    ) x
+                ),
+                (
+                    SELECT COUNT(*) FROM (
+                        SELECT {source}, {target} FROM {schema}.{table} WHERE low_stress
+                        EXCEPT
+                        SELECT {source}, {target} FROM {ref_schema}.{ref_table} WHERE low_stress
+                    ) x
+                ),
+                (SELECT COUNT(*) FROM {schema}.{table})
+        """,
+        subs,
+        ret=True,
+        conn=conn
+    )[0]
+    conn.close()
+    return {
+        "pairs": counts[4],
+        "high_stress_missing": counts[0],
+        "high_stress_extra": counts[1],
+        "low_stress_missing": counts[2],
+        "low_stress_extra": counts[3]
+    }
+
+
+def test_break_scores(categories=None,max_total=None,repeat=3,tolerance=1e-9,
+                      check=True,config=None,host=None,db_name=None,user=None,
+                      password=None):
+    """
+    Compares the bna_break_score SQL function used by calculate_score with
+    the CASE statement built by DestinationCategory._concat_case for each
+    scored destination category. Both are evaluated over a grid of high and
+    low stress totals (including NULLs) and timed.
+
+    Parameters
+    ----------
+    categories : list, optional
+        destination categories to test (if none test all of them)
+    max_total : int, optional
+        largest high stress total in the grid (if none use twice the top break
+        for count-based categories and 100 for percentage-based categories)
+    repeat : int, optional
+        number of times to time each version
+    tolerance : float, optional
+        largest difference allowed between the two scores
+    check : bool, optional
+        raise an AssertionError if any category's scores differ
+    config : str, optional
+        path to the config file, if not given use the default config.yaml
+    host : str, optional
+        host to connect to
+    db_name : str, optional
+        database name
+    user : str, optional
+        database user
+    password : str, optional
+        database password
+
+    Returns
+    -------
+    pandas DataFrame with the number of rows, mismatches, and the best time
+    of each version for each category
+    """
+    bna = pyBNA(config=config,host=host,db_name=db_name,user=user,password=password)
+    conn = bna.get_db_connection()
+    for destination in bna.destinations.values():
+        if destination.has_count:
+            destination.install_break_score(conn)
+            break
+
+    results = list()
+    for name, destination in bna.destinations.items():
+        if categories is not None and name not in categories:
+            continue
+        if not destination.has_count or "breaks" not in destination.config:
+            continue
+        result = {"category": name}
+        result.update(_compare_break_scores(bna,destination,conn,max_total,repeat,tolerance))
+        results.append(result)
+    conn.rollback()
+    conn.close()
+
+    results = pd.DataFrame(results).set_index("category")
+    print(results)
+
+    if check:
+        mismatched = results[results["mismatches"] > 0]
+        if len(mismatched) > 0:
+            raise AssertionError("bna_break_score differs from the CASE statement for: {}".format(
+                ", ".join(mismatched.index)
+            ))
+    return results
+
+
+def _compare_break_scores(db,destination,conn,max_total=None,repeat=3,tolerance=1e-9):
+    """
+    Scores a grid of high and low stress totals for one destination category
+    with both the CASE statement and bna_break_score
+
+    Parameters
+    ----------
+    db : pyBNA
+        pyBNA object
+    destination : DestinationCategory
+        the category to score
+    conn : psycopg2 connection object
+        a connection with bna_break_score installed
+    max_total : int, optional
+        largest high stress total in the grid
+    repeat : int, optional
+        number of times to time each version
+    tolerance : float, optional
+        largest difference allowed between the two scores
+
+    Returns
+    -------
+    dict
+    """
+    if max_total is None:
+        if destination.config.method == "count":
+            max_total = int(2*max(destination.config.breaks.keys())) + 2
+        else:
+            max_total = 100
+    subs = {
+        "max_total": sql.Literal(max_total),
+        "total_type": sql.SQL("BIGINT" if destination.config.method == "count" else "FLOAT8"),
+        "case": destination._concat_case("hs","ls"),
+        "score_function": destination._break_score_call("hs","ls"),
+        "tolerance": sql.Literal(tolerance)
+    }
+    db._run_sql(
+        """
+            DROP TABLE IF EXISTS pg_temp.tmp_break_grid;
+            CREATE TEMP TABLE tmp_break_grid AS (
+                SELECT hs::{total_type} AS hs, ls::{total_type} AS ls
+                FROM
+                    generate_series(0,{max_total}) hs,
+                    generate_series(0,hs) ls
+                UNION ALL
+                SELECT NULL, g::{total_type} FROM generate_series(0,{max_total}) g
+                UNION ALL
+                SELECT g::{total_type}, NULL FROM generate_series(0,{max_total}) g
+                UNION ALL
+                SELECT NULL, NULL
+            );
+        """,
+        subs,
+        conn=conn
+    )
+    counts = db._run_sql(
+        """
+            SELECT
+                COUNT(*),
+                COUNT(*) FILTER (
+                    WHERE (case_score IS NULL) <> (function_score IS NULL)
+                    OR abs(case_score - function_score) > {tolerance}
+                )
+            FROM (
+                SELECT {case} AS case_score, {score_function} AS function_score
+                FROM pg_temp.tmp_break_grid
+            ) x
+        """,
+        subs,
+        ret=True,
+        conn=conn
+    )[0]
+
+    timings = dict()
+    for version in ["case","score_function"]:
+        query = "SELECT SUM({" + version + "}) FROM pg_temp.tmp_break_grid"
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            db._run_sql(query,subs,ret=True,conn=conn)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        timings[version] = best
+
+    return {
+        "rows": counts[0],
+        "mismatches": counts[1],
+        "case_time": timings["case"],
+        "function_time": timings["score_function"]
+    }
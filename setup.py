@@ -36,6 +36,7 @@ setup(
     package_data={"": package_files(root,[".csv",".xlsx",".sql",".yaml",".zip"])},
     install_requires=[
         "packaging",
+        "numpy",
         "pandas",
         "geopandas",
         "psycopg2-binary",
@@ -45,5 +46,8 @@ setup(
         "osmnx",
         "overpass",
         "xlrd"
-    ]
+    ],
+    extras_require={
+        "sparse": ["scipy"]
+    }
 )